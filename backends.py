@@ -0,0 +1,446 @@
+import asyncio
+import copy
+import functools
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Type
+import requests
+
+from endpoint_pool import EndpointPool
+from http_client import build_session
+from metrics import record_failure, record_response
+from prompts import (PrefixLayout, build_batch_prompt, build_glossary_prompt, build_system_prompt, estimate_messages_tokens,
+                     parse_batch_response)
+from rate_limit import RequestScheduler
+from streaming import THINK_CLOSE, THINK_OPEN, ThinkFilter, consume_ollama_stream, consume_openai_stream
+from subtitle import SubtitleBlock, estimate_tokens
+from validation import FAILED_MARKER
+
+@dataclass
+class ModelConfigOpenAI:
+    api_url: str = "https://api.siliconflow.cn/v1"
+    model_id: str = "deepseek-ai/DeepSeek-V3"  # 强制指定模型[^1]
+    api_key: str = "YOUR_API_KEY"
+    headers: dict = None
+    stream: bool = False            # 流式响应开关（SSE）
+    max_think_tokens: Optional[int] = None   # 流式响应中推理内容的token上限，超出即中断
+    max_stream_tokens: Optional[int] = None  # 流式响应的总token上限，超出即中断
+    pool_connections: int = 4       # 连接池缓存的主机数
+    pool_maxsize: int = 16          # 每个主机的最大连接数
+    connect_timeout: float = 10     # 建立连接超时（秒）
+    read_timeout: float = 30        # 读取响应超时（秒）
+    rpm: Optional[float] = None     # 每分钟请求数上限，None为不限（遇到429后自动收紧）
+    tpm: Optional[float] = None     # 每分钟token数上限，None为不限
+    max_retries: int = 5            # 单次请求最大重试次数
+    session: requests.Session = field(default=None, repr=False, compare=False)  # 复用连接的HTTP会话
+    scheduler: RequestScheduler = field(default=None, repr=False, compare=False)  # 共享的限速重试调度器
+    
+    def __post_init__(self):
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        self.session = self.session or build_session(self.pool_connections, self.pool_maxsize)
+        self.scheduler = self.scheduler or RequestScheduler(self.rpm, self.tpm, self.max_retries)
+
+@dataclass
+class ModelConfigOllama:
+    """Ollama专用配置类"""
+    api_url: str = "http://localhost:11434"  # 默认本地地址[^1]
+    model_id: str = "llama3.2"  # 必须指定模型名称[^1]
+    num_ctx: int = 4096         # 上下文窗口大小[^3]
+    temperature: float = 0.3    # 输出随机性控制[^1]
+    top_p: float = 0.9          # Top-p采样参数[^1]
+    stream: bool = False        # 流式响应开关[^1]
+    keep_alive: str = "5m"      # 模型内存驻留时间[^1]
+    headers: dict = None        # 自定义请求头
+    max_think_tokens: Optional[int] = None   # 流式响应中<think>段的token上限，超出即中断
+    max_stream_tokens: Optional[int] = None  # 流式响应的总token上限，超出即中断
+    pool_connections: int = 4   # 连接池缓存的主机数
+    pool_maxsize: int = 16      # 每个主机的最大连接数
+    connect_timeout: float = 10 # 建立连接超时（秒）
+    read_timeout: float = 60    # 读取响应超时（秒）
+    rpm: Optional[float] = None # 每分钟请求数上限，None为不限
+    tpm: Optional[float] = None # 每分钟token数上限，None为不限
+    max_retries: int = 3        # 单次请求最大重试次数
+    api_urls: Optional[List[str]] = None        # 多台服务的地址列表，设置后忽略api_url，按负载分发请求
+    max_in_flight_per_host: Optional[int] = None  # 每台服务的最大在途请求数，None为不限
+    session: requests.Session = field(default=None, repr=False, compare=False)  # 复用连接的HTTP会话
+    scheduler: RequestScheduler = field(default=None, repr=False, compare=False)  # 共享的限速重试调度器
+    pool: EndpointPool = field(default=None, repr=False, compare=False)  # 多台服务的负载均衡池
+    
+    def __post_init__(self):
+        self.headers = self.headers or {}
+        # 自动添加必要头信息[^3]
+        self.headers.setdefault("Content-Type", "application/json")
+        if self.pool is None and self.api_urls:
+            self.pool = EndpointPool(self.api_urls, self.max_in_flight_per_host)
+        if self.pool is not None:
+            self.pool_connections = max(self.pool_connections, len(self.pool))
+        self.session = self.session or build_session(self.pool_connections, self.pool_maxsize)
+        self.scheduler = self.scheduler or RequestScheduler(self.rpm, self.tpm, self.max_retries)
+
+@dataclass
+class LocalModelConfig:
+    '''
+    进程内本地模型配置，不经过HTTP
+    generate: 接收Chat消息列表、返回模型输出文本的函数，例如llama-cpp-python:
+        llm = Llama(model_path="qwen2.5-7b-instruct-q4_k_m.gguf", n_ctx=4096)
+        config = LocalModelConfig(
+            generate=lambda messages: llm.create_chat_completion(messages)["choices"][0]["message"]["content"],
+            model_id="qwen2.5-7b-q4"
+        )
+    进程内模型通常无法并行推理，并发调用时由lock串行化
+    '''
+    generate: Callable[[List[dict]], str] = None
+    model_id: str = "local"
+    num_ctx: Optional[int] = None   # 模型上下文长度，用于自动计算上下文token预算
+    max_retries: int = 1            # 本地调用一般无需重试
+    serialize: bool = True          # 是否串行化调用
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+    scheduler: RequestScheduler = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.generate is None:
+            raise ValueError("LocalModelConfig需要提供generate函数")
+        self.scheduler = self.scheduler or RequestScheduler(max_retries=self.max_retries)
+
+@dataclass
+class ChatResult:
+    """单次Chat请求的结果"""
+    text: str                       # 模型输出（已去除推理段）
+    ttft: Optional[float] = None    # 首token耗时（秒），仅流式请求
+    think_tokens: int = 0           # 推理段token数（非流式请求为估算值）
+    prompt_tokens: Optional[int] = None      # 接口返回的提示词token数（usage/prompt_eval_count）
+    completion_tokens: Optional[int] = None  # 接口返回的生成token数（usage/eval_count），含推理段
+    cached_tokens: Optional[int] = None      # 命中提示词缓存的token数，仅部分接口返回
+
+def _split_think(content: str):
+    """拆分非流式输出中的推理段，返回(推理段, 正文)"""
+    think, _, text = content.rpartition(THINK_CLOSE)
+    return think.replace(THINK_OPEN, ""), text.strip()
+
+def _instrumented(chat):
+    """记录chat请求的耗时和token用量到当前线程的指标记录，接口未返回用量时按估算值记录"""
+    @functools.wraps(chat)
+    def wrapper(config, messages: List[dict], *args, **kwargs) -> ChatResult:
+        started = time.monotonic()
+        try:
+            result = chat(config, messages, *args, **kwargs)
+        except Exception:
+            record_failure(time.monotonic() - started)
+            raise
+        estimated = result.prompt_tokens is None or result.completion_tokens is None
+        record_response(
+            time.monotonic() - started,
+            result.prompt_tokens if result.prompt_tokens is not None else estimate_messages_tokens(messages),
+            result.completion_tokens if result.completion_tokens is not None else estimate_tokens(result.text) + result.think_tokens,
+            result.think_tokens,
+            result.ttft,
+            estimated,
+            result.cached_tokens
+        )
+        return result
+    return wrapper
+
+def _cached_tokens(usage: dict) -> Optional[int]:
+    """命中提示词缓存的token数：OpenAI为prompt_tokens_details.cached_tokens，DeepSeek为prompt_cache_hit_tokens"""
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    return cached if cached is not None else usage.get("prompt_cache_hit_tokens")
+
+@_instrumented
+def chat_openai(config: ModelConfigOpenAI, messages: List[dict], max_tokens: int = 1024) -> ChatResult:
+    """调用OpenAI兼容的Chat接口（单次请求，失败时抛出异常）"""
+    payload = {
+        "model": config.model_id,  # 必填参数[^1]
+        "messages": messages,
+        "temperature": 0.3,        # 控制随机性[^4]
+        "max_tokens": max_tokens,  # 支持长上下文[^3]
+        "top_p": 0.9,             # 平衡多样性[^4]
+        "n": 1,                   # 固定生成数量[^1]
+        "frequency_penalty": 0.5   # 减少重复[^4]
+    }
+    if config.stream:
+        payload["stream"] = True
+        think_filter = ThinkFilter(config.max_think_tokens, config.max_stream_tokens)
+        # 提前退出with块会关闭连接，服务端随之终止生成
+        with config.session.post(
+            f"{config.api_url}/chat/completions",
+            headers=config.headers,
+            json=payload,
+            timeout=(config.connect_timeout, config.read_timeout),
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            last = consume_openai_stream(response, think_filter)
+        usage = last.get("usage") or {}
+        return ChatResult(think_filter.text, think_filter.ttft, think_filter.think_tokens,
+                          usage.get("prompt_tokens"), usage.get("completion_tokens"), _cached_tokens(usage))
+
+    response = config.session.post(
+        f"{config.api_url}/chat/completions",  # 官方接口路径[^1]
+        headers=config.headers,
+        json=payload,
+        timeout=(config.connect_timeout, config.read_timeout)
+    )
+    response.raise_for_status()
+
+    # 严格提取翻译结果[^2]
+    response_data = response.json()
+    message = response_data['choices'][0]['message']
+    # 部分兼容接口（如vLLM部署的推理模型）把推理段直接放在content中，与流式路径一致地去除
+    think, text = _split_think(message['content'])
+    usage = response_data.get("usage") or {}
+    reasoning_tokens = (usage.get("completion_tokens_details") or {}).get("reasoning_tokens")
+    if reasoning_tokens is None:
+        reasoning_tokens = estimate_tokens(think + (message.get("reasoning_content") or ""))
+    return ChatResult(text, None, reasoning_tokens, usage.get("prompt_tokens"), usage.get("completion_tokens"), _cached_tokens(usage))
+
+@_instrumented
+def chat_ollama(config: ModelConfigOllama, messages: List[dict]) -> ChatResult:
+    """调用Ollama Chat接口，输出去除<think>段（单次请求，失败时抛出异常）；配置了多台服务时由负载均衡池选择地址"""
+    if config.pool is not None:
+        return config.pool.call(lambda api_url: _chat_ollama_at(config, api_url, messages))
+    return _chat_ollama_at(config, config.api_url, messages)
+
+def _chat_ollama_at(config: ModelConfigOllama, api_url: str, messages: List[dict]) -> ChatResult:
+    payload = {
+        "model": config.model_id,   # 必须指定模型名称[^5]
+        "messages": messages,
+        "options": {
+            "temperature": config.temperature,  # 生成随机性控制[^6]
+            "top_p": config.top_p,
+            "num_ctx": config.num_ctx
+        },
+        "stream": config.stream,
+        "keep_alive": config.keep_alive  # 模型驻留控制[^5]
+    }
+    if config.stream:
+        think_filter = ThinkFilter(config.max_think_tokens, config.max_stream_tokens)
+        # 提前退出with块会关闭连接，Ollama随之终止生成
+        with config.session.post(
+            f"{api_url}/api/chat",
+            headers=config.headers,
+            json=payload,
+            timeout=(config.connect_timeout, config.read_timeout),
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            last = consume_ollama_stream(response, think_filter)
+        return ChatResult(think_filter.text, think_filter.ttft, think_filter.think_tokens,
+                          last.get("prompt_eval_count"), last.get("eval_count"))
+
+    response = config.session.post(
+        f"{api_url}/api/chat",  # Chat专用接口[^5]
+        headers=config.headers,
+        json=payload,
+        timeout=(config.connect_timeout, config.read_timeout)
+    )
+    response.raise_for_status()
+
+    response_data = response.json()
+    if not response_data.get("done", True):
+        raise ValueError("未完成完整响应")
+    try:
+        text_with_think = response_data['message']['content'].strip()  # 提取核心响应[^5]
+    except KeyError:
+        raise ValueError(f"异常响应格式:{response.text[:200]}")
+    # remove text between <think> </think> tag
+    think, text = _split_think(text_with_think)
+    return ChatResult(text, None, estimate_tokens(think),
+                      response_data.get("prompt_eval_count"), response_data.get("eval_count"))
+
+@_instrumented
+def chat_local(config: LocalModelConfig, messages: List[dict]) -> ChatResult:
+    """调用进程内本地模型，输出去除<think>段"""
+    if config.serialize:
+        with config.lock:
+            output = config.generate(messages)
+    else:
+        output = config.generate(messages)
+    think, text = _split_think(output)
+    return ChatResult(text, None, estimate_tokens(think))
+
+class Backend:
+    '''
+    翻译后端
+    子类只需实现chat()（单次请求，失败时抛出异常），即可复用单块翻译、批量翻译（translate_many）、
+    并发、缓存、断点续译和校验修复等全部流程；
+    用register_backend注册并关联配置类后，generate_srt_translation等函数可直接接收该配置对象
+    同步方法可在线程池中并发调用；异步方法默认在线程中执行同步方法（连接池仍然复用），
+    有原生异步客户端的后端可覆盖atranslate/atranslate_many
+    '''
+    name: str = ""
+    config_class: Optional[type] = None
+    output_rule = "请严格按要求直接输出中文译文（不要添加任何解释或符号）"
+    batch_output_rule = "请严格按要求逐行输出中文译文（不要添加任何解释）"
+    block_template = "上下文参考：\n{context}\n需要翻译的内容：{text}\n"
+
+    def __init__(self, config, layout: Optional[PrefixLayout] = None):
+        self.config = config
+        self.layout = layout
+
+    def with_layout(self, layout: Optional[PrefixLayout]) -> "Backend":
+        """使用指定提示词布局的同一后端（共用配置、连接池和限速），见prompts.PrefixLayout"""
+        backend = copy.copy(self)
+        backend.layout = layout
+        return backend
+
+    @property
+    def model_id(self) -> str:
+        return self.config.model_id
+
+    @property
+    def scheduler(self) -> RequestScheduler:
+        return self.config.scheduler
+
+    @property
+    def context_limit(self) -> Optional[int]:
+        """模型上下文长度（token），用于自动计算上下文预算，None为不限制"""
+        return None
+
+    def chat(self, messages: List[dict], max_tokens: int = 1024) -> ChatResult:
+        raise NotImplementedError
+
+    def clean_output(self, text: str) -> str:
+        return text.strip()
+
+    def system_prompt(self, domain: Optional[str], output_rule: str) -> str:
+        """系统指令，子类可覆盖；使用提示词布局时以output_rule=""调用，由布局追加术语表"""
+        return build_system_prompt(domain, output_rule)
+
+    def request_system_prompt(self, domain: Optional[str], batch: bool = False) -> str:
+        """实际发送的系统指令：使用提示词布局时单块与批量请求共用，否则按请求方式附加输出要求"""
+        if self.layout is not None:
+            return self.layout.system_prompt(domain, self.system_prompt(domain, ""))
+        return self.system_prompt(domain, self.batch_output_rule if batch else self.output_rule)
+
+    def block_messages(self, block: SubtitleBlock, context: str, domain: Optional[str],
+                       terms: Optional[Dict[str, str]] = None) -> List[dict]:
+        glossary = build_glossary_prompt(terms)
+        if self.layout is not None:
+            return [
+                {"role": "system", "content": self.request_system_prompt(domain)},
+                {"role": "user", "content": self.layout.block_prompt(context, block.text, self.output_rule, glossary)}
+            ]
+        return [
+            {"role": "system", "content": self.request_system_prompt(domain)},
+            {"role": "user", "content": glossary + self.block_template.format(context=context, text=block.text)}
+        ]
+
+    def translate(self, block: SubtitleBlock, context: str, domain: Optional[str],
+                  terms: Optional[Dict[str, str]] = None) -> str:
+        """翻译单个字幕块，重试耗尽后返回带[TRANSLATION_FAILED]标记的原文；terms为需要遵守的术语 {原文: 译文}"""
+        messages = self.block_messages(block, context, domain, terms)
+        try:
+            result = self.scheduler.call(
+                lambda: self.chat(messages),
+                tokens=estimate_messages_tokens(messages),
+                on_error=lambda e: print(f"Error translating block {block.index}: {str(e)}\nRetrying...")
+            )
+            return self.clean_output(result.text)
+        except Exception as e:
+            print(f"Error translating block {block.index}: {str(e)}")
+            return f"{block.text} {FAILED_MARKER}"
+
+    def translate_many(self, blocks: List[SubtitleBlock], context: str, domain: Optional[str],
+                       terms: Optional[Dict[str, str]] = None) -> Optional[List[str]]:
+        """
+        单次请求翻译连续多个字幕块
+        返回与blocks一一对应的译文；请求失败或译文未对齐时返回None，由调用方回退逐块翻译
+        """
+        glossary = build_glossary_prompt(terms)
+        if self.layout is not None:
+            messages = [
+                {"role": "system", "content": self.request_system_prompt(domain, batch=True)},
+                {"role": "user", "content": self.layout.batch_prompt(blocks, context, glossary)}
+            ]
+        else:
+            messages = [
+                {"role": "system", "content": self.request_system_prompt(domain, batch=True)},
+                {"role": "user", "content": glossary + build_batch_prompt(blocks, context)}
+            ]
+        try:
+            result = self.scheduler.call(lambda: self.chat(messages, 1024 * len(blocks)), tokens=estimate_messages_tokens(messages))
+        except Exception as e:
+            print(f"Error translating batch {blocks[0].index}-{blocks[-1].index}: {str(e)}")
+            return None
+        # 单次回复若未对齐不再重试，直接交给逐块翻译兜底
+        return parse_batch_response(result.text, blocks)
+
+    async def atranslate(self, block: SubtitleBlock, context: str, domain: Optional[str],
+                         terms: Optional[Dict[str, str]] = None) -> str:
+        return await asyncio.to_thread(self.translate, block, context, domain, terms)
+
+    async def atranslate_many(self, blocks: List[SubtitleBlock], context: str, domain: Optional[str],
+                              terms: Optional[Dict[str, str]] = None) -> Optional[List[str]]:
+        return await asyncio.to_thread(self.translate_many, blocks, context, domain, terms)
+
+
+BACKENDS: Dict[str, Type[Backend]] = {}
+
+
+def register_backend(name: str, config_class: Optional[type] = None):
+    """注册后端类的装饰器，config_class为对应的配置类，get_backend据此由配置对象找到后端"""
+    def decorator(cls: Type[Backend]) -> Type[Backend]:
+        cls.name = name
+        if config_class is not None:
+            cls.config_class = config_class
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+def get_backend(config) -> Backend:
+    """由配置对象（或已创建的后端）得到后端实例"""
+    if isinstance(config, Backend):
+        return config
+    for cls in reversed(list(BACKENDS.values())):
+        if cls.config_class is not None and isinstance(config, cls.config_class):
+            return cls(config)
+    raise TypeError(f"没有注册与{type(config).__name__}对应的翻译后端")
+
+
+def create_backend(name: str, **config_kwargs) -> Backend:
+    """按注册名创建后端，参数传给对应的配置类"""
+    try:
+        cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"未知的翻译后端: {name}，可选: {', '.join(BACKENDS)}")
+    return cls(cls.config_class(**config_kwargs))
+
+
+@register_backend("openai", ModelConfigOpenAI)
+class OpenAIBackend(Backend):
+    def chat(self, messages: List[dict], max_tokens: int = 1024) -> ChatResult:
+        return chat_openai(self.config, messages, max_tokens)
+
+    def clean_output(self, text: str) -> str:
+        # 去除模型偶尔附带的"译文："等前缀
+        return text.split("：")[-1].strip()
+
+
+@register_backend("ollama", ModelConfigOllama)
+class OllamaBackend(Backend):
+    output_rule = "请严格按要求输出译文（不要添加任何解释或符号）"
+    block_template = "上下文参考：{context}\n需翻译：{text}"
+
+    @property
+    def context_limit(self) -> Optional[int]:
+        return self.config.num_ctx
+
+    def chat(self, messages: List[dict], max_tokens: int = 1024) -> ChatResult:
+        return chat_ollama(self.config, messages)
+
+
+@register_backend("local", LocalModelConfig)
+class LocalBackend(Backend):
+    output_rule = "请严格按要求输出译文（不要添加任何解释或符号）"
+
+    @property
+    def context_limit(self) -> Optional[int]:
+        return self.config.num_ctx
+
+    def chat(self, messages: List[dict], max_tokens: int = 1024) -> ChatResult:
+        return chat_local(self.config, messages)
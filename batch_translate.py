@@ -0,0 +1,452 @@
+"""
+批量字幕翻译
+用法:
+    python batch_translate.py courses/acis/ --out-dir output/ --backend ollama --model qwq:32b --domain 民用航空
+    python batch_translate.py manifest.jsonl --out-dir output/ --workers 8 --episodes 3
+    python batch_translate.py courses/acis/ --out-dir output/ --api-url http://gpu1:11434 http://gpu2:11434 --model qwq:32b --workers 8
+
+输入可以是目录（其中每个.srt文件为一集，同名的.mp4/.mkv视为对应视频）
+或清单文件（.jsonl每行 {"srt": "...", "name": "...", "video": "..."}，其他格式每行一个SRT路径）
+每集依次执行：拆分长字幕、翻译、重新翻译失败块、合并双语字幕、生成ffmpeg命令（--burn时直接压制双语视频），
+多集并行处理，所有请求共用同一个线程池和同一份限速额度
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from subtitle import count_srt_blocks, iter_srt, parse_srt, save_srt, split_long_subtitle_blocks, merge_subtitles, CMD_FFMPEG_MERGE_TEMPLATE, CMD_FFMPEG_SPLIT_TEMPLATE
+from backends import Backend, create_backend
+from translate_llm import generate_srt_translation, re_translate_failed_blocks, stream_srt_translation
+from validation import ValidationRules, check_translation
+from metrics import MetricsCollector
+from translation_cache import TranslationCache
+from dedup import DuplicateIndex
+from glossary import Glossary
+from prompts import PrefixLayout
+from media import MediaConfig, burn_subtitles, burn_workers
+
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".mov", ".avi")
+
+
+@dataclass
+class EpisodeJob:
+    '''
+    单集任务
+    输出目录下依次生成 source.srt（拆分后的原文）、rough.srt（初译）、
+    translated.srt（重译失败块后的译文）、merged.srt（双语字幕）及断点日志rough.srt.journal
+    '''
+    name: str
+    srt_path: str
+    output_dir: str
+    video_path: Optional[str] = None
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.output_dir, filename)
+
+
+@dataclass
+class EpisodeResult:
+    name: str
+    status: str = "pending"         # pending/running/done/skipped/failed
+    stage: str = ""
+    blocks: int = 0
+    failed_blocks: int = 0
+    elapsed: float = 0.0
+    started_at: Optional[float] = None
+    error: Optional[str] = None
+    commands: List[str] = field(default_factory=list)
+
+
+def _find_video(srt_path: str) -> Optional[str]:
+    stem = os.path.splitext(srt_path)[0]
+    for ext in VIDEO_EXTENSIONS:
+        if os.path.exists(stem + ext):
+            return stem + ext
+    return None
+
+
+def discover_jobs(source: str, output_dir: str) -> List[EpisodeJob]:
+    """从目录或清单文件收集任务，每集的输出放在output_dir下以集名命名的子目录中"""
+    entries = []
+    if os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            if filename.lower().endswith(".srt"):
+                entries.append({"srt": os.path.join(source, filename)})
+    else:
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, 'r', encoding='utf-8-sig') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                entry = json.loads(line) if source.endswith(".jsonl") else {"srt": line}
+                # 清单中的相对路径相对于清单文件所在目录
+                for key in ("srt", "video"):
+                    if entry.get(key):
+                        entry[key] = os.path.join(base_dir, entry[key])
+                entries.append(entry)
+
+    jobs = []
+    names = set()
+    for entry in entries:
+        name = entry.get("name") or os.path.splitext(os.path.basename(entry["srt"]))[0]
+        if name in names:
+            raise ValueError(f"集名重复: {name}")
+        names.add(name)
+        jobs.append(EpisodeJob(
+            name=name,
+            srt_path=entry["srt"],
+            output_dir=os.path.join(output_dir, name),
+            video_path=entry.get("video") or _find_video(entry["srt"])
+        ))
+    return jobs
+
+
+def _run_stages(job: EpisodeJob, config, result: EpisodeResult, executor, max_workers, domain, split_max_words, window_size,
+                batch_size, cache, metrics, verbose, dedup, merge_sentences, prefix_layout, glossary):
+    """分阶段处理：拆分 -> 翻译 -> 校验重译 -> 合并，每个阶段读入上一阶段的完整文件"""
+    result.stage = "split"
+    blocks = parse_srt(job.srt_path)
+    if split_max_words:
+        blocks = split_long_subtitle_blocks(blocks, max_length=split_max_words)
+    save_srt(job.path("source.srt"), blocks)
+    result.blocks = len(blocks)
+
+    result.stage = "translate"
+    generate_srt_translation(
+        input_path=job.path("source.srt"),
+        output_path=job.path("rough.srt"),
+        config=config,
+        domain=domain,
+        window_size=window_size,
+        batch_size=batch_size,
+        cache=cache,
+        journal_path=job.path("rough.srt.journal"),
+        dedup=dedup,
+        merge_sentences=merge_sentences,
+        prefix_layout=prefix_layout,
+        glossary=glossary,
+        executor=executor,
+        max_workers=max_workers,
+        progress_desc=job.name,
+        metrics=metrics,
+        verbose=verbose
+    )
+
+    result.stage = "retranslate"
+    still_bad = re_translate_failed_blocks(
+        rough_path=job.path("rough.srt"),
+        source_path=job.path("source.srt"),
+        output_path=job.path("translated.srt"),
+        config=config,
+        domain=domain,
+        window_size=window_size,
+        cache=cache,
+        executor=executor,
+        max_workers=max_workers,
+        metrics=metrics,
+        verbose=verbose,
+        glossary=glossary
+    )
+    result.failed_blocks = len(still_bad)
+
+    result.stage = "merge"
+    merge_subtitles(job.path("translated.srt"), job.path("source.srt"), job.path("merged.srt"))
+
+
+def _run_stream(job: EpisodeJob, config, result: EpisodeResult, executor, max_workers, domain, split_max_words, window_size,
+                batch_size, cache, metrics, verbose, dedup, merge_sentences, prefix_layout, glossary):
+    """单趟流式处理，内存占用与字幕长度无关"""
+    result.stage = "stream"
+    rules = ValidationRules()
+    translated = stream_srt_translation(
+        job.srt_path,
+        job.path("translated.srt"),
+        config,
+        split_max_words=split_max_words,
+        source_output_path=job.path("source.srt"),
+        bilingual_output_path=job.path("merged.srt.part"),
+        journal_path=job.path("translated.srt.journal"),
+        domain=domain,
+        window_size=window_size,
+        batch_size=batch_size,
+        cache=cache,
+        executor=executor,
+        max_workers=max_workers,
+        metrics=metrics,
+        rules=rules,
+        dedup=dedup,
+        merge_sentences=merge_sentences,
+        prefix_layout=prefix_layout,
+        glossary=glossary
+    )
+    result.blocks = result.failed_blocks = 0
+    for block, translated_text in translated:
+        result.blocks += 1
+        result.failed_blocks += bool(check_translation(block.text, translated_text, rules))
+        if verbose:
+            print(f"Block {block.index}\n原文：{block.text}\n译文：{translated_text}\n")
+    os.replace(job.path("merged.srt.part"), job.path("merged.srt"))
+
+
+def run_episode(
+    job: EpisodeJob,
+    config,
+    result: EpisodeResult,
+    executor: Optional[ThreadPoolExecutor] = None,
+    max_workers: int = 1,
+    domain: Optional[str] = None,
+    split_max_words: int = 15,
+    window_size: int = 5,
+    batch_size: int = 1,
+    cache: Optional[TranslationCache] = None,
+    dedup: Optional[DuplicateIndex] = None,
+    metrics: Optional[MetricsCollector] = None,
+    verbose: bool = True,
+    force: bool = False,
+    stream: bool = False,
+    merge_sentences: bool = False,
+    prefix_layout: Optional[PrefixLayout] = None,
+    glossary: Optional[Glossary] = None,
+    media: Optional[MediaConfig] = None,
+    media_executor: Optional[ThreadPoolExecutor] = None
+) -> EpisodeResult:
+    """
+    执行单集的完整流程，结果（含当前阶段）实时写入result
+    executor: 多集共用的请求线程池，max_workers为其线程数；未传入时本集按max_workers自建线程池
+    dedup: 多集共用的重复字幕索引，重复的短句只翻译一次
+    stream: 单趟流式处理，拆分、翻译、校验重译和双语合并逐块进行并立即写出，不生成rough.srt；
+            双语字幕先写入merged.srt.part，完成后改名为merged.srt
+    merge_sentences: 按句子翻译，句子中途断开的相邻字幕合并翻译后再拆回各字幕块
+    prefix_layout: 前缀缓存友好的提示词布局，见prompts.PrefixLayout
+    glossary: 多集共用的术语表，每次请求只注入原文中出现的术语
+    media: 传入时把双语字幕压制进视频（见media.burn_subtitles），否则只生成ffmpeg命令
+    media_executor: 多集共用的压制线程池，限制同时运行的ffmpeg进程数，其线程数须为burn_workers(media)
+    """
+    result.started_at = time.monotonic()
+    result.status = "running"
+    try:
+        output_video = job.path(f"{job.name}_bilingual.mp4")
+        # 已翻译但尚未压制的集只补做压制
+        burn = media is not None and job.video_path and (force or not os.path.exists(output_video))
+        if not force and os.path.exists(job.path("merged.srt")):
+            result.blocks = count_srt_blocks(job.path("merged.srt"))
+            if not burn:
+                result.status = "skipped"
+                return result
+        else:
+            os.makedirs(job.output_dir, exist_ok=True)
+            if stream:
+                _run_stream(job, config, result, executor, max_workers, domain, split_max_words, window_size, batch_size, cache,
+                            metrics, verbose, dedup, merge_sentences, prefix_layout, glossary)
+            else:
+                _run_stages(job, config, result, executor, max_workers, domain, split_max_words, window_size, batch_size, cache,
+                            metrics, verbose, dedup, merge_sentences, prefix_layout, glossary)
+
+        if burn:
+            result.stage = "burn"
+            burn_subtitles(job.video_path, job.path("merged.srt"), output_video, media, executor=media_executor,
+                           progress_desc=f"{job.name} burn", max_workers=burn_workers(media))
+        elif job.video_path:
+            result.commands.append(CMD_FFMPEG_MERGE_TEMPLATE.format(
+                input_path_video=job.video_path,
+                input_path_srt=job.path("merged.srt"),
+                output_path_video=output_video
+            ))
+            result.commands.append(CMD_FFMPEG_SPLIT_TEMPLATE.format(
+                input_path_video=output_video,
+                output_dir=job.output_dir + "/"
+            ))
+        result.status = "done"
+        result.stage = ""
+    except Exception as e:
+        result.status = "failed"
+        result.error = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    finally:
+        result.elapsed = time.monotonic() - result.started_at
+    return result
+
+
+def format_summary(results: List[EpisodeResult]) -> str:
+    lines = [f"{'episode':<24}{'status':<10}{'blocks':>8}{'failed':>8}{'time(s)':>10}"]
+    for r in results:
+        status, elapsed = r.status, r.elapsed
+        if r.status == "running":
+            status, elapsed = f"@{r.stage}", time.monotonic() - r.started_at
+        lines.append(f"{r.name:<24}{status:<10}{r.blocks:>8}{r.failed_blocks:>8}{elapsed:>10.1f}")
+        if r.error:
+            lines.append(f"    {r.error}")
+    done = sum(r.status in ("done", "skipped") for r in results)
+    lines.append(f"{done}/{len(results)} episodes finished, {sum(r.failed_blocks for r in results)} blocks still failed")
+    return "\n".join(lines)
+
+
+def run_batch(
+    jobs: List[EpisodeJob],
+    config,
+    max_workers: int = 4,
+    max_episodes: int = 2,
+    report_interval: float = 60.0,
+    **episode_kwargs
+) -> List[EpisodeResult]:
+    '''
+    并行处理多集
+    max_workers: 所有集共用的在途请求数上限（共享线程池）
+    max_episodes: 同时处理的集数，各集的请求进入同一个线程池排队
+    report_interval: 打印各集进度汇总的间隔（秒），0为不打印
+    限速额度（rpm/tpm）和HTTP连接池由同一个config在所有集之间共享
+    传入media时所有集的压制分段共用一个线程池，同时运行的ffmpeg进程数不超过burn_workers(media)
+    其余参数透传给run_episode
+    '''
+    results = [EpisodeResult(name=job.name) for job in jobs]
+    finished = threading.Event()
+
+    def _report():
+        while not finished.wait(report_interval):
+            print(f"\n{format_summary(results)}\n")
+
+    reporter = None
+    if report_interval:
+        reporter = threading.Thread(target=_report, daemon=True)
+        reporter.start()
+    media = episode_kwargs.get("media")
+    # 确定压制并发数需要检测编码器，没有视频需要压制时不调用ffmpeg
+    burning = media is not None and any(job.video_path for job in jobs)
+    # 各集的流程线程只负责编排，翻译请求和压制分段分别提交到共享的线程池，分开以免互相等待造成死锁
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as request_pool, \
+            ThreadPoolExecutor(max_workers=burn_workers(media) if burning else 1) as media_pool, \
+            ThreadPoolExecutor(max_workers=max(1, max_episodes)) as episode_pool:
+        futures = [
+            episode_pool.submit(run_episode, job, config, result, request_pool, max(1, max_workers),
+                                media_executor=media_pool, **episode_kwargs)
+            for job, result in zip(jobs, results)
+        ]
+        for future in futures:
+            future.result()
+    finished.set()
+
+    print(format_summary(results))
+    for r in results:
+        for command in r.commands:
+            print(command)
+    return results
+
+
+def build_backend(args) -> Backend:
+    kwargs = dict(api_url=args.api_url[0], model_id=args.model, rpm=args.rpm, tpm=args.tpm, pool_maxsize=max(16, args.workers))
+    if args.backend == "ollama":
+        kwargs["num_ctx"] = args.num_ctx
+        if len(args.api_url) > 1:
+            kwargs.update(api_urls=args.api_url, max_in_flight_per_host=args.max_in_flight_per_host)
+    else:
+        if len(args.api_url) > 1:
+            raise SystemExit("多个--api-url仅支持ollama后端")
+        kwargs["api_key"] = args.api_key or os.environ.get("OPENAI_API_KEY", "")
+    return create_backend(args.backend, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="SRT目录或清单文件")
+    parser.add_argument("--out-dir", required=True, help="输出目录，每集一个子目录")
+    parser.add_argument("--backend", choices=("openai", "ollama"), default="ollama")
+    parser.add_argument("--api-url", required=True, nargs="+", help="ollama后端可传入多台服务的地址，按负载分发请求")
+    parser.add_argument("--max-in-flight-per-host", type=int, default=None, help="多台服务时每台的最大在途请求数")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--api-key", default=None, help="默认读取环境变量OPENAI_API_KEY")
+    parser.add_argument("--num-ctx", type=int, default=4096, help="Ollama上下文长度")
+    parser.add_argument("--domain", default=None)
+    parser.add_argument("--workers", type=int, default=4, help="全局在途请求数上限")
+    parser.add_argument("--episodes", type=int, default=2, help="同时处理的集数")
+    parser.add_argument("--rpm", type=float, default=None)
+    parser.add_argument("--tpm", type=float, default=None)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--window-size", type=int, default=5)
+    parser.add_argument("--split-max-words", type=int, default=15, help="拆分长字幕的单词数上限，0为不拆分")
+    parser.add_argument("--cache", default=None, help="译文缓存数据库路径")
+    parser.add_argument("--dedup-max-words", type=int, default=0,
+                        help="大于0时，不超过该词数的重复短句只翻译一次，所有集共用译文（如4）")
+    parser.add_argument("--dedup-fuzzy", action="store_true", help="判断重复时额外忽略语气词和拉长的字母")
+    parser.add_argument("--force", action="store_true", help="重新处理已生成merged.srt的集")
+    parser.add_argument("--stream", action="store_true", help="单趟流式处理，边翻译边写出，适合很长的字幕")
+    parser.add_argument("--merge-sentences", action="store_true", help="把句子中途断开的相邻字幕合并翻译，译文再按比例拆回")
+    parser.add_argument("--prefix-layout", action="store_true",
+                        help="固定系统指令并按--context-group块对齐上下文，便于服务端复用KV/提示词缓存")
+    parser.add_argument("--context-group", type=int, default=20, help="前缀布局中共用同一份上下文的块数")
+    parser.add_argument("--glossary", default=None, help="术语表路径（每行\"原文<TAB>译文\"，或.json），只注入原文中出现的术语")
+    parser.add_argument("--learn-glossary", action="store_true",
+                        help="翻译前从所有集中提取反复出现的专有名词和缩写，请模型统一译法后写回--glossary")
+    parser.add_argument("--glossary-min-count", type=int, default=3, help="自动提取术语的最少出现次数")
+    parser.add_argument("--burn", action="store_true", help="把双语字幕压制进同名视频（分段并行），代替打印ffmpeg命令")
+    parser.add_argument("--encoder", default=None, help="视频编码器，默认自动检测硬件编码器，不可用时使用libx264")
+    parser.add_argument("--burn-workers", type=int, default=os.cpu_count() or 1, help="同时运行的ffmpeg进程数，默认为CPU核数（硬件编码器至多2个）")
+    parser.add_argument("--segment-time", type=float, default=290, help="压制时切分视频的分段时长（秒）")
+    parser.add_argument("--quiet", action="store_true", help="不逐块打印原文和译文")
+    parser.add_argument("--metrics-jsonl", default=None, help="逐次调用指标的JSONL输出路径")
+    parser.add_argument("--metrics-prom", default=None, help="Prometheus textfile格式的汇总指标输出路径")
+    parser.add_argument("--report-interval", type=float, default=60.0)
+    args = parser.parse_args()
+    if args.learn_glossary and not args.glossary:
+        raise SystemExit("--learn-glossary需要同时指定--glossary")
+
+    jobs = discover_jobs(args.source, args.out_dir)
+    print(f"Found {len(jobs)} episodes in {args.source}")
+    cache = TranslationCache(args.cache) if args.cache else None
+    dedup = DuplicateIndex(max_words=args.dedup_max_words, fuzzy=args.dedup_fuzzy) if args.dedup_max_words > 0 else None
+    config = build_backend(args)
+    pool = getattr(config.config, "pool", None)
+    if pool is not None:
+        alive = pool.check_health(config.config.session)
+        print(f"{len(alive)}/{len(pool)} endpoints reachable")
+    glossary = None
+    if args.glossary:
+        glossary = Glossary.load(args.glossary)
+        if args.learn_glossary:
+            texts = (block.text for job in jobs for block in iter_srt(job.srt_path))
+            learned = glossary.learn(config, texts, args.domain, min_count=args.glossary_min_count)
+            glossary.save(args.glossary)
+            print(f"Learned {len(learned)} terms, saved to {args.glossary}")
+        print(f"Glossary: {len(glossary)} terms")
+    metrics = MetricsCollector(args.metrics_jsonl, args.metrics_prom, model_id=config.model_id)
+    try:
+        results = run_batch(
+            jobs,
+            config,
+            max_workers=args.workers,
+            max_episodes=args.episodes,
+            report_interval=args.report_interval,
+            domain=args.domain,
+            split_max_words=args.split_max_words,
+            window_size=args.window_size,
+            batch_size=args.batch_size,
+            cache=cache,
+            dedup=dedup,
+            metrics=metrics,
+            verbose=not args.quiet,
+            force=args.force,
+            stream=args.stream,
+            merge_sentences=args.merge_sentences,
+            prefix_layout=PrefixLayout(context_group=args.context_group) if args.prefix_layout else None,
+            glossary=glossary,
+            media=MediaConfig(encoder=args.encoder, max_workers=args.burn_workers, segment_time=args.segment_time) if args.burn else None
+        )
+        print(f"\nAll episodes:\n{metrics.format_summary()}")
+        if pool is not None:
+            print(pool.format_status())
+    finally:
+        metrics.close()
+        if cache is not None:
+            cache.close()
+    if any(r.status == "failed" for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
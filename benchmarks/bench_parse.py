@@ -0,0 +1,147 @@
+"""
+SRT解析速度基准
+用法: python benchmarks/bench_parse.py --blocks 100000 --repeat 3
+生成多小时的合成字幕文件，对比重写前的逐行解析（原样保留的旧解析器和旧数据类，legacy+time为再逐块解析时间轴）
+与parse_srt的耗时（parse_srt+time为再访问每块的起止时间，标准时间轴在首次访问时才解析），
+以及旧数据类、SubtitleBlock列表与列式SubtitleTrack的内存占用
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subtitle import SubtitleTrack, format_timeline, parse_srt
+
+WORDS = "the pilot checks flaps before takeoff and tower gives clearance to land on runway two seven".split()
+
+
+def write_synthetic_srt(path: str, n_blocks: int, seed: int = 0):
+    """生成合成SRT：每块1~2行文本，时长约2秒"""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(n_blocks):
+            start = i * 2.5
+            lines = [" ".join(rng.choices(WORDS, k=rng.randint(3, 12))) for _ in range(rng.randint(1, 2))]
+            f.write(f"{i + 1}\n{format_timeline(start, start + 2)}\n" + "\n".join(lines) + "\n\n")
+
+
+@dataclass
+class LegacySubtitleBlock:
+    '''
+    重写前的字幕块（原样保留），仅用于对比
+    '''
+    def __init__(self, index:int, timeline:str, text:str):
+        self.index = index
+        self.timeline = timeline
+        self.text = text
+        self.start = None
+        self.end = None
+        self.duration = None
+
+    def calc_duration(self) -> float:
+        start, end = self.timeline.split(" --> ")
+        start = start.split(":")
+        end = end.split(":")
+        self.start = int(start[0])*3600 + int(start[1])*60 + float(start[2].replace(",","."))
+        self.end = int(end[0])*3600 + int(end[1])*60 + float(end[2].replace(",","."))
+        self.duration = self.end - self.start
+
+
+def legacy_parse_srt(file_path: str):
+    """重写前的逐行解析实现（原样保留），仅用于对比"""
+    blocks = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        current_block = None
+        for line in f:
+            line = line.strip()
+            if line.isdigit():
+                current_block = LegacySubtitleBlock(index=int(line), timeline="", text="")
+            elif '-->' in line:
+                current_block.timeline = line
+            elif line:
+                current_block.text += line + " "
+            elif current_block and current_block.text:
+                current_block.text = current_block.text.strip()
+                blocks.append(current_block)
+                current_block = None
+        if current_block and current_block.text:
+            blocks.append(current_block)
+    return blocks
+
+
+def legacy_parse_srt_timed(file_path: str):
+    """旧实现解析后再逐块解析时间轴，得到与parse_srt相同的信息（起止时间）"""
+    blocks = legacy_parse_srt(file_path)
+    for block in blocks:
+        block.calc_duration()
+    return blocks
+
+
+def parse_srt_timed(file_path: str):
+    """parse_srt后访问每块的起止时间，与legacy+time对比"""
+    blocks = parse_srt(file_path)
+    for block in blocks:
+        block.start_ms, block.end_ms
+    return blocks
+
+
+def best_of(func, path: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        func(path)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def peak_memory(func, path: str) -> float:
+    """返回解析结果常驻内存（MB）"""
+    gc.collect()
+    tracemalloc.start()
+    result = func(path)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.srt")
+        write_synthetic_srt(path, args.blocks)
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"{args.blocks} blocks, {size_mb:.1f} MB")
+
+        assert [b.text for b in legacy_parse_srt(path)] == [b.text for b in parse_srt(path)]
+        legacy_time = best_of(legacy_parse_srt, path, args.repeat)
+        timed_time = best_of(legacy_parse_srt_timed, path, args.repeat)
+        new_time = best_of(parse_srt, path, args.repeat)
+        new_timed_time = best_of(parse_srt_timed, path, args.repeat)
+
+        for name, elapsed in (("legacy", legacy_time), ("legacy+time", timed_time), ("parse_srt", new_time),
+                              ("parse_srt+time", new_timed_time)):
+            print(f"{name:>14}: {elapsed:.3f}s  {args.blocks / elapsed:,.0f} blocks/s  {size_mb / elapsed:.1f} MB/s")
+        print(f"parse_srt time / legacy: {new_time / legacy_time:.2f}, "
+              f"parse_srt+time / legacy+time: {new_timed_time / timed_time:.2f}")
+
+        track_time = best_of(SubtitleTrack.from_srt, path, args.repeat)
+        print(f"{'track':>14}: {track_time:.3f}s  {args.blocks / track_time:,.0f} blocks/s")
+        for name, func in (("legacy", legacy_parse_srt_timed), ("blocks", parse_srt), ("track", SubtitleTrack.from_srt)):
+            print(f"{name:>14}: {peak_memory(func, path):.1f} MB resident")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+端到端翻译吞吐基准
+用法: python benchmarks/bench_translate.py --blocks 100 1000 10000 --backend both --workers 8 --batch-size 10
+      python benchmarks/bench_translate.py --backend ollama --hosts 4 --workers 16 --max-in-flight-per-host 4
+      python benchmarks/bench_translate.py --backend openai --prefix-cache --prompt-token-latency 0.0002 --window-size 50 --prefix-layout
+
+启动本地模拟LLM服务（mock_llm_server.py），在合成字幕上运行generate_srt_translation，
+报告每秒翻译块数、单块延迟p50/p99（批量请求中每块计该请求的耗时）、请求数和发送的提示词token数
+--hosts大于1时启动多个模拟服务，Ollama后端以多服务负载均衡模式运行，用于观察吞吐随服务数的扩展
+--prefix-cache时模拟服务按与最近请求的公共前缀计算缓存命中（cached%列），配合--prompt-token-latency模拟prefill耗时，
+用于对比--prefix-layout（前缀缓存友好的提示词布局）的效果
+计时前先在无故障、无延迟的模拟服务上校验：并发、批量和重复字幕复用的输出须与串行逐块翻译逐字节相同，否则以非0状态退出
+"""
+import argparse
+import contextlib
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_parse import write_synthetic_srt
+from mock_llm_server import MockLLMServer
+from dedup import DuplicateIndex
+from prompts import PrefixLayout
+from translate_llm import ModelConfigOllama, ModelConfigOpenAI, generate_srt_translation
+from validation import FAILED_MARKER
+
+BATCH_SIZE_PATTERN = re.compile(r"共(\d+)行")
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def instrument(session, latencies: list):
+    """记录每次HTTP请求的耗时，批量请求按其中的块数重复记录"""
+    post = session.post
+    lock = threading.Lock()
+
+    def timed_post(*args, **kwargs):
+        messages = (kwargs.get("json") or {}).get("messages") or [{}]
+        match = BATCH_SIZE_PATTERN.search(messages[-1].get("content", ""))
+        t0 = time.perf_counter()
+        try:
+            return post(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies.extend([elapsed] * (int(match.group(1)) if match else 1))
+
+    session.post = timed_post
+
+
+def run_case(servers: List[MockLLMServer], backend: str, path: str, n_blocks: int, args) -> dict:
+    server = servers[0]
+    if backend == "openai":
+        config = ModelConfigOpenAI(api_url=server.url, model_id="mock", api_key="mock", stream=args.stream,
+                                   pool_maxsize=max(16, args.workers), max_retries=args.max_retries)
+    else:
+        config = ModelConfigOllama(api_url=server.url, model_id="mock", stream=args.stream,
+                                   pool_maxsize=max(16, args.workers), max_retries=args.max_retries,
+                                   api_urls=[s.url for s in servers] if len(servers) > 1 else None,
+                                   max_in_flight_per_host=args.max_in_flight_per_host)
+    # 退避等待按模拟服务的尺度缩短，避免基准被重试等待主导
+    config.scheduler.base_delay = config.scheduler.max_delay = args.retry_delay
+    latencies = []
+    instrument(config.session, latencies)
+    for s in servers:
+        s.reset_stats()
+
+    output_path = path + f".{backend}.out.srt"
+    t0 = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        generate_srt_translation(path, output_path, config, window_size=args.window_size,
+                                 max_workers=args.workers, batch_size=args.batch_size,
+                                 prefix_layout=PrefixLayout(context_group=args.context_group) if args.prefix_layout else None)
+    elapsed = time.perf_counter() - t0
+    with open(output_path, 'r', encoding='utf-8') as f:
+        failed = f.read().count(FAILED_MARKER)
+    # OpenAI后端只使用第一个服务
+    stats = {key: sum(s.stats[key] for s in servers) for key in server.stats}
+    return {
+        "backend": backend,
+        "blocks": n_blocks,
+        "elapsed": elapsed,
+        "blocks_per_s": n_blocks / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "requests": stats["requests"],
+        "prompt_tokens": stats["prompt_tokens"],
+        "cached_ratio": stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0,
+        "retried": stats["errors"] + stats["rate_limited"],
+        "failed": failed
+    }
+
+
+def _translate_quietly(path: str, output_path: str, config, **kwargs) -> bytes:
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        generate_srt_translation(path, output_path, config, **kwargs)
+    with open(output_path, 'rb') as f:
+        return f.read()
+
+
+def check_consistency(backends, tmp: str, args) -> bool:
+    """对比串行逐块翻译与并发/批量/重复复用的输出，模拟服务的译文由原文确定，任何差异都说明顺序或对齐有误"""
+    path = os.path.join(tmp, "check.srt")
+    write_synthetic_srt(path, args.check_blocks)
+    server = MockLLMServer(latency=0.0).start()
+    prefix_layout = PrefixLayout(context_group=args.context_group) if args.prefix_layout else None
+    variants = {
+        "concurrent": dict(max_workers=args.workers),
+        "batch": dict(max_workers=args.workers, batch_size=max(2, args.batch_size)),
+        "dedup": dict(max_workers=args.workers, batch_size=args.batch_size, dedup=DuplicateIndex(max_words=None)),
+    }
+    ok = True
+    try:
+        for backend in backends:
+            config_class = ModelConfigOpenAI if backend == "openai" else ModelConfigOllama
+            config = config_class(api_url=server.url, model_id="mock", stream=args.stream)
+            common = dict(window_size=args.window_size, prefix_layout=prefix_layout)
+            expected = _translate_quietly(path, path + ".serial.srt", config, max_workers=1, **common)
+            for name, kwargs in variants.items():
+                output = _translate_quietly(path, path + f".{name}.srt", config, **common, **kwargs)
+                if output != expected:
+                    print(f"MISMATCH {backend}/{name}: output differs from serial translation")
+                    ok = False
+        print(f"consistency check ({args.check_blocks} blocks, {', '.join(variants)} vs serial): {'ok' if ok else 'FAILED'}")
+    finally:
+        server.stop()
+    return ok
+
+
+def run_all(servers: List[MockLLMServer], backends, tmp: str, args):
+    for n_blocks in args.blocks:
+        path = os.path.join(tmp, f"bench_{n_blocks}.srt")
+        write_synthetic_srt(path, n_blocks)
+        for backend in backends:
+            r = run_case(servers, backend, path, n_blocks, args)
+            print(f"{r['backend']:<8}{r['blocks']:>8}{r['elapsed']:>9.2f}{r['blocks_per_s']:>10.1f}{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+                  f"{r['requests']:>10}{r['prompt_tokens']:>12}{r['prompt_tokens'] / r['blocks']:>10.1f}{r['cached_ratio']:>9.0%}{r['retried']:>9}{r['failed']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--backend", choices=("openai", "ollama", "both"), default="both")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--window-size", type=int, default=5)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟服务每个请求的延迟（秒）")
+    parser.add_argument("--parallel", type=int, default=None, help="每个模拟服务同时处理的请求数，模拟GPU并行槽位")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--think-tokens", type=int, default=0)
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--retry-delay", type=float, default=0.05, help="客户端退避上限（秒）")
+    parser.add_argument("--hosts", type=int, default=1, help="模拟服务数量，大于1时Ollama后端使用多服务负载均衡")
+    parser.add_argument("--max-in-flight-per-host", type=int, default=None)
+    parser.add_argument("--prefix-layout", action="store_true", help="使用前缀缓存友好的提示词布局")
+    parser.add_argument("--context-group", type=int, default=20, help="前缀布局中共用同一份上下文的块数")
+    parser.add_argument("--prefix-cache", action="store_true", help="模拟服务端的提示词前缀缓存")
+    parser.add_argument("--check-blocks", type=int, default=200, help="一致性校验使用的字幕块数，0为跳过校验")
+    parser.add_argument("--prompt-token-latency", type=float, default=0.0, help="模拟服务按未命中缓存的提示词token追加的延迟（秒/token）")
+    args = parser.parse_args()
+
+    backends = ("openai", "ollama") if args.backend == "both" else (args.backend,)
+    header = f"{'backend':<8}{'blocks':>8}{'time(s)':>9}{'blocks/s':>10}{'p50(ms)':>9}{'p99(ms)':>9}{'requests':>10}{'prompt_tok':>12}{'tok/block':>10}{'cached%':>9}{'retried':>9}{'failed':>8}"
+    print(f"hosts={args.hosts} workers={args.workers} batch_size={args.batch_size} window_size={args.window_size} stream={args.stream} "
+          f"latency={args.latency}s parallel={args.parallel} error_rate={args.error_rate} rate_limit_rate={args.rate_limit_rate} think_tokens={args.think_tokens} "
+          f"prefix_layout={args.prefix_layout} prefix_cache={args.prefix_cache} prompt_token_latency={args.prompt_token_latency}")
+    if args.check_blocks:
+        with tempfile.TemporaryDirectory() as tmp:
+            if not check_consistency(backends, tmp, args):
+                raise SystemExit(1)
+    print(header)
+    servers = [MockLLMServer(latency=args.latency, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                             retry_after=0, think_tokens=args.think_tokens, parallel=args.parallel,
+                             prompt_token_latency=args.prompt_token_latency, prefix_cache=args.prefix_cache).start()
+               for _ in range(args.hosts)]
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            run_all(servers, backends, tmp, args)
+    finally:
+        for server in servers:
+            server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+本地模拟LLM服务，用于基准测试和离线调试
+用法: python benchmarks/mock_llm_server.py --port 8000 --latency 0.05 --error-rate 0.01 --rate-limit-rate 0.02 --think-tokens 50
+      python benchmarks/mock_llm_server.py --port 8000 --prefix-cache --prompt-token-latency 0.0002
+
+同时实现OpenAI兼容接口（POST /chat/completions，SSE流式）和Ollama接口（POST /api/chat，NDJSON流式），
+"译文"由原文逐字符确定性映射得到，能够识别批量翻译的[序号]格式
+延迟、错误率、429比例、<think>填充长度均可配置；是否出错只取决于提示词内容和该提示词的第几次请求，
+与并发顺序无关，同样的参数每次运行结果一致
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subtitle import estimate_tokens
+
+BATCH_HEADER = re.compile(r"每行以\[序号\]开头）：\n")
+BATCH_LINE = re.compile(r"^\[(\d+)\]\s*(.*)$")
+SINGLE_SOURCE = re.compile(r"(?:需要翻译的内容：|需翻译：)(.*)", re.S)
+
+
+def fake_translate(text: str) -> str:
+    """把字母确定性地映射为汉字，其余字符原样保留"""
+    return "".join(chr(0x4e00 + (ord(c) * 7) % 2000) if c.isalpha() else c for c in text)
+
+
+def fake_reply(prompt: str) -> str:
+    """按提示词格式生成回复：批量格式逐行保留[序号]，否则只翻译待翻译的原文"""
+    header = BATCH_HEADER.search(prompt)
+    if header:
+        lines = []
+        for line in prompt[header.end():].split("\n"):
+            match = BATCH_LINE.match(line)
+            if match:
+                lines.append(f"[{match.group(1)}] {fake_translate(match.group(2))}")
+        return "\n".join(lines)
+    match = SINGLE_SOURCE.search(prompt)
+    return fake_translate((match.group(1) if match else prompt).strip())
+
+
+class MockLLMServer:
+    '''
+    在后台线程中运行的模拟LLM服务
+    latency: 每个请求的基础延迟（秒）
+    per_token_latency: 按回复token数追加的延迟（秒/token）
+    error_rate: 返回500的比例
+    rate_limit_rate: 返回429（带Retry-After）的比例
+    retry_after: 429响应中的Retry-After秒数
+    think_tokens: 回复前附加的<think>推理段长度（token）
+    seed: 决定哪些请求出错的随机种子
+    parallel: 同时处理的请求数上限（模拟GPU并行槽位，如OLLAMA_NUM_PARALLEL），超出的请求排队，None为不限
+    prompt_token_latency: 按未命中缓存的提示词token数追加的延迟（秒/token，模拟prefill耗时）
+    prefix_cache: 模拟提示词前缀缓存：与最近几次请求的最长公共前缀视为命中，OpenAI接口在
+                  usage.prompt_tokens_details.cached_tokens中返回命中数，Ollama接口的prompt_eval_count只计未命中部分
+    Sample:
+    with MockLLMServer(latency=0.02, rate_limit_rate=0.05) as server:
+        config = ModelConfigOpenAI(api_url=server.url)
+        ...
+        print(server.stats)
+    '''
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        per_token_latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        think_tokens: int = 0,
+        seed: int = 0,
+        parallel: Optional[int] = None,
+        prompt_token_latency: float = 0.0,
+        prefix_cache: bool = False
+    ):
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.think_tokens = think_tokens
+        self.seed = seed
+        self.prompt_token_latency = prompt_token_latency
+        self.prefix_cache = prefix_cache
+        self._recent_prompts = deque(maxlen=parallel or 8)
+        self.stopped = False
+        self._slots = threading.BoundedSemaphore(parallel) if parallel else None
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "rate_limited": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止服务；已建立的keep-alive连接及正在处理的请求直接断开，不返回响应（模拟服务器宕机）"""
+        self.stopped = True
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_stats(self):
+        with self._lock:
+            for key in self.stats:
+                self.stats[key] = 0
+            self._attempts.clear()
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _cached_tokens(self, messages: list) -> int:
+        """与最近几次请求的完整提示词比较，最长公共前缀的token数即命中缓存的部分"""
+        if not self.prefix_cache:
+            return 0
+        full = "\n".join(f"{m.get('role')}:{m.get('content', '')}" for m in messages)
+        with self._lock:
+            common = max((len(os.path.commonprefix([full, previous])) for previous in self._recent_prompts), default=0)
+            self._recent_prompts.append(full)
+        return estimate_tokens(full[:common])
+
+    def _outcome(self, prompt: str) -> str:
+        """根据提示词及其重复请求次数确定本次返回ok/error/rate_limited"""
+        with self._lock:
+            attempt = self._attempts.get(prompt, 0)
+            self._attempts[prompt] = attempt + 1
+        digest = hashlib.blake2b(f"{self.seed}:{attempt}:{prompt}".encode("utf-8"), digest_size=8).digest()
+        roll = int.from_bytes(digest, "big") / 2 ** 64
+        if roll < self.rate_limit_rate:
+            return "rate_limited"
+        if roll < self.rate_limit_rate + self.error_rate:
+            return "error"
+        return "ok"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.endswith("/api/tags"):
+                    self._send_json(200, {"models": [{"name": "mock"}]})
+                else:
+                    self._send_json(404, {"error": f"unknown path {self.path}"})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                openai = self.path.endswith("/chat/completions")
+                if not openai and not self.path.endswith("/api/chat"):
+                    self._send_json(404, {"error": f"unknown path {self.path}"})
+                    return
+                messages = body.get("messages", [])
+                prompt = messages[-1]["content"] if messages else ""
+                prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+                server._count("requests")
+                server._count("prompt_tokens", prompt_tokens)
+
+                outcome = server._outcome(prompt)
+                if server._slots is not None:
+                    with server._slots:
+                        self._respond(body, openai, prompt, prompt_tokens, outcome)
+                else:
+                    self._respond(body, openai, prompt, prompt_tokens, outcome)
+
+            def _respond(self, body: dict, openai: bool, prompt: str, prompt_tokens: int, outcome: str):
+                cached_tokens = server._cached_tokens(body.get("messages", []))
+                server._count("cached_tokens", cached_tokens)
+                time.sleep(server.latency + server.prompt_token_latency * (prompt_tokens - cached_tokens))
+                if server.stopped:
+                    self.close_connection = True
+                    return
+                if outcome == "rate_limited":
+                    server._count("rate_limited")
+                    self._send_json(429, {"error": "rate limited"}, {"Retry-After": str(server.retry_after)})
+                    return
+                if outcome == "error":
+                    server._count("errors")
+                    self._send_json(500, {"error": "internal error"})
+                    return
+
+                reply = fake_reply(prompt)
+                think = "<think>" + "嗯" * server.think_tokens + "</think>" if server.think_tokens else ""
+                completion_tokens = estimate_tokens(reply) + server.think_tokens
+                server._count("completion_tokens", completion_tokens)
+                time.sleep(server.per_token_latency * completion_tokens)
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+                if server.prefix_cache:
+                    usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+                # Ollama复用KV缓存时prompt_eval_count只计实际计算的token
+                prompt_eval_count = prompt_tokens - cached_tokens
+                if body.get("stream"):
+                    self._stream(openai, think, reply, usage, prompt_eval_count, completion_tokens)
+                elif openai:
+                    self._send_json(200, {
+                        "choices": [{"message": {"role": "assistant", "content": think + reply}, "finish_reason": "stop"}],
+                        "usage": usage
+                    })
+                else:
+                    self._send_json(200, {
+                        "message": {"role": "assistant", "content": think + reply},
+                        "done": True,
+                        "prompt_eval_count": prompt_eval_count,
+                        "eval_count": completion_tokens
+                    })
+
+            def _stream(self, openai: bool, think: str, reply: str, usage: dict, prompt_eval_count: int, completion_tokens: int):
+                # 推理段整体一个分片计1个token过少，按字符拆分以便客户端的推理预算生效
+                pieces = list(think) + [reply[i:i + 4] for i in range(0, len(reply), 4)]
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream" if openai else "application/x-ndjson")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for piece in pieces:
+                        if openai:
+                            chunk = {"choices": [{"delta": {"content": piece}}]}
+                            self.wfile.write(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n")
+                        else:
+                            chunk = {"message": {"content": piece}, "done": False}
+                            self.wfile.write(json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n")
+                    if openai:
+                        final = {"choices": [], "usage": usage}
+                        self.wfile.write(b"data: " + json.dumps(final).encode("utf-8") + b"\n\ndata: [DONE]\n\n")
+                    else:
+                        final = {"message": {"content": ""}, "done": True, "prompt_eval_count": prompt_eval_count, "eval_count": completion_tokens}
+                        self.wfile.write(json.dumps(final).encode("utf-8") + b"\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客户端超出预算后主动断开
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--per-token-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--think-tokens", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--parallel", type=int, default=None)
+    parser.add_argument("--prompt-token-latency", type=float, default=0.0)
+    parser.add_argument("--prefix-cache", action="store_true")
+    args = parser.parse_args()
+
+    server = MockLLMServer(
+        args.host, args.port, args.latency, args.per_token_latency, args.error_rate,
+        args.rate_limit_rate, args.retry_after, args.think_tokens, args.seed, args.parallel,
+        args.prompt_token_latency, args.prefix_cache
+    )
+    print(f"Mock LLM server listening on {server.url} (OpenAI: {server.url}/chat/completions, Ollama: {server.url}/api/chat)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
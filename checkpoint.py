@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+
+def hash_source(text: str) -> str:
+    """计算原文哈希，用于校验日志条目与当前字幕是否一致"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class TranslationJournal:
+    '''
+    翻译断点日志（追加写入的JSONL文件）
+    每完成一个字幕块追加一行 {"index": 序号, "hash": 原文哈希, "translation": 译文}，
+    中断后重新运行时跳过日志中已完成且原文未变化的字幕块
+    Sample:
+    {"index": 12, "hash": "3f2a...", "translation": "你做了什么？"}
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[int, dict] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 进程被强制终止时最后一行可能不完整
+                    self._entries[entry["index"]] = entry
+        self._file = open(path, 'a', encoding='utf-8')
+        if self._file.tell() > 0 and not self._ends_with_newline():
+            self._file.write("\n")  # 隔开不完整的最后一行，避免与新记录粘连
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, index: int, source_text: str) -> Optional[str]:
+        """查询已完成的译文，原文哈希不一致时视为未完成"""
+        entry = self._entries.get(index)
+        if entry is None or entry["hash"] != hash_source(source_text):
+            return None
+        return entry["translation"]
+
+    def record(self, index: int, source_text: str, translation: str):
+        """追加一条已完成记录并立即落盘"""
+        entry = {"index": index, "hash": hash_source(source_text), "translation": translation}
+        with self._lock:
+            self._entries[index] = entry
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,116 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# 模糊归组时忽略的语气词
+FILLER_WORDS = {"um", "umm", "uh", "uhm", "er", "erm", "ah", "eh", "hmm", "mm"}
+
+_REPEATED_CHARS = re.compile(r"(.)\1{2,}")
+
+
+def normalize_text(text: str) -> str:
+    """
+    归一化字幕文本用于判断重复：统一全半角、忽略大小写、标点和多余空白
+    问句与陈述句的译文不同，末尾的问号保留为标记
+    Sample:
+    normalize_text("OK.") == normalize_text("ok") == "ok"
+    normalize_text("OK?") == "ok ?"
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    question = text.rstrip().endswith("?")
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    words = text.split()
+    if question:
+        words.append("?")
+    return " ".join(words)
+
+
+def fuzzy_key(text: str) -> str:
+    """在normalize_text基础上去掉语气词并压缩拉长的字母（"Sooo"视同"so"），只剩语气词时不去掉"""
+    words = [_REPEATED_CHARS.sub(r"\1", word) for word in normalize_text(text).split()]
+    kept = [word for word in words if word not in FILLER_WORDS]
+    return " ".join(kept or words)
+
+
+class SharedTranslation:
+    '''
+    一组重复字幕共用的译文，由代表句（第一次出现的那一条）所在的任务发布
+    '''
+    __slots__ = ("key", "started", "text", "_done")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.started = False
+        self.text: Optional[str] = None
+        self._done = threading.Event()
+
+    def result(self) -> Optional[str]:
+        """
+        代表句已开始翻译时等待其完成并返回译文；尚未开始翻译或翻译失败时返回None，由调用方自行翻译
+        只等待已开始的代表句，避免占用线程等待排在后面的任务
+        """
+        if not self.started:
+            return None
+        self._done.wait()
+        return self.text
+
+
+class DuplicateIndex:
+    '''
+    一次运行内的重复字幕索引：归一化后相同的短句只翻译第一次出现的那一条，其余出现复用其译文
+    可在多个文件（如批量处理的多集）间共用，多个线程共用
+    max_words: 只复用不超过该词数的短句（短句基本不依赖上下文，较长的句子译文随上下文变化），None为不限
+    fuzzy: 按fuzzy_key归组（额外忽略语气词和拉长的字母），否则按normalize_text归组
+    max_entries: 保留的不同短句数上限，超出后淘汰最久未出现的，内存占用与字幕总数无关
+    Sample:
+    dedup = DuplicateIndex(max_words=4)
+    generate_srt_translation("lecture.srt", "lecture.zh.srt", config, dedup=dedup)
+    '''
+    def __init__(self, max_words: Optional[int] = 4, fuzzy: bool = False, max_entries: int = 100000):
+        self.max_words = max_words
+        self.fuzzy = fuzzy
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, SharedTranslation]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, text: str) -> Optional[str]:
+        """计算归组键，不参与复用的字幕（空白、超过max_words）返回None"""
+        key = fuzzy_key(text) if self.fuzzy else normalize_text(text)
+        if not key or (self.max_words is not None and len(key.split()) > self.max_words):
+            return None
+        return key
+
+    def claim(self, texts: List[str]) -> Dict[int, Tuple[SharedTranslation, bool]]:
+        """
+        为一组（同一次请求中的）字幕登记代表句或查找已有的代表句，
+        返回 {位置: (共用译文, 是否为代表句)}；同一组内重复的字幕不互相复用
+        """
+        claims = {}
+        keys = set()
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = self.key(text)
+                if key is None or key in keys:
+                    continue
+                keys.add(key)
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    claims[i] = (entry, False)
+                    continue
+                entry = self._entries[key] = SharedTranslation(key)
+                claims[i] = (entry, True)
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return claims
+
+    def publish(self, entry: SharedTranslation, text: Optional[str]):
+        """发布代表句的译文，text为None（翻译失败）时移除该组，下一次出现重新作为代表句翻译"""
+        entry.text = text
+        if text is None:
+            with self._lock:
+                if self._entries.get(entry.key) is entry:
+                    del self._entries[entry.key]
+        entry._done.set()
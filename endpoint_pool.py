@@ -0,0 +1,195 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Set, TypeVar
+
+import requests
+
+from metrics import record_failure
+
+T = TypeVar("T")
+
+# 在某个服务上失败后换一台服务重发的HTTP状态码（服务端故障），429等仍交给RequestScheduler处理
+REISSUE_STATUS = {500, 502, 503, 504}
+
+
+@dataclass
+class Endpoint:
+    """一个服务端点的负载与健康状态"""
+    url: str
+    in_flight: int = 0
+    latency: Optional[float] = None  # 请求耗时的指数移动平均（秒），尚未测得时为None
+    completed: int = 0
+    failures: int = 0                # 累计失败次数
+    consecutive_failures: int = 0
+    healthy: bool = True
+    down_until: float = 0.0          # 标记为不可用后，到该时刻才允许再次试探
+    cooldown: float = 0.0
+    probing: bool = False            # 冷却结束后正在用一个请求试探
+
+
+class EndpointPool:
+    '''
+    多个服务端点（如多台Ollama服务器）的负载均衡池，多个线程共用
+    每个请求发往预计最快完成的端点：(在途请求数+1) * 耗时移动平均，尚未测得耗时的端点按已知的最快耗时估计
+    max_in_flight: 每个端点的最大在途请求数（一般设为服务端的OLLAMA_NUM_PARALLEL），None为不限；
+                   全部端点满载时等待空闲
+    连接失败或超时的端点立即标记为不可用，连续failure_threshold次5xx也标记为不可用；
+    不可用的端点冷却cooldown秒后放行一个试探请求，成功则恢复，失败则冷却时间加倍（最长max_cooldown秒）
+    在不可用端点上失败的请求立即改发到其他端点，不占用RequestScheduler的重试次数
+    Sample:
+    pool = EndpointPool(["http://gpu1:11434", "http://gpu2:11434", "http://gpu3:11434"], max_in_flight=4)
+    config = ModelConfigOllama(pool=pool, model_id="qwq:32b")
+    generate_srt_translation(..., config=config, max_workers=12)
+    print(pool.format_status())
+    '''
+    def __init__(
+        self,
+        urls: List[str],
+        max_in_flight: Optional[int] = None,
+        ewma_alpha: float = 0.3,
+        failure_threshold: int = 3,
+        cooldown: float = 5.0,
+        max_cooldown: float = 120.0
+    ):
+        if not urls:
+            raise ValueError("EndpointPool至少需要一个端点")
+        self.endpoints = [Endpoint(url.rstrip("/")) for url in urls]
+        self.max_in_flight = max_in_flight
+        self.ewma_alpha = ewma_alpha
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def _available(self, endpoint: Endpoint, now: float) -> bool:
+        if not endpoint.healthy:
+            # 冷却结束后只放行一个试探请求
+            return now >= endpoint.down_until and not endpoint.probing
+        return self.max_in_flight is None or endpoint.in_flight < self.max_in_flight
+
+    def _expected_latency(self, endpoint: Endpoint) -> float:
+        if endpoint.latency is not None:
+            return endpoint.latency
+        measured = [e.latency for e in self.endpoints if e.latency is not None]
+        return min(measured) if measured else 1.0
+
+    def acquire(self, exclude: Set[str] = frozenset()) -> Endpoint:
+        """
+        选出预计最快完成的端点并占用一个在途名额；全部端点满载或处于冷却时等待
+        除exclude外没有其他端点时抛出ConnectionError
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                candidates = [e for e in self.endpoints if e.url not in exclude]
+                if not candidates:
+                    raise requests.exceptions.ConnectionError("没有可用的服务端点")
+                available = [e for e in candidates if self._available(e, now)]
+                if available:
+                    endpoint = min(available, key=lambda e: ((e.in_flight + 1) * self._expected_latency(e), e.in_flight))
+                    if not endpoint.healthy:
+                        endpoint.probing = True
+                    endpoint.in_flight += 1
+                    return endpoint
+                # 等待其他请求归还名额，或最早结束冷却的端点可以试探
+                wake = min((e.down_until - now for e in candidates if not e.healthy), default=1.0)
+                self._condition.wait(timeout=min(1.0, max(0.01, wake)))
+
+    def release(self, endpoint: Endpoint, latency: float, ok: bool, fatal: bool = False):
+        """
+        归还在途名额并更新端点状态
+        ok: 请求是否成功；fatal: 失败是否说明端点已不可用（连接失败、超时）
+        """
+        with self._condition:
+            endpoint.in_flight -= 1
+            endpoint.probing = False
+            if ok:
+                endpoint.completed += 1
+                endpoint.consecutive_failures = 0
+                endpoint.healthy = True
+                endpoint.cooldown = 0.0
+                if endpoint.latency is None:
+                    endpoint.latency = latency
+                else:
+                    endpoint.latency += self.ewma_alpha * (latency - endpoint.latency)
+            else:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if fatal or not endpoint.healthy or endpoint.consecutive_failures >= self.failure_threshold:
+                    self._mark_down(endpoint)
+            self._condition.notify_all()
+
+    def _mark_down(self, endpoint: Endpoint):
+        if endpoint.healthy:
+            print(f"Endpoint {endpoint.url} marked unhealthy after {endpoint.consecutive_failures} failure(s)")
+        endpoint.healthy = False
+        endpoint.cooldown = min(self.max_cooldown, endpoint.cooldown * 2 if endpoint.cooldown else self.base_cooldown)
+        endpoint.down_until = time.monotonic() + endpoint.cooldown
+
+    def call(self, func: Callable[[str], T]) -> T:
+        """
+        在选出的端点上执行func(url)；端点连接失败、超时或返回5xx时改发到其余端点，
+        全部端点都失败后抛出最后一次异常
+        """
+        tried = set()
+        while True:
+            endpoint = self.acquire(tried)
+            started = time.monotonic()
+            try:
+                result = func(endpoint.url)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                self.release(endpoint, time.monotonic() - started, ok=False, fatal=True)
+                error = e
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                self.release(endpoint, time.monotonic() - started, ok=False)
+                if status not in REISSUE_STATUS:
+                    raise
+                error = e
+            except BaseException:
+                # 响应格式错误等与端点健康无关的失败
+                self.release(endpoint, time.monotonic() - started, ok=True)
+                raise
+            else:
+                self.release(endpoint, time.monotonic() - started, ok=True)
+                return result
+            tried.add(endpoint.url)
+            if len(tried) >= len(self.endpoints):
+                raise error
+            record_failure(time.monotonic() - started)
+            print(f"Request to {endpoint.url} failed ({error}), reissuing to another endpoint")
+
+    def check_health(self, session: requests.Session, path: str = "/api/tags", timeout: float = 5.0) -> List[str]:
+        """主动探测全部端点（默认请求Ollama的/api/tags），标记不可达或返回5xx的端点，返回可用端点列表"""
+        alive = []
+        for endpoint in self.endpoints:
+            try:
+                response = session.get(endpoint.url + path, timeout=timeout)
+                if response.status_code >= 500:
+                    response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                print(f"Endpoint {endpoint.url} health check failed: {e}")
+                with self._condition:
+                    endpoint.consecutive_failures += 1
+                    self._mark_down(endpoint)
+            else:
+                with self._condition:
+                    endpoint.healthy = True
+                    endpoint.consecutive_failures = 0
+                    endpoint.cooldown = 0.0
+                    self._condition.notify_all()
+                alive.append(endpoint.url)
+        return alive
+
+    def format_status(self) -> str:
+        with self._condition:
+            lines = [f"{'endpoint':<32}{'state':>10}{'in_flight':>10}{'done':>8}{'failed':>8}{'latency':>10}"]
+            for e in self.endpoints:
+                latency = f"{e.latency:.2f}s" if e.latency is not None else "-"
+                lines.append(f"{e.url:<32}{'up' if e.healthy else 'down':>10}{e.in_flight:>10}{e.completed:>8}{e.failures:>8}{latency:>10}")
+        return "\n".join(lines)
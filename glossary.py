@@ -0,0 +1,267 @@
+import json
+import os
+import re
+import threading
+from collections import Counter, deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from backends import get_backend
+from prompts import build_system_prompt
+from subtitle import CJK_PATTERN
+
+# 英文术语后可跟的复数词尾，"aileron"可匹配"ailerons"
+INFLECTIONS = ("s", "es")
+
+# 自动提取术语时忽略的常见大写词
+COMMON_WORDS = {"i", "ok", "okay", "tv", "mr", "mrs", "ms", "dr"}
+
+_CANDIDATE_PATTERN = re.compile(r"\b(?:[A-Z][a-z]+|[A-Z]{2,}s?)(?:[ -](?:[A-Z][a-z]+|[A-Z]{2,}s?))*\b")
+_WORD_SPLIT = re.compile(r"[ -]")
+_SENTENCE_START = re.compile(r"(?:^|[.!?。！？]\s+)$")
+
+
+def _is_word_char(ch: str) -> bool:
+    """字母数字（中日文除外）视为单词的一部分，英文术语须在单词边界处匹配"""
+    return ch.isalnum() and not CJK_PATTERN.match(ch)
+
+
+class TermMatcher:
+    '''
+    Aho-Corasick多模式匹配自动机：一次扫描找出文本中出现的全部术语，耗时与文本长度成线性，与术语数量无关
+    忽略大小写；以字母数字开头/结尾的术语须在单词边界处匹配（允许英文复数词尾），中日文术语不受此限制
+    Sample:
+    TermMatcher(["wing", "angle of attack"]).find("The wings stall at a high Angle of Attack.")
+    -> [(4, 9, "wing"), (26, 41, "angle of attack")]
+    '''
+    def __init__(self, terms: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._term: List[Optional[str]] = [None]   # 以该节点结尾的术语
+        self._output: List[int] = [0]              # 沿失败链最近的术语节点，0为没有
+        for term in terms:
+            self._insert(term)
+        self._build()
+
+    def _insert(self, term: str):
+        node = 0
+        for ch in term:
+            key = ch.lower()
+            child = self._goto[node].get(key)
+            if child is None:
+                child = len(self._goto)
+                self._goto[node][key] = child
+                self._goto.append({})
+                self._fail.append(0)
+                self._term.append(None)
+                self._output.append(0)
+            node = child
+        if node:
+            self._term[node] = term
+
+    def _build(self):
+        """按广度优先计算失败链和输出链"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for key, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and key not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(key, 0)
+                self._fail[child] = fail
+                self._output[child] = fail if self._term[fail] is not None else self._output[fail]
+                queue.append(child)
+
+    def _bounded_end(self, text: str, term: str, end: int) -> Optional[int]:
+        """检查匹配的单词边界，返回包含复数词尾的结束位置，不在边界上时返回None"""
+        if not _is_word_char(term[-1]) or end == len(text) or not _is_word_char(text[end]):
+            return end
+        for suffix in INFLECTIONS:
+            stop = end + len(suffix)
+            if text[end:stop].lower() == suffix and (stop == len(text) or not _is_word_char(text[stop])):
+                return stop
+        return None
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """返回文本中互不重叠的术语出现 [(起始, 结束, 术语)]，重叠时取最左、最长的"""
+        matches = []
+        node = 0
+        for pos, ch in enumerate(text):
+            key = ch.lower()
+            while node and key not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(key, 0)
+            hit = node if self._term[node] is not None else self._output[node]
+            while hit:
+                term = self._term[hit]
+                start = pos + 1 - len(term)
+                if not _is_word_char(term[0]) or start == 0 or not _is_word_char(text[start - 1]):
+                    end = self._bounded_end(text, term, pos + 1)
+                    if end is not None:
+                        matches.append((start, end, term))
+                hit = self._output[hit]
+        matches.sort(key=lambda match: (match[0], match[0] - match[1]))
+        selected = []
+        for match in matches:
+            if not selected or match[0] >= selected[-1][1]:
+                selected.append(match)
+        return selected
+
+
+class Glossary:
+    '''
+    术语表 {原文: 译文}：翻译时只把当前请求的原文中出现的术语注入提示词，
+    多集共用同一份术语表时术语译法前后一致，无需依赖很长的上下文窗口
+    可从文件加载（每行"原文<TAB>译文"或"原文 => 译文"，或JSON对象），也可由learn()从字幕中提取并请模型统一译法
+    多个线程共用，add()后自动机在下次匹配时重建
+    Sample:
+    glossary = Glossary.load("aviation_glossary.tsv")
+    generate_srt_translation("lecture.srt", "lecture_cn.srt", config, glossary=glossary, window_size=3)
+    '''
+    def __init__(self, terms: Optional[Dict[str, str]] = None):
+        self.terms: Dict[str, str] = {}
+        self._matcher: Optional[Tuple[TermMatcher, Dict[str, str]]] = None
+        self._lock = threading.Lock()
+        for source, target in (terms or {}).items():
+            self.add(source, target)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __contains__(self, source: str) -> bool:
+        return source.strip().lower() in self._folded()
+
+    def _folded(self) -> Dict[str, str]:
+        return {source.lower(): source for source in self.terms}
+
+    def add(self, source: str, target: str):
+        """添加或覆盖一条术语，忽略大小写相同的旧条目"""
+        source, target = source.strip(), target.strip()
+        if not source or not target:
+            return
+        with self._lock:
+            old = self._folded().get(source.lower())
+            if old is not None:
+                del self.terms[old]
+            self.terms[source] = target
+            self._matcher = None
+
+    def _get_matcher(self) -> Tuple[TermMatcher, Dict[str, str]]:
+        """返回自动机及构建时的术语快照，匹配期间其他线程add()不影响本次结果"""
+        with self._lock:
+            if self._matcher is None:
+                terms = dict(self.terms)
+                self._matcher = (TermMatcher(terms), terms)
+            return self._matcher
+
+    def match(self, texts: Iterable[str]) -> Dict[str, str]:
+        """返回texts中出现的术语 {原文: 译文}，按首次出现的顺序"""
+        matcher, terms = self._get_matcher()
+        matched = {}
+        for text in texts:
+            for _, _, term in matcher.find(text):
+                if term not in matched:
+                    matched[term] = terms[term]
+        return matched
+
+    @classmethod
+    def load(cls, path: str) -> "Glossary":
+        """从文件加载术语表，文件不存在时返回空术语表"""
+        glossary = cls()
+        if not os.path.exists(path):
+            return glossary
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith(".json"):
+                for source, target in json.load(f).items():
+                    glossary.add(source, target)
+                return glossary
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                source, sep, target = line.partition("\t") if "\t" in line else line.partition("=>")
+                if sep:
+                    glossary.add(source, target)
+        return glossary
+
+    def save(self, path: str):
+        """按原文排序写入文件（.json为JSON对象，其余为TSV），先写临时文件再替换"""
+        terms = dict(sorted(self.terms.items(), key=lambda item: item[0].lower()))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if path.endswith(".json"):
+                json.dump(terms, f, ensure_ascii=False, indent=2)
+            else:
+                f.writelines(f"{source}\t{target}\n" for source, target in terms.items())
+        os.replace(tmp_path, path)
+
+    def learn(self, config, texts: Iterable[str], domain: Optional[str] = None, min_count: int = 3,
+              max_terms: int = 200) -> Dict[str, str]:
+        """从字幕文本中提取尚未收录的候选术语，请模型给出统一译法并加入术语表，返回新增的术语"""
+        candidates = [term for term in extract_terms(texts, min_count, max_terms) if term not in self]
+        learned = learn_terms(config, candidates, domain)
+        for source, target in learned.items():
+            self.add(source, target)
+        return learned
+
+
+def extract_terms(texts: Iterable[str], min_count: int = 3, max_terms: int = 200) -> List[str]:
+    """
+    提取候选术语：出现至少min_count次的专有名词短语（首字母大写的词组）和缩写词，按出现次数降序
+    句首的大写词（"The"、"So"）多半只是普通词：句首短语的第一个词从未在句中以大写出现时去掉
+    """
+    found = []           # (短语, 是否位于句首)
+    capitalized = set()  # 在句中以大写出现过的词
+    for text in texts:
+        for match in _CANDIDATE_PATTERN.finditer(text):
+            at_start = bool(_SENTENCE_START.search(text[:match.start()]))
+            words = _WORD_SPLIT.split(match.group(0))
+            capitalized.update(word.lower() for word in words[at_start:])
+            found.append((match.group(0), at_start))
+    counts = Counter()
+    spellings = {}
+    for term, at_start in found:
+        if at_start:
+            first = _WORD_SPLIT.split(term, maxsplit=1)[0]
+            if first.lower() not in capitalized:
+                term = term[len(first) + 1:]
+        key = term.lower()
+        if not key or key in COMMON_WORDS:
+            continue
+        counts[key] += 1
+        spellings.setdefault(key, term)
+    return [spellings[key] for key, count in counts.most_common(max_terms) if count >= min_count]
+
+
+def parse_term_lines(text: str, terms: Iterable[str]) -> Dict[str, str]:
+    """解析模型输出的"原文 => 译文"行，只保留请求中的术语（忽略大小写）"""
+    wanted = {term.lower(): term for term in terms}
+    parsed = {}
+    for line in text.splitlines():
+        source, sep, target = line.partition("=>")
+        term = wanted.get(source.strip(" -*\t").lower())
+        if sep and term is not None and target.strip():
+            parsed[term] = target.strip()
+    return parsed
+
+
+def learn_terms(config, terms: List[str], domain: Optional[str] = None, batch_size: int = 50) -> Dict[str, str]:
+    """请模型按当前领域翻译术语列表，每次请求batch_size个，请求失败的一批跳过"""
+    backend = get_backend(config)
+    learned = {}
+    for start in range(0, len(terms), batch_size):
+        batch = terms[start:start + batch_size]
+        messages = [
+            {"role": "system", "content": build_system_prompt(domain, "")},
+            {"role": "user", "content": (
+                "请给出以下术语在当前领域的标准中文译法，每行输出\"原文 => 译文\"，不要添加任何解释：\n"
+                + "\n".join(batch)
+            )}
+        ]
+        try:
+            result = backend.scheduler.call(lambda: backend.chat(messages, 32 * len(batch)))
+        except Exception as e:
+            print(f"Error learning terms {batch[0]}...{batch[-1]}: {str(e)}")
+            continue
+        learned.update(parse_term_lines(result.text, batch))
+    return learned
@@ -0,0 +1,16 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def build_session(pool_connections: int = 4, pool_maxsize: int = 16, pool_block: bool = True) -> requests.Session:
+    '''
+    创建复用TCP/TLS连接的HTTP会话（keep-alive连接池）
+    pool_connections: 缓存连接池的主机数量
+    pool_maxsize: 每个主机保留的最大连接数
+    pool_block: 连接数达到上限时等待空闲连接，而不是临时新建连接
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -0,0 +1,360 @@
+"""
+视频压制：把双语字幕烧录进视频
+先按关键帧无损切分视频，再为每段生成平移到该段起点的字幕切片，多个ffmpeg进程并行压制各段，最后无损拼接
+长视频的压制耗时随CPU核数近似线性缩短；压制后的分段同时作为分段输出（split_000.mp4...），取代原先的分段命令
+用法:
+    burn_subtitles("ep01.mp4", "output/ep01/merged.srt", "output/ep01/ep01_bilingual.mp4", MediaConfig(max_workers=8))
+"""
+import csv
+import functools
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from tqdm import tqdm
+
+from subtitle import SubtitleBlock, parse_srt, save_srt
+
+# 按优先级尝试的硬件H.264编码器，均不可用（未编译或没有对应硬件）时使用libx264
+HARDWARE_ENCODERS = ("h264_nvenc", "h264_qsv", "h264_videotoolbox", "h264_amf")
+SOFTWARE_ENCODER = "libx264"
+# 检查是否需要终止ffmpeg进程的间隔（秒）
+ABORT_POLL_INTERVAL = 0.2
+
+
+class MediaError(RuntimeError):
+    """ffmpeg/ffprobe执行失败"""
+
+
+class MediaCancelled(MediaError):
+    """其他分段失败，本段的ffmpeg进程被终止"""
+
+
+@dataclass
+class MediaConfig:
+    '''
+    压制配置
+    encoder: 视频编码器，None为自动检测（依次尝试HARDWARE_ENCODERS，实际编码一帧确认可用，否则用libx264）
+    max_workers: 同时运行的ffmpeg进程数，默认为CPU核数；每个libx264进程使用 核数/max_workers 个线程
+    hardware_max_workers: 使用硬件编码器时同时运行的ffmpeg进程数上限（消费级显卡同时编码的会话数有限，
+                          如NVENC超出时ffmpeg直接失败；编码单元也不会因更多进程而更快），见burn_workers
+    segment_time: 切分的目标时长（秒），实际在关键帧处切开
+    keep_segments: 是否保留压制后的各段（输出目录下的split_000.mp4...）
+    subtitle_style: ASS样式覆盖，如"FontName=Noto Sans CJK SC,FontSize=20"
+    '''
+    ffmpeg: str = "ffmpeg"
+    ffprobe: str = "ffprobe"
+    encoder: Optional[str] = None
+    bitrate: str = "8000k"          # 硬件编码器的码率
+    crf: int = 20                   # libx264的质量参数
+    preset: str = "veryfast"        # libx264的速度预设
+    segment_time: float = 290
+    max_workers: int = field(default_factory=lambda: os.cpu_count() or 1)
+    hardware_max_workers: int = 2
+    keep_segments: bool = True
+    subtitle_style: Optional[str] = None
+
+
+def _tail(path: str, lines: int = 5) -> str:
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return "".join(f.readlines()[-lines:]).strip()
+    except OSError:
+        return ""
+
+
+def run_ffmpeg(
+    args: List[str],
+    log_path: str,
+    on_progress: Optional[Callable[[float], None]] = None,
+    abort: Optional[threading.Event] = None,
+    cwd: Optional[str] = None
+):
+    """
+    运行ffmpeg子进程，错误输出写入log_path，失败时抛出MediaError（附日志末尾几行）
+    on_progress: 接收已处理的秒数，由"-progress pipe:1"的输出解析
+    abort: 置位后终止子进程（其他分段失败时），已置位时不启动子进程
+    """
+    if abort is not None and abort.is_set():
+        raise MediaCancelled("已取消")
+    args = args[:1] + ["-hide_banner", "-nostdin", "-y", "-loglevel", "error", "-progress", "pipe:1", "-nostats"] + args[1:]
+    with open(log_path, 'w', encoding='utf-8') as log:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=log, cwd=cwd, text=True)
+        finished = threading.Event()
+
+        def _watch():
+            # 进度输出可能长时间停顿（如读取大文件头），由单独的线程响应abort
+            while not finished.is_set():
+                if abort.wait(ABORT_POLL_INTERVAL):
+                    process.kill()
+                    return
+
+        if abort is not None:
+            threading.Thread(target=_watch, daemon=True).start()
+        try:
+            for line in process.stdout:
+                key, _, value = line.strip().partition("=")
+                if key == "out_time_us" and on_progress is not None and value.isdigit():
+                    on_progress(int(value) / 1e6)
+            returncode = process.wait()
+        finally:
+            finished.set()
+            # 异常（包括KeyboardInterrupt）时不留下孤儿进程
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+    if abort is not None and abort.is_set():
+        raise MediaCancelled("已取消")
+    if returncode != 0:
+        raise MediaError(f"ffmpeg退出码{returncode}: {_tail(log_path)}")
+
+
+@functools.lru_cache(maxsize=None)
+def available_encoders(ffmpeg: str = "ffmpeg") -> frozenset:
+    """ffmpeg编译时包含的视频编码器"""
+    try:
+        output = subprocess.run([ffmpeg, "-hide_banner", "-encoders"], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise MediaError(f"无法运行{ffmpeg}: {e}")
+    encoders = set()
+    for line in output.splitlines():
+        parts = line.split()
+        # 形如" V....D libx264   libx264 H.264 / AVC ..."
+        if len(parts) >= 2 and parts[0].startswith("V") and len(parts[0]) == 6:
+            encoders.add(parts[1])
+    return frozenset(encoders)
+
+
+@functools.lru_cache(maxsize=None)
+def encoder_works(ffmpeg: str, encoder: str) -> bool:
+    """实际编码一帧测试编码器：硬件编码器在没有对应显卡/驱动的机器上同样会被列出"""
+    args = [ffmpeg, "-hide_banner", "-nostdin", "-loglevel", "error", "-f", "lavfi", "-i", "color=black:s=256x256:d=0.1",
+            "-frames:v", "1", "-c:v", encoder, "-f", "null", "-"]
+    try:
+        return subprocess.run(args, capture_output=True, timeout=30).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def detect_encoder(config: MediaConfig) -> str:
+    """选择编码器：优先使用配置指定的，其次第一个可用的硬件编码器，最后libx264"""
+    if config.encoder:
+        return config.encoder
+    encoders = available_encoders(config.ffmpeg)
+    for encoder in HARDWARE_ENCODERS:
+        if encoder in encoders and encoder_works(config.ffmpeg, encoder):
+            return encoder
+    if SOFTWARE_ENCODER not in encoders:
+        raise MediaError(f"{config.ffmpeg}未包含{SOFTWARE_ENCODER}，也没有可用的硬件编码器")
+    return SOFTWARE_ENCODER
+
+
+def burn_workers(config: MediaConfig, encoder: Optional[str] = None) -> int:
+    """同时压制的分段数：libx264为config.max_workers，硬件编码器不超过config.hardware_max_workers"""
+    encoder = encoder or detect_encoder(config)
+    workers = max(1, config.max_workers)
+    return workers if encoder == SOFTWARE_ENCODER else min(workers, max(1, config.hardware_max_workers))
+
+
+def encoder_args(encoder: str, config: MediaConfig, threads: int) -> List[str]:
+    if encoder == SOFTWARE_ENCODER:
+        return ["-c:v", encoder, "-preset", config.preset, "-crf", str(config.crf), "-threads", str(threads)]
+    return ["-c:v", encoder, "-b:v", config.bitrate]
+
+
+def probe_duration(video_path: str, ffprobe: str = "ffprobe") -> float:
+    """视频时长（秒）"""
+    args = [ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", video_path]
+    try:
+        output = subprocess.run(args, capture_output=True, text=True, check=True).stdout
+        return float(output.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+        raise MediaError(f"无法读取视频时长{video_path}: {e}")
+
+
+def parse_segment_list(path: str, work_dir: str) -> List[Tuple[str, float, float]]:
+    """解析ffmpeg segment的csv列表，返回 [(分段路径, 起始秒, 结束秒)]"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return [(os.path.join(work_dir, row[0]), float(row[1]), float(row[2])) for row in csv.reader(f) if row]
+
+
+def split_video(video_path: str, work_dir: str, config: MediaConfig) -> List[Tuple[str, float, float]]:
+    """按关键帧无损切分视频（不重新编码），返回各段及其在原视频中的起止时间"""
+    list_path = os.path.join(work_dir, "segments.csv")
+    run_ffmpeg([
+        config.ffmpeg, "-i", os.path.abspath(video_path), "-map", "0:v:0", "-map", "0:a?", "-c", "copy",
+        "-f", "segment", "-segment_time", str(config.segment_time), "-reset_timestamps", "1",
+        "-segment_list", "segments.csv", "-segment_list_type", "csv", "part_%03d.mp4"
+    ], os.path.join(work_dir, "split.log"), cwd=work_dir)
+    return parse_segment_list(list_path, work_dir)
+
+
+def slice_srt(blocks: Iterable[SubtitleBlock], start_ms: int, end_ms: int) -> List[SubtitleBlock]:
+    """
+    截取与[start_ms, end_ms)重叠的字幕并平移到以start_ms为0点，跨越边界的字幕截断到区间内，序号从1重新编号
+    Sample:
+    00:04:48,000 --> 00:04:53,000 在[0, 290000)与[290000, 580000)两段中分别为
+    00:04:48,000 --> 00:04:50,000 和 00:00:00,000 --> 00:00:03,000
+    """
+    sliced = []
+    for block in blocks:
+        if block.start_ms is None or block.end_ms <= start_ms or block.start_ms >= end_ms:
+            continue
+        sliced.append(SubtitleBlock(
+            index=len(sliced) + 1,
+            timeline="",
+            text="\n".join(block.lines),
+            start_ms=max(block.start_ms, start_ms) - start_ms,
+            end_ms=min(block.end_ms, end_ms) - start_ms
+        ))
+    return sliced
+
+
+def _subtitles_filter(srt_filename: str, config: MediaConfig) -> str:
+    # 在字幕所在目录运行ffmpeg并只传文件名，避免滤镜参数中路径的转义问题
+    if config.subtitle_style:
+        return f"subtitles={srt_filename}:force_style='{config.subtitle_style}'"
+    return f"subtitles={srt_filename}"
+
+
+def burn_segment(
+    video_path: str,
+    srt_path: str,
+    output_path: str,
+    encoder: str,
+    config: MediaConfig,
+    threads: int = 0,
+    on_progress: Optional[Callable[[float], None]] = None,
+    abort: Optional[threading.Event] = None
+):
+    """把字幕烧录进一段视频，音频直接复制"""
+    run_ffmpeg(
+        [config.ffmpeg, "-i", os.path.abspath(video_path), "-vf", _subtitles_filter(os.path.basename(srt_path), config)]
+        + encoder_args(encoder, config, threads) + ["-c:a", "copy", os.path.abspath(output_path)],
+        os.path.splitext(output_path)[0] + ".log",
+        on_progress,
+        abort,
+        cwd=os.path.dirname(os.path.abspath(srt_path))
+    )
+
+
+def concat_segments(paths: List[str], output_path: str, work_dir: str, config: MediaConfig):
+    """无损拼接各段（concat demuxer）"""
+    list_path = os.path.join(work_dir, "concat.txt")
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    run_ffmpeg([config.ffmpeg, "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", os.path.abspath(output_path)],
+               os.path.join(work_dir, "concat.log"))
+
+
+def burn_subtitles(
+    video_path: str,
+    srt_path: str,
+    output_path: str,
+    config: Optional[MediaConfig] = None,
+    executor: Optional[ThreadPoolExecutor] = None,
+    work_dir: Optional[str] = None,
+    progress_desc: Optional[str] = None,
+    max_workers: Optional[int] = None
+) -> List[str]:
+    """
+    把字幕烧录进视频，输出到output_path
+    视频长于一个分段时先切分，各段在线程池中并行压制（每段一个ffmpeg进程），完成后拼接；
+    任一段失败时取消尚未开始的分段、终止其余ffmpeg进程并抛出MediaError，临时文件保留在work_dir中便于排查
+    executor: 多个视频共用的线程池，同时运行的ffmpeg进程数由该线程池限制
+    max_workers: 同时压制的分段数，用于分配每个进程的线程数；传入executor时应为其线程数，默认为burn_workers(config)
+    work_dir: 临时目录，默认为output_path + ".parts"，成功后删除
+    返回输出的文件：output_path，以及keep_segments时的各段（与output_path同目录的split_000.mp4...）
+    """
+    config = config or MediaConfig()
+    encoder = detect_encoder(config)
+    duration = probe_duration(video_path, config.ffprobe)
+    work_dir = work_dir or output_path + ".parts"
+    os.makedirs(work_dir, exist_ok=True)
+    workers = max(1, max_workers or burn_workers(config, encoder))
+    print(f"Burning {video_path} ({duration / 60:.1f} min) with {encoder}, {workers} workers")
+
+    if duration > config.segment_time * 1.5:
+        segments = split_video(video_path, work_dir, config)
+    else:
+        segments = [(os.path.abspath(video_path), 0.0, duration)]
+    blocks = parse_srt(srt_path)
+    jobs = []
+    lengths = []
+    for i, (segment_path, start, end) in enumerate(segments):
+        # 最后一段的结束时间取视频时长，包含所有剩余字幕
+        end = duration if i == len(segments) - 1 else end
+        segment_srt = os.path.join(work_dir, f"part_{i:03d}.srt")
+        save_srt(segment_srt, slice_srt(blocks, round(start * 1000), round(end * 1000)))
+        jobs.append((segment_path, segment_srt, os.path.join(work_dir, f"burned_{i:03d}.mp4")))
+        lengths.append(end - start)
+
+    # 各进程平分CPU核数，只有一段时单个进程使用全部核
+    threads = max(1, (os.cpu_count() or 1) // min(workers, len(jobs)))
+    lock = threading.Lock()
+    done = [0.0] * len(jobs)
+    abort = threading.Event()
+    progress = tqdm(total=duration, desc=progress_desc or os.path.basename(video_path),
+                    bar_format="{l_bar}{bar}| {n:.0f}/{total:.0f}s [{elapsed}<{remaining}]")
+
+    def _burn(i: int):
+        def _progress(seconds: float):
+            seconds = min(seconds, lengths[i])
+            with lock:
+                progress.update(max(0.0, seconds - done[i]))
+                done[i] = max(done[i], seconds)
+        try:
+            # 其他分段已失败时，排队中的分段不再启动ffmpeg
+            if abort.is_set():
+                raise MediaCancelled("已取消")
+            burn_segment(*jobs[i], encoder, config, threads, _progress, abort)
+            _progress(lengths[i])
+        except Exception:
+            abort.set()
+            raise
+
+    own_executor = None
+    if executor is None:
+        own_executor = executor = ThreadPoolExecutor(max_workers=workers)
+    futures = []
+    try:
+        futures = [executor.submit(_burn, i) for i in range(len(jobs))]
+        _, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        if pending:
+            # 有分段失败：取消排队中的分段，等待正在运行的分段随abort终止
+            abort.set()
+            for future in pending:
+                future.cancel()
+            wait(pending)
+        errors = [future.exception() for future in futures if not future.cancelled() and future.exception() is not None]
+        if errors:
+            # 报告最先失败的原因，而不是随后被终止的分段
+            raise next((e for e in errors if not isinstance(e, MediaCancelled)), errors[0])
+    finally:
+        abort.set()
+        for future in futures:
+            future.cancel()
+        progress.close()
+        if own_executor is not None:
+            own_executor.shutdown(wait=True)
+
+    burned = [output for _, _, output in jobs]
+    if len(burned) == 1:
+        os.replace(burned[0], output_path)
+        outputs = [output_path]
+    else:
+        concat_segments(burned, output_path, work_dir, config)
+        outputs = [output_path]
+        if config.keep_segments:
+            output_dir = os.path.dirname(os.path.abspath(output_path))
+            for i, path in enumerate(burned):
+                outputs.append(os.path.join(output_dir, f"split_{i:03d}.mp4"))
+                os.replace(path, outputs[-1])
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return outputs
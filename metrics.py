@@ -0,0 +1,350 @@
+import json
+import math
+import os
+import threading
+import time
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional
+
+_local = threading.local()
+
+
+@dataclass
+class RequestMetrics:
+    '''
+    一次翻译调用（单个字幕块或一批字幕块）的指标
+    同一次调用中的重试累加到同一条记录；token数优先取接口返回的usage/eval_count，
+    接口未返回时按估算值填充并标记estimated
+    '''
+    file: str
+    first_index: int
+    last_index: int
+    blocks: int = 1                 # 本次调用完成翻译的块数，批量回复未对齐时为0
+    kind: str = "block"             # block/batch
+    queue_wait: float = 0.0         # 从提交到开始处理的排队时间（秒）
+    http_latency: float = 0.0       # 各次HTTP请求耗时之和（秒），含重试
+    requests: int = 0
+    retries: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0      # 含推理段
+    think_tokens: int = 0
+    cached_tokens: int = 0          # 命中提示词缓存的token数（接口返回时）
+    ttft: Optional[float] = None
+    estimated: bool = False
+    failed: int = 0                 # 失败的字幕块数
+    timestamp: float = 0.0
+
+
+def current() -> Optional[RequestMetrics]:
+    """当前线程正在记录的指标，不在记录范围内时为None"""
+    return getattr(_local, "metrics", None)
+
+
+@contextmanager
+def track(metrics: RequestMetrics):
+    """在with块内把本线程的HTTP请求和重试记录到metrics"""
+    previous = current()
+    _local.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        _local.metrics = previous
+
+
+def record_response(latency: float, prompt_tokens: Optional[int], completion_tokens: Optional[int],
+                    think_tokens: int = 0, ttft: Optional[float] = None, estimated: bool = False,
+                    cached_tokens: Optional[int] = None):
+    metrics = current()
+    if metrics is None:
+        return
+    metrics.requests += 1
+    metrics.http_latency += latency
+    metrics.prompt_tokens += prompt_tokens or 0
+    metrics.completion_tokens += completion_tokens or 0
+    metrics.think_tokens += think_tokens
+    metrics.cached_tokens += cached_tokens or 0
+    metrics.estimated = metrics.estimated or estimated
+    if ttft is not None and metrics.ttft is None:
+        metrics.ttft = ttft
+
+
+def record_failure(latency: float):
+    """记录一次失败的HTTP请求（随后会重试或放弃）"""
+    metrics = current()
+    if metrics is not None:
+        metrics.requests += 1
+        metrics.http_latency += latency
+
+
+def record_retry():
+    metrics = current()
+    if metrics is not None:
+        metrics.retries += 1
+
+
+SUMMED_FIELDS = ("blocks", "requests", "retries", "prompt_tokens", "completion_tokens", "think_tokens", "cached_tokens", "failed")
+
+
+class _Histogram:
+    '''
+    对数分桶的耗时直方图，桶数固定，内存占用与记录次数无关，可直接按桶合并
+    第0个桶为不超过MIN_SECONDS的耗时（按0计），第i个桶为(MIN_SECONDS*GROWTH**(i-1), MIN_SECONDS*GROWTH**i]，
+    最后一个桶兼收更大的值；分位数取所在桶的几何中点，相对误差约5%，总和与次数精确累计
+    '''
+    __slots__ = ("counts", "count", "sum")
+    MIN_SECONDS = 0.001
+    GROWTH = 1.1
+    BUCKETS = 160   # 最后一个桶的下界约为1.1**158毫秒，即约3.4小时
+
+    def __init__(self):
+        self.counts = array("q", bytes(8 * self.BUCKETS))
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value: float, n: int = 1):
+        """记录n次耗时均为value的观测"""
+        self.count += n
+        self.sum += value * n
+        if value <= self.MIN_SECONDS:
+            bucket = 0
+        else:
+            bucket = min(self.BUCKETS - 1, 1 + int(math.log(value / self.MIN_SECONDS) / math.log(self.GROWTH)))
+        self.counts[bucket] += n
+
+    def merge(self, other: "_Histogram"):
+        for bucket, n in enumerate(other.counts):
+            if n:
+                self.counts[bucket] += n
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> float:
+        """第q分位数（与对排好序的观测取第int(q*count)个一致），没有观测时为0"""
+        if not self.count:
+            return 0.0
+        rank = min(self.count - 1, int(q * self.count))
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if seen > rank:
+                break
+        if bucket == 0:
+            return 0.0
+        return self.MIN_SECONDS * self.GROWTH ** (bucket - 0.5)
+
+
+class _FileStats:
+    '''
+    单个文件的指标累计值
+    不保留每条调用记录，计数直接累加，分位数所需的耗时记录在固定大小的直方图中
+    '''
+    __slots__ = ("calls", "totals", "estimated", "latencies", "queue_waits", "ttfts")
+
+    def __init__(self):
+        self.calls = 0
+        self.totals = Counter()
+        self.estimated = False
+        self.latencies = _Histogram()   # 单个HTTP请求的耗时，每次调用按其平均耗时计入请求数次
+        self.queue_waits = _Histogram()
+        self.ttfts = _Histogram()
+
+    def add(self, record: RequestMetrics):
+        self.calls += 1
+        for name in SUMMED_FIELDS:
+            self.totals[name] += getattr(record, name)
+        self.estimated = self.estimated or record.estimated
+        if record.requests:
+            self.latencies.add(record.http_latency / record.requests, record.requests)
+        self.queue_waits.add(record.queue_wait)
+        if record.ttft is not None:
+            self.ttfts.add(record.ttft)
+
+    def merge(self, other: "_FileStats"):
+        self.calls += other.calls
+        self.totals.update(other.totals)
+        self.estimated = self.estimated or other.estimated
+        self.latencies.merge(other.latencies)
+        self.queue_waits.merge(other.queue_waits)
+        self.ttfts.merge(other.ttfts)
+
+
+class MetricsCollector:
+    '''
+    翻译任务的指标汇总，多个线程（及批量任务中的多个文件）共用
+    jsonl_path: 每条调用记录追加写入的JSONL文件
+    prometheus_path: Prometheus textfile格式的汇总指标文件（供node_exporter的textfile collector读取），
+                     每写入flush_every条记录及结束时整体重写
+    Sample:
+    metrics = MetricsCollector(jsonl_path="run.metrics.jsonl", prometheus_path="/var/lib/node_exporter/srt.prom")
+    generate_srt_translation(..., metrics=metrics, verbose=False)
+    metrics.close()
+    '''
+    def __init__(self, jsonl_path: Optional[str] = None, prometheus_path: Optional[str] = None,
+                 model_id: str = "", flush_every: int = 100):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.model_id = model_id
+        self.flush_every = flush_every
+        self.started_at = time.monotonic()
+        self.calls = 0
+        self.stats: Dict[str, _FileStats] = {}  # 文件 -> 累计值
+        self.hits = Counter()               # (文件, 来源) -> 字幕块数，来源为cache/journal/dedup
+        self.saved_calls = Counter()        # 文件 -> 因复用重复字幕而省下的模型调用数
+        self.video_ms: Dict[str, int] = {}  # 文件 -> 字幕覆盖的视频时长（毫秒）
+        self._lock = threading.Lock()
+        self._file = open(jsonl_path, 'a', encoding='utf-8') if jsonl_path else None
+
+    def set_video_duration(self, file: str, duration_ms: int):
+        with self._lock:
+            self.video_ms[file] = duration_ms
+
+    def count_hits(self, file: str, source: str, blocks: int):
+        if blocks:
+            with self._lock:
+                self.hits[(file, source)] += blocks
+
+    def count_saved_calls(self, file: str, calls: int):
+        if calls:
+            with self._lock:
+                self.saved_calls[file] += calls
+
+    def add(self, record: RequestMetrics):
+        record.timestamp = time.time()
+        with self._lock:
+            self.calls += 1
+            self.stats.setdefault(record.file, _FileStats()).add(record)
+            if self._file is not None:
+                self._file.write(json.dumps(asdict(record), ensure_ascii=False) + "\n")
+                self._file.flush()
+            flush = self.prometheus_path and self.calls % self.flush_every == 0
+        if flush:
+            self.write_prometheus()
+
+    def summary(self, file: Optional[str] = None) -> dict:
+        """汇总指标，file为None时汇总全部文件"""
+        with self._lock:
+            stats = _FileStats()
+            for name, file_stats in self.stats.items():
+                if file is None or name == file:
+                    stats.merge(file_stats)
+            hits = Counter()
+            for (f, source), n in self.hits.items():
+                if file is None or f == file:
+                    hits[source] += n
+            saved_calls = sum(n for f, n in self.saved_calls.items() if file is None or f == file)
+            video_ms = self.video_ms.get(file, 0) if file is not None else sum(self.video_ms.values())
+        totals = stats.totals
+        model_blocks = totals["blocks"]
+        blocks = model_blocks + sum(hits.values())
+        prompt_tokens = totals["prompt_tokens"]
+        completion_tokens = totals["completion_tokens"]
+        think_tokens = totals["think_tokens"]
+        cached_tokens = totals["cached_tokens"]
+        video_minutes = video_ms / 60000
+        elapsed = time.monotonic() - self.started_at
+        latencies = stats.latencies
+        ttfts = stats.ttfts
+        return {
+            "blocks": blocks,
+            "model_blocks": model_blocks,
+            "cache_hits": hits.get("cache", 0),
+            "journal_hits": hits.get("journal", 0),
+            "dedup_hits": hits.get("dedup", 0),
+            "calls": stats.calls,
+            "saved_calls": saved_calls,
+            "requests": totals["requests"],
+            "retries": totals["retries"],
+            "failed_blocks": totals["failed"],
+            "elapsed": elapsed,
+            "blocks_per_s": blocks / elapsed if elapsed else 0.0,
+            "http_latency_p50": latencies.quantile(0.5),
+            "http_latency_p99": latencies.quantile(0.99),
+            "http_latency_sum": latencies.sum,
+            "http_latency_count": latencies.count,
+            "queue_wait_p50": stats.queue_waits.quantile(0.5),
+            "queue_wait_p99": stats.queue_waits.quantile(0.99),
+            "queue_wait_sum": stats.queue_waits.sum,
+            "queue_wait_count": stats.queue_waits.count,
+            "ttft_p50": ttfts.quantile(0.5) if ttfts.count else None,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "cached_ratio": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+            "completion_tokens": completion_tokens,
+            "think_tokens": think_tokens,
+            "think_overhead": think_tokens / completion_tokens if completion_tokens else 0.0,
+            "tokens_estimated": stats.estimated,
+            "video_minutes": video_minutes,
+            "tokens_per_video_minute": (prompt_tokens + completion_tokens) / video_minutes if video_minutes else None
+        }
+
+    def format_summary(self, file: Optional[str] = None) -> str:
+        s = self.summary(file)
+        lines = [
+            f"Blocks: {s['blocks']} (model {s['model_blocks']}, cache {s['cache_hits']}, journal {s['journal_hits']}, "
+            f"dedup {s['dedup_hits']}), failed {s['failed_blocks']}",
+            f"Requests: {s['requests']} in {s['calls']} calls ({s['saved_calls']} saved by dedup), {s['retries']} retries, "
+            f"{s['elapsed']:.1f}s, {s['blocks_per_s']:.2f} blocks/s",
+            f"HTTP latency p50/p99: {s['http_latency_p50']:.2f}s/{s['http_latency_p99']:.2f}s, "
+            f"queue wait p50/p99: {s['queue_wait_p50']:.2f}s/{s['queue_wait_p99']:.2f}s"
+            + (f", TTFT p50: {s['ttft_p50']:.2f}s" if s["ttft_p50"] is not None else ""),
+            f"Tokens: prompt {s['prompt_tokens']}"
+            + (f" (cached {s['cached_tokens']}, {s['cached_ratio']:.0%})" if s["cached_tokens"] else "")
+            + f", completion {s['completion_tokens']} "
+            f"(think {s['think_tokens']}, {s['think_overhead']:.0%})"
+            + (" [estimated]" if s["tokens_estimated"] else "")
+        ]
+        if s["tokens_per_video_minute"] is not None:
+            lines.append(f"Video: {s['video_minutes']:.1f} min, {s['tokens_per_video_minute']:.0f} tokens per minute of video")
+        return "\n".join(lines)
+
+    def write_prometheus(self):
+        """以Prometheus textfile格式整体重写汇总指标（先写临时文件再替换，避免被读到半个文件）"""
+        if not self.prometheus_path:
+            return
+        s = self.summary()
+        label = f'model="{self.model_id}"'
+        prefix = "srt_translate"
+        lines = []
+
+        def metric(name: str, kind: str, value, labels: str = label, help_text: str = ""):
+            if help_text:
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} {kind}")
+            lines.append(f"{prefix}_{name}{{{labels}}} {value}")
+
+        metric("blocks_total", "counter", s["model_blocks"], f'{label},source="model"', "Translated subtitle blocks by source")
+        metric("blocks_total", "counter", s["cache_hits"], f'{label},source="cache"')
+        metric("blocks_total", "counter", s["journal_hits"], f'{label},source="journal"')
+        metric("blocks_total", "counter", s["dedup_hits"], f'{label},source="dedup"')
+        metric("saved_calls_total", "counter", s["saved_calls"], help_text="Model calls saved by reusing duplicate lines")
+        metric("failed_blocks_total", "counter", s["failed_blocks"], help_text="Blocks left untranslated")
+        metric("requests_total", "counter", s["requests"], help_text="HTTP requests including retries")
+        metric("retries_total", "counter", s["retries"], help_text="Retried requests")
+        metric("tokens_total", "counter", s["prompt_tokens"], f'{label},type="prompt"', "Tokens by type")
+        metric("tokens_total", "counter", s["completion_tokens"], f'{label},type="completion"')
+        metric("tokens_total", "counter", s["think_tokens"], f'{label},type="think"')
+        metric("tokens_total", "counter", s["cached_tokens"], f'{label},type="cached"')
+        metric("http_latency_seconds", "summary", s["http_latency_p50"], f'{label},quantile="0.5"', "HTTP latency per request")
+        metric("http_latency_seconds", "summary", s["http_latency_p99"], f'{label},quantile="0.99"')
+        metric("http_latency_seconds_sum", "summary", f"{s['http_latency_sum']:.6f}")
+        metric("http_latency_seconds_count", "summary", s["http_latency_count"])
+        metric("queue_wait_seconds", "summary", s["queue_wait_p50"], f'{label},quantile="0.5"', "Queue wait before a call starts")
+        metric("queue_wait_seconds", "summary", s["queue_wait_p99"], f'{label},quantile="0.99"')
+        metric("queue_wait_seconds_sum", "summary", f"{s['queue_wait_sum']:.6f}")
+        metric("queue_wait_seconds_count", "summary", s["queue_wait_count"])
+        metric("video_minutes_total", "counter", f"{s['video_minutes']:.3f}", help_text="Minutes of video covered by processed subtitles")
+
+        tmp_path = self.prometheus_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prometheus_path)
+
+    def close(self):
+        self.write_prometheus()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
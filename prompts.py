@@ -0,0 +1,95 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from subtitle import SubtitleBlock, estimate_tokens
+
+# 提示词模板版本，修改用户消息模板后需递增以使旧缓存失效（实际发送的系统指令已直接计入缓存键）
+PROMPT_VERSION = "1"
+# 用户指令中除上下文和原文外的固定文字及消息格式开销（token）
+PROMPT_OVERHEAD_TOKENS = 64
+
+def build_system_prompt(domain: Optional[str], output_rule: str) -> str:
+    """构造翻译系统指令"""
+    return (
+        f"你是一个资深的{domain or '通用'}领域的字幕翻译专家，严格遵守以下规则：\n"
+        "1. 仅输出简体中文译文\n"
+        "2. 根据上下文参考给出最符合语境的翻译\n"
+        "3. 确保译文语序和表述符合中文正确的语言习惯\n"
+        "4. 自动校正原文中可能存在的的拼写错误\n"
+        "5. 猜想并保持原始文本的风格和语气\n"
+        "6. 专业技术词汇请参考当前领域知识进行翻译\n"
+        f"当前领域：{domain or '通用领域'}"
+        f"{output_rule}"
+    )
+
+def estimate_messages_tokens(messages: List[dict]) -> int:
+    """估算请求消息的token数，用于tpm限速"""
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+def build_glossary_prompt(terms: Optional[Dict[str, str]]) -> str:
+    """构造术语提示，每行"原文 => 译文"；没有术语时为空字符串"""
+    if not terms:
+        return ""
+    lines = "\n".join(f"{source} => {target}" for source, target in terms.items())
+    return f"术语表（原文 => 译文），出现时必须使用：\n{lines}\n"
+
+BATCH_LINE_PATTERN = re.compile(r"^\s*\[(\d+)\]\s*(.*?)\s*$")
+
+def build_batch_prompt(blocks: List[SubtitleBlock], context: str) -> str:
+    """构造批量翻译的用户指令，每行以[字幕序号]开头"""
+    numbered = "\n".join(f"[{block.index}] {block.text}" for block in blocks)
+    return (
+        f"上下文参考：\n{context}\n"
+        f"需要翻译的内容（共{len(blocks)}行，每行以[序号]开头）：\n{numbered}\n"
+        "请逐行输出译文，每行保留原有的[序号]前缀，行数与序号必须与原文一一对应"
+    )
+
+@dataclass
+class PrefixLayout:
+    '''
+    便于复用提示词前缀（Ollama的KV缓存、OpenAI兼容接口的提示词缓存）的提示词布局
+    系统指令只包含固定规则、领域和术语表，整次运行逐字节不变，单块与批量请求共用，输出要求移到用户消息中；
+    用户消息依次为上下文、输出要求、待翻译的原文，上下文按context_group块对齐分组，
+    同一分组内的请求使用完全相同的上下文，连续的请求共享"系统指令+上下文"这一长前缀，只有末尾的原文不同
+    context_group: 共用同一份上下文的连续字幕块数（向上取整为batch_size的倍数）
+    glossary: 术语表 {原文: 译文}，按原文排序写入系统指令
+    Sample:
+    generate_srt_translation(..., batch_size=5, prefix_layout=PrefixLayout(context_group=20, glossary={"aileron": "副翼"}))
+    '''
+    context_group: int = 20
+    glossary: Optional[Dict[str, str]] = None
+
+    def system_prompt(self, domain: Optional[str], base: Optional[str] = None) -> str:
+        """base: 后端自定义的系统指令（不含输出要求），默认为build_system_prompt(domain, "")"""
+        prompt = build_system_prompt(domain, "") if base is None else base
+        if self.glossary:
+            prompt += "\n" + build_glossary_prompt(dict(sorted(self.glossary.items()))).rstrip()
+        return prompt
+
+    # 按请求匹配的术语（glossary.Glossary）放在上下文之后，不影响前缀复用
+    def block_prompt(self, context: str, text: str, output_rule: str, terms: str = "") -> str:
+        return f"上下文参考：\n{context}\n{terms}{output_rule}\n需要翻译的内容：{text}"
+
+    def batch_prompt(self, blocks: List[SubtitleBlock], context: str, terms: str = "") -> str:
+        numbered = "\n".join(f"[{block.index}] {block.text}" for block in blocks)
+        return (
+            f"上下文参考：\n{context}\n{terms}"
+            "请逐行输出中文译文（不要添加任何解释），每行保留原有的[序号]前缀，行数与序号必须与原文一一对应\n"
+            f"需要翻译的内容（共{len(blocks)}行，每行以[序号]开头）：\n{numbered}"
+        )
+
+def parse_batch_response(text: str, blocks: List[SubtitleBlock]) -> Optional[List[str]]:
+    """解析批量译文，按字幕序号对齐；行数或序号不匹配时返回None"""
+    translations = {}
+    for line in text.splitlines():
+        match = BATCH_LINE_PATTERN.match(line)
+        if not match:
+            continue
+        index, translated_text = int(match.group(1)), match.group(2)
+        if index in translations or not translated_text:
+            return None
+        translations[index] = translated_text
+    if set(translations) != {block.index for block in blocks}:
+        return None
+    return [translations[block.index] for block in blocks]
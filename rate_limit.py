@@ -0,0 +1,221 @@
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional, TypeVar
+
+import requests
+
+from metrics import record_retry
+
+T = TypeVar("T")
+
+# 可重试的HTTP状态码，其余4xx错误视为请求本身有误，直接失败
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+def parse_retry_after(response: Optional[requests.Response]) -> Optional[float]:
+    """解析Retry-After响应头（秒数或HTTP日期），返回需要等待的秒数"""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """带随机抖动的指数退避时长（full jitter）"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    '''
+    令牌桶：容量为每分钟额度，按rate_per_minute匀速补充
+    '''
+    def __init__(self, rate_per_minute: float):
+        self.rate_per_minute = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.rate_per_minute, self.tokens + elapsed * self.rate_per_minute / 60)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """返回获取amount个令牌还需等待的秒数"""
+        self._refill(now)
+        # 单次请求超过桶容量时按满桶处理，避免永远等待
+        amount = min(amount, self.rate_per_minute)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.rate_per_minute
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.rate_per_minute)
+
+
+class RequestScheduler:
+    '''
+    自适应限速与重试调度器，多个线程（及共享同一配置的多个任务）共用
+    rpm: 每分钟请求数上限，None表示不限（遇到429后按观测到的速率自动收紧）
+    tpm: 每分钟token数上限，None表示不限
+    max_retries: 单次调用的最大重试次数
+    遇到429时读取Retry-After并暂停全部请求；速率按adjust_interval秒的窗口调整，每个窗口至多调整一次：
+    按窗口内成功请求的比例降速（至多减半），有成功时再按当前速率的recovery比例恢复，直到配置的上限，
+    超出服务端上限时被拒的比例约为超出部分，速率随之收敛到上限附近；偶发的零星429不会让速率持续下降
+    min_fraction: 速率下限占上限（未配置rpm时为首次限流时观测到的速率）的比例，不低于min_rpm
+    fallback_rpm: 未配置rpm且观测不到请求速率（此前只发出过一个请求）时，首次限流后采用的保守速率
+    '''
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        min_rpm: float = 1.0,
+        adjust_interval: float = 1.0,
+        recovery: float = 0.1,
+        min_fraction: float = 0.1,
+        fallback_rpm: float = 10.0
+    ):
+        self.max_rpm = rpm
+        self.max_retries = max(1, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_rpm = min_rpm
+        self.adjust_interval = adjust_interval
+        self.recovery = recovery
+        self.min_fraction = min_fraction
+        self.fallback_rpm = fallback_rpm
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.reference_rpm = rpm    # 速率上限；未配置rpm时为首次限流时观测到的速率
+        self.paused_until = 0.0
+        self.recent_requests = deque()   # 最近adjust_interval秒内发出请求的时刻，至少保留最近两次
+        self.rate_limited_count = 0
+        self._window_start = time.monotonic()
+        self._window_ok = 0
+        self._window_limited = 0
+        self._lock = threading.Lock()
+
+    @property
+    def current_rpm(self) -> Optional[float]:
+        return self.request_bucket.rate_per_minute if self.request_bucket else None
+
+    @property
+    def floor_rpm(self) -> float:
+        return max(self.min_rpm, (self.reference_rpm or 0) * self.min_fraction)
+
+    def acquire(self, tokens: float = 0):
+        """阻塞直到速率额度允许发出下一个请求"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if self.request_bucket:
+                    wait = max(wait, self.request_bucket.wait_time(1, now))
+                if self.token_bucket and tokens:
+                    wait = max(wait, self.token_bucket.wait_time(tokens, now))
+                if wait <= 0:
+                    if self.request_bucket:
+                        self.request_bucket.take(1)
+                    if self.token_bucket and tokens:
+                        self.token_bucket.take(tokens)
+                    self.recent_requests.append(now)
+                    # 至少保留两次：串行的慢请求之间也能观测到速率
+                    while len(self.recent_requests) > 2 and now - self.recent_requests[0] > self.adjust_interval:
+                        self.recent_requests.popleft()
+                    return
+            time.sleep(wait)
+
+    def _adjust(self, now: float):
+        """窗口结束时调整速率（调用方持有锁）"""
+        if now - self._window_start < self.adjust_interval:
+            return
+        ok, limited = self._window_ok, self._window_limited
+        self._window_start, self._window_ok, self._window_limited = now, 0, 0
+        bucket = self.request_bucket
+        if bucket is None:
+            return
+        # 按成功比例收缩再按比例恢复：零星的随机429下速率仍可回升，
+        # 超出服务端上限时被拒的比例约为超出部分，速率收敛到上限附近
+        rate = bucket.rate_per_minute * max(0.5, ok / (ok + limited))
+        if ok:
+            rate *= 1 + self.recovery
+        if self.max_rpm is not None:
+            rate = min(self.max_rpm, rate)
+        elif rate >= self.reference_rpm:
+            # 未配置rpm时恢复到首次限流时的速率即取消限速，之后再遇到429重新观测
+            self.request_bucket = None
+            return
+        bucket.rate_per_minute = max(self.floor_rpm, rate)
+        # 出现过429说明已到服务端上限，突发额度限制为一个窗口的请求数
+        burst = bucket.rate_per_minute * self.adjust_interval / 60 if limited else bucket.rate_per_minute
+        bucket.tokens = min(bucket.tokens, max(1.0, burst))
+
+    def on_success(self):
+        """记录一次成功，窗口结束时按比例恢复速率"""
+        with self._lock:
+            self._window_ok += 1
+            self._adjust(time.monotonic())
+
+    def on_rate_limited(self, retry_after: Optional[float]):
+        """记录一次限流：按Retry-After暂停全部请求，窗口结束时按429的比例降速"""
+        with self._lock:
+            self.rate_limited_count += 1
+            self._window_limited += 1
+            now = time.monotonic()
+            if retry_after is not None:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if self.request_bucket is None:
+                # 未配置rpm时以最近发出请求的速率作为起点和参考上限（观测不到时用fallback_rpm），从新窗口开始观测降速效果
+                span = self.recent_requests[-1] - self.recent_requests[0] if self.recent_requests else 0.0
+                observed = (len(self.recent_requests) - 1) * 60 / span if span > 0 else self.fallback_rpm
+                self.reference_rpm = max(self.min_rpm * 2, observed)
+                self.request_bucket = TokenBucket(self.reference_rpm)
+                self.request_bucket.tokens = 0.0
+                self._window_start, self._window_ok, self._window_limited = now, 0, 0
+                return
+            self._adjust(now)
+
+    def call(self, func: Callable[[], T], tokens: float = 0, on_error: Optional[Callable[[Exception], None]] = None) -> T:
+        """
+        在限速下执行func，可重试的异常按抖动指数退避重试，重试耗尽后抛出最后一次异常
+        on_error: 每次失败时的回调，用于打印日志
+        """
+        for attempt in range(self.max_retries):
+            self.acquire(tokens)
+            try:
+                result = func()
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status not in RETRYABLE_STATUS or attempt == self.max_retries - 1:
+                    raise
+                if on_error:
+                    on_error(e)
+                record_retry()
+                retry_after = parse_retry_after(e.response)
+                if status == 429:
+                    self.on_rate_limited(retry_after)
+                time.sleep(retry_after if retry_after is not None else backoff_delay(attempt, self.base_delay, self.max_delay))
+            except (requests.exceptions.RequestException, ValueError, KeyError, IndexError) as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                if on_error:
+                    on_error(e)
+                record_retry()
+                time.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+            else:
+                self.on_success()
+                return result
@@ -0,0 +1,136 @@
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List
+
+from subtitle import CJK_PATTERN, CLAUSE_END, CLOSING_MARKS, SENTENCE_END, SubtitleBlock
+from validation import FAILED_MARKER
+
+# 以句点结尾但通常不结束句子的缩写
+ABBREVIATIONS = {"mr.", "mrs.", "ms.", "dr.", "prof.", "st.", "vs.", "e.g.", "i.e.", "approx."}
+
+
+def ends_sentence(text: str) -> bool:
+    """文本是否以完整的句子结束（句末标点，且不是省略号或常见缩写）"""
+    text = text.rstrip().rstrip(CLOSING_MARKS)
+    if not text:
+        return True
+    if text.endswith(("...", "…")):
+        return False
+    words = text.split()
+    if words and words[-1].lower() in ABBREVIATIONS:
+        return False
+    return text.endswith(tuple(SENTENCE_END))
+
+
+def _join_texts(texts: List[str]) -> str:
+    """拼接相邻字幕的文本，中日文之间不加空格"""
+    joined = texts[0]
+    for text in texts[1:]:
+        if joined and text and CJK_PATTERN.match(joined[-1]) and CJK_PATTERN.match(text[0]):
+            joined += text
+        else:
+            joined += " " + text
+    return joined
+
+
+@dataclass
+class SentenceUnit:
+    '''
+    由一个或多个相邻字幕块合并成的句子，作为一个整体翻译
+    blocks: 原字幕块
+    block: 用于翻译的字幕块；只有一块时即原字幕块，多块时序号取第一块，文本为各块拼接，时间轴覆盖全部字幕块
+    '''
+    blocks: List[SubtitleBlock]
+    block: SubtitleBlock
+
+    def split(self, translation: str) -> List[str]:
+        """把整句的译文按原字幕块的字符数比例拆回各字幕块"""
+        if len(self.blocks) == 1:
+            return [translation]
+        return split_translation(translation, [len(block.text) for block in self.blocks])
+
+
+def _make_unit(blocks: List[SubtitleBlock]) -> SentenceUnit:
+    if len(blocks) == 1:
+        return SentenceUnit(blocks, blocks[0])
+    merged = SubtitleBlock(
+        index=blocks[0].index,
+        timeline="",
+        text=_join_texts([block.text for block in blocks]),
+        start_ms=blocks[0].start_ms,
+        end_ms=blocks[-1].end_ms
+    )
+    return SentenceUnit(blocks, merged)
+
+
+def iter_sentence_units(
+    blocks: Iterable[SubtitleBlock],
+    max_words: int = 40,
+    max_blocks: int = 4,
+    max_gap_ms: int = 1500
+) -> Iterator[SentenceUnit]:
+    """
+    把句子中途断开的相邻字幕块合并为句子单元，逐个生成
+    当前字幕以句末标点结束、合并后超过max_words个词或max_blocks块、
+    或与下一块的间隔超过max_gap_ms毫秒（说话停顿，多半换了话题）时结束当前单元
+    Sample:
+    "So the wing is made" + "of three main parts." -> 一个单元，翻译后按字符数比例拆回两块
+    """
+    current: List[SubtitleBlock] = []
+    words = 0
+    for block in blocks:
+        n_words = len(block.text.split())
+        if current:
+            last = current[-1]
+            gap = block.start_ms - last.end_ms if block.start_ms is not None and last.end_ms is not None else 0
+            if (ends_sentence(last.text) or not block.text.strip() or len(current) >= max_blocks
+                    or words + n_words > max_words or gap > max_gap_ms):
+                yield _make_unit(current)
+                current, words = [], 0
+        current.append(block)
+        words += n_words
+    if current:
+        yield _make_unit(current)
+
+
+def _cut_candidates(text: str) -> List[tuple]:
+    """可断开的位置及代价：标点之后0，空格处1"""
+    candidates = []
+    for p in range(1, len(text)):
+        if text[p - 1] in SENTENCE_END or text[p - 1] in CLAUSE_END:
+            if text[p] not in CLOSING_MARKS and text[p] not in SENTENCE_END and text[p] not in CLAUSE_END:
+                candidates.append((p, 0))
+        elif text[p].isspace() and not text[p - 1].isspace():
+            candidates.append((p, 1))
+    return candidates
+
+
+def split_translation(text: str, weights: List[int]) -> List[str]:
+    """
+    把一段译文按权重（原文各段的字符数）拆成len(weights)段
+    每个断点取目标位置附近（一段平均长度的40%以内）的标点处，其次空格处，都没有时在目标位置直接断开
+    翻译失败的标记原样复制到每一段，以便之后逐块重译
+    """
+    n = len(weights)
+    if FAILED_MARKER in text:
+        return [text] * n
+    text = text.strip()
+    length = len(text)
+    if not any(weights):
+        weights = [1] * n
+    total = sum(weights)
+    tolerance = 0.4 * length / n
+    candidates = _cut_candidates(text)
+    cuts = [0]
+    acc = 0
+    for k, weight in enumerate(weights[:-1], 1):
+        acc += weight
+        target = length * acc / total
+        # 每段至少保留一个字符（译文足够长时）
+        low, high = cuts[-1] + 1, length - (n - k)
+        cut = round(target)
+        nearby = [(cost, abs(p - target), p) for p, cost in candidates if low <= p <= high and abs(p - target) <= tolerance]
+        if nearby:
+            cut = min(nearby)[2]
+        cuts.append(min(max(cut, low), max(high, low)))
+    cuts.append(length)
+    return [text[start:end].strip() for start, end in zip(cuts, cuts[1:])]
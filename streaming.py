@@ -0,0 +1,166 @@
+import json
+import time
+from typing import Iterator, Optional
+
+import requests
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+class StreamBudgetExceeded(RuntimeError):
+    """流式生成超出token预算，已主动中断"""
+
+
+class ThinkFilter:
+    '''
+    流式输出的<think>段过滤器
+    逐段接收模型输出，实时剔除<think>...</think>之间的推理内容，
+    并统计首token耗时与推理token数，超出预算时抛出StreamBudgetExceeded
+    每个流式分片近似按1个token计数
+    部分模型（如qwq:32b）不输出起始标签，直接输出推理内容并以</think>结束：
+    在出现第一个标签之前，开头的输出暂定为推理内容，但只受max_tokens限制、不计入推理预算，
+    以免不输出推理段的模型因译文较长而超出推理预算；随后出现</think>时确认为推理段，剔除并计入推理预算，
+    出现<think>或直到结束都没有标签时改判为译文
+    max_think_tokens: 推理段最大token数，None为不限
+    max_tokens: 全部输出（推理+译文）最大token数，None为不限
+    '''
+    def __init__(self, max_think_tokens: Optional[int] = None, max_tokens: Optional[int] = None):
+        self.max_think_tokens = max_think_tokens
+        self.max_tokens = max_tokens
+        self.started_at = time.monotonic()
+        self.ttft: Optional[float] = None
+        self.tokens = 0
+        self.in_think = False
+        self._think_tokens = 0
+        self._tentative = True       # 尚未出现标签，开头的输出可能是缺少起始标签的推理段
+        self._tentative_tokens = 0
+        self._pending = ""
+        self._visible = []
+
+    def feed(self, chunk: str, think: bool = False):
+        """
+        接收一段输出
+        think: 该片段是否由接口单独标记为推理内容（如OpenAI兼容接口的reasoning_content）
+        """
+        if not chunk:
+            return
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.started_at
+        self.tokens += 1
+        if think:
+            # 接口单独返回推理内容时正文中不会混入推理段
+            self._settle(False)
+            self._think_tokens += 1
+        else:
+            was_in_think = self.in_think or self._tentative
+            self._pending += chunk
+            self._drain()
+            if was_in_think or self.in_think:
+                self._think_tokens += 1
+            if self._tentative:
+                self._tentative_tokens += 1
+        if self.max_think_tokens is not None and self.think_tokens > self.max_think_tokens:
+            raise StreamBudgetExceeded(f"推理内容超出预算({self.max_think_tokens} tokens)")
+        if self.max_tokens is not None and self.tokens > self.max_tokens:
+            raise StreamBudgetExceeded(f"输出超出预算({self.max_tokens} tokens)")
+
+    @property
+    def think_tokens(self) -> int:
+        """推理token数，尚未确认归属的开头输出不计入"""
+        return self._think_tokens - (self._tentative_tokens if self._tentative else 0)
+
+    def _settle(self, is_think: bool):
+        """确定开头暂定输出的归属，is_think为False时改判为译文"""
+        if self._tentative and not is_think:
+            self._think_tokens -= self._tentative_tokens
+        self._tentative = False
+
+    def _drain(self):
+        if self._tentative:
+            end = self._pending.find(THINK_CLOSE)
+            start = self._pending.find(THINK_OPEN)
+            if end >= 0 and (start < 0 or end < start):
+                self._pending = self._pending[end + len(THINK_CLOSE):]
+                self._settle(True)
+            elif start >= 0:
+                self._settle(False)
+            else:
+                return
+        while self._pending:
+            if self.in_think:
+                end = self._pending.find(THINK_CLOSE)
+                if end < 0:
+                    # 保留可能被截断的结束标签前缀
+                    self._pending = self._pending[-(len(THINK_CLOSE) - 1):]
+                    return
+                self._pending = self._pending[end + len(THINK_CLOSE):]
+                self.in_think = False
+            else:
+                start = self._pending.find(THINK_OPEN)
+                if start < 0:
+                    keep = _partial_suffix(self._pending, THINK_OPEN)
+                    self._visible.append(self._pending[:len(self._pending) - keep])
+                    self._pending = self._pending[len(self._pending) - keep:]
+                    return
+                self._visible.append(self._pending[:start])
+                self._pending = self._pending[start + len(THINK_OPEN):]
+                self.in_think = True
+
+    @property
+    def text(self) -> str:
+        """已过滤推理段后的完整输出"""
+        visible = "".join(self._visible) + ("" if self.in_think else self._pending)
+        # 部分模型不输出起始标签，仅以</think>结束推理段
+        return visible.split(THINK_CLOSE)[-1].strip()
+
+
+def _partial_suffix(text: str, tag: str) -> int:
+    """返回text末尾与tag前缀重合的长度"""
+    for size in range(min(len(text), len(tag) - 1), 0, -1):
+        if tag.startswith(text[-size:]):
+            return size
+    return 0
+
+
+def iter_ollama_stream(response: requests.Response) -> Iterator[dict]:
+    """逐行解析Ollama的NDJSON流式响应"""
+    for line in response.iter_lines():
+        if line:
+            yield json.loads(line)
+
+
+def iter_openai_stream(response: requests.Response) -> Iterator[dict]:
+    """解析OpenAI兼容接口的SSE流式响应"""
+    for line in response.iter_lines():
+        if not line or not line.startswith(b"data:"):
+            continue
+        data = line[len(b"data:"):].strip()
+        if data == b"[DONE]":
+            return
+        yield json.loads(data)
+
+
+def consume_ollama_stream(response: requests.Response, think_filter: ThinkFilter) -> dict:
+    """消费Ollama流式响应，返回最后一个（含统计信息的）数据包"""
+    last = {}
+    for data in iter_ollama_stream(response):
+        if "error" in data:
+            raise ValueError(f"异常响应:{data['error']}")
+        think_filter.feed(data.get("message", {}).get("content", ""))
+        last = data
+        if data.get("done"):
+            return last
+    raise ValueError("未完成完整响应")
+
+
+def consume_openai_stream(response: requests.Response, think_filter: ThinkFilter) -> dict:
+    """消费OpenAI兼容接口的流式响应，返回最后一个数据包（部分服务商在其中附带usage）"""
+    last = {}
+    for data in iter_openai_stream(response):
+        for choice in data.get("choices") or []:
+            delta = choice.get("delta", {})
+            think_filter.feed(delta.get("reasoning_content") or "", think=True)
+            think_filter.feed(delta.get("content") or "")
+        last = data
+    return last
@@ -1,119 +1,821 @@
+import gc
+import heapq
+import os
+import re
+from array import array
+from bisect import bisect_right
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# 快速路径解析的字幕块中尚未解析的起止时间
+_PENDING = object()
 
-@dataclass
 class SubtitleBlock:
     '''
     字幕块
+    使用__slots__存储，起止时间以毫秒整数保存，时间轴字符串在需要时再格式化
+    快速路径解析出的字幕块先保存标准格式的时间轴字符串，首次访问起止时间时再解析
     Sample:
     1
     00:00:06,460 --> 00:00:07,980
     你做了什么？
     What did you do?
     '''
-    def __init__(self, index:int, timeline:str, text:str):
+    __slots__ = ("index", "text", "_start_ms", "_end_ms", "_timeline", "_lines")
+
+    def __init__(self, index:int, timeline:str, text:str, start_ms:Optional[int]=None, end_ms:Optional[int]=None, lines:Optional[List[str]]=None):
         self.index = index
-        self.timeline = timeline
         self.text = text
-        self.start = None
-        self.end = None
-        self.duration = None
-
-    def calc_duration(self) -> float:
-        start, end = self.timeline.split(" --> ")
-        start = start.split(":")
-        end = end.split(":")
-        self.start = int(start[0])*3600 + int(start[1])*60 + float(start[2].replace(",","."))
-        self.end = int(end[0])*3600 + int(end[1])*60 + float(end[2].replace(",","."))
-        self.duration = self.end - self.start
+        if start_ms is None and timeline:
+            start_ms, end_ms = parse_timeline(timeline)
+        self._start_ms = start_ms
+        self._end_ms = end_ms
+        # 仅在时间轴无法由起止时间还原时（如带坐标等扩展信息）保留原始字符串
+        self._timeline = None if start_ms is not None and _is_canonical_timeline(timeline) else (timeline or None)
+        # 多行字幕以换行连接保存原始文本行，单行字幕的原始文本即text，不单独存储
+        self._lines = "\n".join(lines) if lines is not None and len(lines) > 1 else None
+
+    def _parse_pending(self):
+        """解析延后的时间轴（快速路径保证为标准格式），时间轴字符串随即释放"""
+        self._start_ms, self._end_ms = parse_timeline(self._timeline)
+        self._timeline = None
+
+    @property
+    def start_ms(self) -> Optional[int]:
+        if self._start_ms is _PENDING:
+            self._parse_pending()
+        return self._start_ms
+
+    @start_ms.setter
+    def start_ms(self, value: Optional[int]):
+        if self._start_ms is _PENDING:
+            self._parse_pending()
+        self._start_ms = value
+
+    @property
+    def end_ms(self) -> Optional[int]:
+        if self._start_ms is _PENDING:
+            self._parse_pending()
+        return self._end_ms
+
+    @end_ms.setter
+    def end_ms(self, value: Optional[int]):
+        if self._start_ms is _PENDING:
+            self._parse_pending()
+        self._end_ms = value
+
+    @property
+    def timeline(self) -> str:
+        if self._timeline is not None:
+            return self._timeline
+        if self._start_ms is None:
+            return ""
+        return f"{format_timestamp(self._start_ms)} --> {format_timestamp(self._end_ms)}"
+
+    @timeline.setter
+    def timeline(self, value: str):
+        self._start_ms, self._end_ms = parse_timeline(value) if value else (None, None)
+        self._timeline = None if self._start_ms is not None and _is_canonical_timeline(value) else (value or None)
+
+    @property
+    def lines(self) -> List[str]:
+        """原始文本行"""
+        return self._lines.split("\n") if self._lines is not None else [self.text]
+
+    @lines.setter
+    def lines(self, value: List[str]):
+        self._lines = "\n".join(value) if len(value) > 1 else None
+        self.text = " ".join(value)
+
+    @property
+    def start(self) -> Optional[float]:
+        return self.start_ms / 1000 if self.start_ms is not None else None
+
+    @property
+    def end(self) -> Optional[float]:
+        return self.end_ms / 1000 if self.end_ms is not None else None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.start_ms is None or self.end_ms is None:
+            return None
+        return (self.end_ms - self.start_ms) / 1000
+
+    def calc_duration(self) -> Optional[float]:
+        """起止时间在构造或首次访问时解析，保留该方法以兼容旧调用"""
+        return self.duration
+
+    def __repr__(self) -> str:
+        return f"SubtitleBlock(index={self.index!r}, timeline={self.timeline!r}, text={self.text!r})"
+
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本token数：中日文字符按1个token计，其余按4个字符1个token计"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def format_timestamp(ms: int) -> str:
+    """毫秒转换为SRT时间戳，如 00:00:06,460"""
+    seconds, ms = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{ms:03d}"
 
 def format_timeline(start: float,end:float) -> str:
-    start_str = f"{int(start//3600):02d}:{int((start%3600)//60):02d}:{start%60:.3f}".replace(".",",")
-    end_str = f"{int(end//3600):02d}:{int((end%3600)//60):02d}:{end%60:.3f}".replace(".",",")
-    return f"{start_str} --> {end_str}"
+    return f"{format_timestamp(round(start * 1000))} --> {format_timestamp(round(end * 1000))}"
 
-def parse_srt(file_path: str) -> List[SubtitleBlock]:
-    """SRT文件解析器"""
+TIMESTAMP_PATTERN = re.compile(r"(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})")
+BLOCK_SEPARATOR = re.compile(r"\n[ \t]*\n")
+TWO_DIGITS = {f"{i:02d}": i for i in range(100)}
+
+def parse_timeline(timeline: str):
+    """将时间轴解析为(起始毫秒, 结束毫秒)，格式错误时返回(None, None)"""
+    # 标准格式 "00:00:06,460 --> 00:00:07,980" 直接按固定位置切片
+    if timeline[12:17] == " --> ":
+        try:
+            return (
+                ((TWO_DIGITS[timeline[0:2]] * 60 + TWO_DIGITS[timeline[3:5]]) * 60 + TWO_DIGITS[timeline[6:8]]) * 1000 + int(timeline[9:12]),
+                ((TWO_DIGITS[timeline[17:19]] * 60 + TWO_DIGITS[timeline[20:22]]) * 60 + TWO_DIGITS[timeline[23:25]]) * 1000 + int(timeline[26:29])
+            )
+        except (KeyError, ValueError):
+            pass
+    stamps = TIMESTAMP_PATTERN.findall(timeline)
+    if len(stamps) < 2:
+        return None, None
+    (h1, m1, s1, ms1), (h2, m2, s2, ms2) = stamps[:2]
+    return (
+        ((int(h1) * 60 + int(m1)) * 60 + int(s1)) * 1000 + int(ms1.ljust(3, "0")),
+        ((int(h2) * 60 + int(m2)) * 60 + int(s2)) * 1000 + int(ms2.ljust(3, "0"))
+    )
+
+def _is_canonical_timeline(timeline: str) -> bool:
+    """时间轴是否为可由起止时间原样还原的标准格式"""
+    return (
+        len(timeline) == 29 and timeline[12:17] == " --> " and timeline[8] == "," and timeline[25] == ","
+        and timeline[3] < "6" and timeline[6] < "6" and timeline[20] < "6" and timeline[23] < "6"
+    )
+
+def _iter_srt_chunks(lines: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    逐行读取SRT，按空行切分，生成 (块文本, 原始片段)
+    块文本与BLOCK_SEPARATOR切分整个文件得到的片段一致；原始片段包含该块及其后的空行，
+    依次拼接全部原始片段即为原文（文件开头的空行归入第一块）
+    """
+    raw, text_lines, closed = [], [], False
+    for line in lines:
+        if line.rstrip("\n").strip(" \t"):
+            if closed:
+                yield "\n".join(text_lines), "".join(raw)
+                raw, text_lines, closed = [], [], False
+            text_lines.append(line.rstrip("\n"))
+        elif text_lines:
+            closed = True
+        raw.append(line)
+    if raw:
+        yield "\n".join(text_lines), "".join(raw)
+
+def _iter_records(chunks: Iterable[str]) -> Iterator[tuple]:
+    """由按空行切分的片段生成字幕记录，见iter_srt_records"""
+    pending = None  # 残段可能并入上一块，因此上一块延后一步输出
+    for chunk in chunks:
+        # 快速路径：标准的"序号/时间轴/文本"结构
+        parts = chunk.split("\n", 2)
+        if len(parts) == 3 and parts[0].isdigit() and '-->' in parts[1]:
+            text_lines = parts[2].split("\n")
+            if parts[2][0].isspace() or parts[2][-1].isspace() or " \n" in parts[2] or "\n " in parts[2] or "\t\n" in parts[2] or "\n\t" in parts[2]:
+                text_lines = [line.strip() for line in text_lines]
+            timeline = parts[1].strip()
+            if pending:
+                yield pending
+            pending = (int(parts[0]), timeline, text_lines, *parse_timeline(timeline))
+            continue
+
+        lines = [line.strip() for line in chunk.strip().split("\n")]
+        if not lines[0]:
+            continue
+        if len(lines) > 1 and '-->' in lines[1] and lines[0].isdigit():
+            index, timeline, text_lines = int(lines[0]), lines[1], lines[2:]
+        elif '-->' in lines[0]:
+            index, timeline, text_lines = (pending[0] + 1 if pending else 1), lines[0], lines[1:]
+        elif pending:
+            pending[2].extend(lines)
+            continue
+        else:
+            continue
+        if not text_lines:
+            continue
+        if pending:
+            yield pending
+        pending = (index, timeline, text_lines, *parse_timeline(timeline))
+    if pending:
+        yield pending
+
+
+def iter_srt_records(content: str) -> Iterator[tuple]:
+    """
+    逐块解析SRT文本内容，生成 (序号, 时间轴, 文本行列表, 起始毫秒, 结束毫秒)
+    以空行切分字幕块，仅把块首行识别为序号，纯数字的字幕文本不会被误判；
+    缺少序号的块按前一块序号顺延，块内空行导致的残段并入前一块
+    """
+    content = content.replace("\r\n", "\n").replace("\r", "\n")
+    return _iter_records(BLOCK_SEPARATOR.split(content.strip()))
+
+def iter_srt(file_path: str) -> Iterator[SubtitleBlock]:
+    """逐块读取SRT文件（不一次读入整个文件），解析规则与parse_srt相同"""
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        for index, timeline, text_lines, start_ms, end_ms in _iter_records(text for text, _ in _iter_srt_chunks(f)):
+            yield SubtitleBlock(index, timeline, " ".join(text_lines), start_ms, end_ms, text_lines)
+
+def count_srt_blocks(file_path: str) -> int:
+    """统计SRT文件中的字幕块数（逐块读取）"""
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        return sum(1 for _ in _iter_records(text for text, _ in _iter_srt_chunks(f)))
+
+# 标准字幕块：序号、标准格式时间轴、首尾无空白的文本行，以空行或文件结尾结束
+_TEXT_LINE = r"\S(?:[^\n]*\S)?"
+REGULAR_BLOCK_PATTERN = re.compile(
+    r"(\d+)\n(\d\d:[0-5]\d:[0-5]\d,\d{3} --> \d\d:[0-5]\d:[0-5]\d,\d{3})\n"
+    rf"({_TEXT_LINE}(?:\n{_TEXT_LINE})*)(?:\n(?:[ \t]*\n)+|\Z)"
+)
+
+def _parse_regular_srt(content: str) -> Optional[List[SubtitleBlock]]:
+    """
+    快速路径：整个文件由标准字幕块首尾相接组成时，用正则split一次切出全部字段，
+    字幕块之间的片段全为空串即说明没有跳过任何内容；时间轴必为标准格式，保存原串并延后到首次访问时解析，
+    直接写入各字段而不经过__init__；遇到任何不规整之处返回None，由通用解析处理
+    """
+    parts = REGULAR_BLOCK_PATTERN.split(content)
+    if any(parts[::4]):
+        return None
     blocks = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        current_block = None
-        for line in f:
-            line = line.strip()
-            if line.isdigit():
-                current_block = SubtitleBlock(index=int(line), timeline="", text="")
-            elif '-->' in line:
-                current_block.timeline = line
-            elif line:
-                current_block.text += line + " "
-            elif current_block and current_block.text:
-                current_block.text = current_block.text.strip()
-                blocks.append(current_block)
-                current_block = None
-        if current_block and current_block.text:  # 处理最后未完结块[^3]
-            blocks.append(current_block)
+    append = blocks.append
+    new = SubtitleBlock.__new__
+    # 字幕块不含循环引用，逐个创建期间暂停分代GC，避免对刚创建的大量对象反复扫描
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for index, timeline, text in zip(parts[1::4], parts[2::4], parts[3::4]):
+            block = new(SubtitleBlock)
+            block.index = int(index)
+            block._start_ms = _PENDING
+            block._timeline = timeline
+            if "\n" in text:
+                block._lines = text
+                block.text = text.replace("\n", " ")
+            else:
+                block._lines = None
+                block.text = text
+            append(block)
+    finally:
+        if gc_enabled:
+            gc.enable()
     return blocks
 
-# 拆分过长的字幕block为两段，按照标点或空格分词拆分
+def parse_srt_text(content: str) -> List[SubtitleBlock]:
+    """解析SRT文本内容"""
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    content = content.strip()
+    blocks = _parse_regular_srt(content)
+    if blocks is not None:
+        return blocks
+    return [
+        SubtitleBlock(index, timeline, " ".join(text_lines), start_ms, end_ms, text_lines)
+        for index, timeline, text_lines, start_ms, end_ms in iter_srt_records(content)
+    ]
+
+def parse_srt(file_path: str) -> List[SubtitleBlock]:
+    """SRT文件解析器（一次读入整个文件，兼容BOM和缺少结尾空行的文件）"""
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        return parse_srt_text(f.read())
+
+class SubtitleTrack:
+    '''
+    列式存储的字幕轨道
+    序号和起止时间（毫秒）分别存放在紧凑的整数数组中，文本存放在列表中，
+    不为每个字幕块创建对象，适合同时在内存中保存大量字幕
+    缺失的时间以-1表示，非标准时间轴（如带坐标信息）单独保存在timelines中
+    Sample:
+    track = SubtitleTrack.from_srt("episode01.srt")
+    track[0]                # 第一块，返回SubtitleBlock
+    track[100:200]          # 切片，返回新的SubtitleTrack
+    track.find(42)          # 按SRT序号查找，返回SubtitleBlock或None
+    track.at(61500)         # 查找01:01.500时正在显示的字幕位置
+    '''
+    __slots__ = ("indices", "starts", "ends", "texts", "timelines", "_positions")
+
+    def __init__(self, indices=None, starts=None, ends=None, texts=None, timelines=None):
+        self.indices = indices if indices is not None else array("q")
+        self.starts = starts if starts is not None else array("q")
+        self.ends = ends if ends is not None else array("q")
+        self.texts: List[str] = texts if texts is not None else []
+        self.timelines = timelines or {}  # 位置 -> 非标准时间轴字符串
+        self._positions = None
+
+    @classmethod
+    def from_blocks(cls, blocks: List[SubtitleBlock]) -> "SubtitleTrack":
+        track = cls()
+        for block in blocks:
+            # 先访问起止时间，延后解析的标准时间轴随之释放，不再作为自定义时间轴保存
+            start_ms, end_ms = block.start_ms, block.end_ms
+            track.append(block.index, start_ms, end_ms, block.text, block._timeline)
+        return track
+
+    @classmethod
+    def from_srt(cls, file_path: str) -> "SubtitleTrack":
+        """直接从SRT文件构建，不创建中间的SubtitleBlock对象"""
+        track = cls()
+        with open(file_path, 'r', encoding='utf-8-sig') as f:
+            content = f.read()
+        for index, timeline, text_lines, start_ms, end_ms in iter_srt_records(content):
+            custom = None if start_ms is not None and _is_canonical_timeline(timeline) else timeline
+            track.append(index, start_ms, end_ms, " ".join(text_lines), custom)
+        return track
+
+    def append(self, index: int, start_ms: Optional[int], end_ms: Optional[int], text: str, timeline: Optional[str] = None):
+        if timeline:
+            self.timelines[len(self.texts)] = timeline
+        self.indices.append(index)
+        self.starts.append(-1 if start_ms is None else start_ms)
+        self.ends.append(-1 if end_ms is None else end_ms)
+        self.texts.append(text)
+        self._positions = None
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def block(self, position: int) -> SubtitleBlock:
+        """按位置（从0开始）取出一个字幕块"""
+        start, end = self.starts[position], self.ends[position]
+        timeline = self.timelines.get(position % len(self.texts), "") if self.timelines else ""
+        return SubtitleBlock(
+            self.indices[position], timeline, self.texts[position],
+            None if start < 0 else start, None if end < 0 else end
+        )
+
+    def __getitem__(self, item: Union[int, slice]):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self.texts))
+            timelines = {}
+            if self.timelines:
+                positions = range(start, stop, step)
+                timelines = {i: self.timelines[p] for i, p in enumerate(positions) if p in self.timelines}
+            return SubtitleTrack(self.indices[item], self.starts[item], self.ends[item], self.texts[item], timelines)
+        return self.block(item)
+
+    def __iter__(self) -> Iterator[SubtitleBlock]:
+        for position in range(len(self.texts)):
+            yield self.block(position)
+
+    def to_blocks(self) -> List[SubtitleBlock]:
+        return list(self)
+
+    def position(self, index: int) -> Optional[int]:
+        """按SRT序号查找所在位置，不存在时返回None"""
+        if self._positions is None:
+            self._positions = {value: position for position, value in reversed(list(enumerate(self.indices)))}
+        return self._positions.get(index)
+
+    def find(self, index: int) -> Optional[SubtitleBlock]:
+        """按SRT序号查找字幕块，不存在时返回None"""
+        position = self.position(index)
+        return None if position is None else self.block(position)
+
+    def at(self, ms: int) -> Optional[int]:
+        """查找ms时刻正在显示的字幕位置（要求按起始时间排序），没有时返回None"""
+        position = bisect_right(self.starts, ms) - 1
+        if position >= 0 and self.starts[position] >= 0 and ms < self.ends[position]:
+            return position
+        return None
+
+def patch_srt_text(content: str, replacements: Dict[int, str]) -> str:
+    """
+    替换SRT文本中指定序号字幕块的文本，其余字幕块（包括原有的换行和空白）保持原样
+    replacements: {SRT序号: 新文本}
+    """
+    parts = re.split(r"(\n[ \t]*\n)", content)
+    for i in range(0, len(parts), 2):
+        lines = parts[i].split("\n")
+        # 跳过文件开头可能的空行
+        head = next((n for n, line in enumerate(lines) if line.strip()), None)
+        if head is None or head + 1 >= len(lines):
+            continue
+        index = lines[head].strip().lstrip("\ufeff")
+        if not index.isdigit() or '-->' not in lines[head + 1] or int(index) not in replacements:
+            continue
+        # 新文本中的空行会截断字幕块，只保留非空行
+        text_lines = [line for line in replacements[int(index)].split("\n") if line.strip()]
+        parts[i] = "\n".join(lines[:head + 2] + text_lines)
+    return "".join(parts)
+
+def iter_patched_srt(file_path: str, get_replacement: Callable[[int], Optional[str]]) -> Iterator[str]:
+    """
+    逐块读取SRT文件并替换字幕块文本，生成输出片段，依次拼接的结果与patch_srt_text相同
+    get_replacement: 按文件顺序对每个带序号的字幕块调用，返回新文本，None表示保持原样
+    """
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        for text, raw in _iter_srt_chunks(f):
+            lines = text.split("\n", 2)
+            head = lines[0].strip().lstrip("\ufeff")
+            replacement = get_replacement(int(head)) if head.isdigit() and len(lines) > 1 and '-->' in lines[1] else None
+            yield raw if replacement is None else patch_srt_text(raw, {int(head): replacement})
+
+# 句末与分句标点，拆分和合并字幕时优先在这些位置断开
+SENTENCE_END = ".?!。！？"
+CLAUSE_END = ",;:，；：、…—"
+CLOSING_MARKS = "\"'”’)]）」』"
+
+def break_penalty(word: str) -> float:
+    """在该词之后断开的代价：句末0，分句处（含省略号）0.5，其余2"""
+    word = word.rstrip(CLOSING_MARKS)
+    if word.endswith(("...", "…")) or word.endswith(tuple(CLAUSE_END)):
+        return 0.5
+    if word.endswith(tuple(SENTENCE_END)):
+        return 0.0
+    return 2.0
+
+def _split_words(words: List[str], max_length: int) -> List[List[str]]:
+    """
+    把词序列切分为最少的段数（每段不超过max_length个词），
+    段数一定时动态规划选择断点：优先在句末、分句标点处断开，并尽量使各段长度接近
+    """
+    n = len(words)
+    k = -(-n // max_length)
+    target = n / k
+    inf = float("inf")
+    best = [[inf] * (n + 1) for _ in range(k + 1)]
+    back = [[0] * (n + 1) for _ in range(k + 1)]
+    best[0][0] = 0.0
+    for j in range(1, k + 1):
+        for i in range(j, n + 1):
+            penalty = break_penalty(words[i - 1]) if i < n else 0.0
+            for start in range(max(j - 1, i - max_length), i):
+                if best[j - 1][start] == inf:
+                    continue
+                cost = best[j - 1][start] + 4 * ((i - start - target) / target) ** 2 + penalty
+                if cost < best[j][i]:
+                    best[j][i], back[j][i] = cost, start
+    segments = []
+    end = n
+    for j in range(k, 0, -1):
+        start = back[j][end]
+        segments.append(words[start:end])
+        end = start
+    return segments[::-1]
+
+def split_proportionally(start_ms: int, end_ms: int, weights: List[int]) -> List[Tuple[int, int]]:
+    """把时间区间按权重（如字符数）分成相邻的若干段"""
+    if not any(weights):
+        weights = [1] * len(weights)
+    total = sum(weights)
+    bounds = [start_ms]
+    acc = 0
+    for weight in weights:
+        acc += weight
+        bounds.append(start_ms + round((end_ms - start_ms) * acc / total))
+    return list(zip(bounds, bounds[1:]))
+
+# 拆分过长的字幕block，按照标点或空格分词拆分
 def split_long_subtitle_blocks(blocks: List[SubtitleBlock], max_length: int = 15) -> List[SubtitleBlock]:
-    new_blocks = []
+    return list(iter_split_long_subtitle_blocks(blocks, max_length))
+
+def iter_split_long_subtitle_blocks(blocks: Iterable[SubtitleBlock], max_length: int = 15) -> Iterator[SubtitleBlock]:
+    """
+    split_long_subtitle_blocks的流式版本，逐块拆分并从1重新编号
+    超过max_length个词的字幕拆成最少的段数，断点优先选在句末和分句标点处，
+    各段的显示时长按字符数分配（语速均匀时与朗读时长一致）
+    """
     index=1
     for block in blocks:
         # count the number of words
         words = block.text.split()
         if len(words) <= max_length:
-            new_blocks.append(SubtitleBlock(index=index, timeline=block.timeline, text=block.text))
+            yield SubtitleBlock(index=index, timeline=block.timeline, text=block.text)
             index += 1
             continue
-        # split the block
-        n_blocks= len(words) // max_length
-        if len(words) % max_length != 0:
-            n_blocks += 1
-        target_length = len(words) // n_blocks
-        block.calc_duration()
-        duration = block.duration
-        for i in range(n_blocks):
-            new_text = " ".join(words[i*target_length:(i+1)*target_length])
-            new_timeline = format_timeline(block.start + i*duration/n_blocks, block.start + (i+1)*duration/n_blocks)
-            new_blocks.append(SubtitleBlock(index=index, timeline=new_timeline, text=new_text))
+        texts = [" ".join(segment) for segment in _split_words(words, max_length)]
+        if block.start_ms is None:
+            # 没有可用的时间轴时各段沿用原时间轴
+            spans = [(None, None)] * len(texts)
+        else:
+            spans = split_proportionally(block.start_ms, block.end_ms, [len(text) for text in texts])
+        for text, (start_ms, end_ms) in zip(texts, spans):
+            yield SubtitleBlock(index=index, timeline=block.timeline if start_ms is None else "", text=text,
+                                start_ms=start_ms, end_ms=end_ms)
             index += 1
-    return new_blocks
 
-def save_srt(file_path: str, blocks: List[SubtitleBlock]):
+def save_srt(file_path: str, blocks: Iterable[SubtitleBlock]):
     """SRT文件保存器"""
     with open(file_path, 'w', encoding='utf-8') as f:
         for block in blocks:
             f.write(f"{block.index}\n{block.timeline}\n{block.text}\n\n")
 
-def merge_subtitles(path_1: str, path_2: str, path_out: str):
-    """合并两个SRT字幕文件"""
-    
-    # load subtitles
-    blocks_1 = parse_srt(path_1)
+def _merged_text(*texts: str) -> str:
+    # 空文本不输出，避免在字幕块中产生空行
+    return "\n".join(text for text in texts if text)
+
+class UnsortedTrackError(ValueError):
+    """流式合并时字幕轨道未按序号或起始时间排序"""
+
+def align_blocks_by_time(blocks_1: List[SubtitleBlock], blocks_2: List[SubtitleBlock], min_overlap_ms: int = 100,
+                         min_overlap_ratio: float = 0.3) -> List[SubtitleBlock]:
+    """
+    按时间区间对齐两条字幕轨道，返回合并后的双语字幕块
+    两条轨道按起始时间归并后单次扫描（已排序时为O(N+M)），时间上相互重叠的块归为一组，
+    一组内可以是一对一、一对多或多对一；只在其中一条轨道出现的块单独成组，不会丢失
+    每组的时间轴优先取第一条轨道的起止范围，序号从1重新编号
+    min_overlap_ms: 重叠不足该时长（或短于该时长的块不足其自身时长）的相邻块视为不相交，
+                    避免因时间轴误差把整段串成一组
+    min_overlap_ratio: 新块与组内结束最晚的块（即与它重叠最多的块）的重叠不足两者中较短一块时长的该比例时也视为不相交，
+                       避免两条轨道在交界处各有少量重叠时经由组的结束时间把前后两组串在一起
+    """
+    # Timsort对已按时间排序的轨道只需线性时间
+    def by_start(blocks):
+        return sorted(blocks, key=lambda b: b.start_ms if b.start_ms is not None else -1)
+    return list(iter_align_blocks_by_time(by_start(blocks_1), by_start(blocks_2), min_overlap_ms, min_overlap_ratio))
+
+def iter_align_blocks_by_time(blocks_1: Iterable[SubtitleBlock], blocks_2: Iterable[SubtitleBlock], min_overlap_ms: int = 100,
+                              min_overlap_ratio: float = 0.3) -> Iterator[SubtitleBlock]:
+    """
+    align_blocks_by_time的流式版本，两条轨道须已按起始时间排序，否则抛出UnsortedTrackError
+    只保留当前一组的文本，内存占用与轨道长度无关
+    """
+    skipped = [0, 0]
+
+    def timed(blocks, track):
+        last_start = None
+        for b in blocks:
+            if b.start_ms is None or b.end_ms is None:
+                skipped[track] += 1
+                continue
+            if last_start is not None and b.start_ms < last_start:
+                raise UnsortedTrackError(f"轨道{track + 1}未按起始时间排序（序号{b.index}）")
+            last_start = b.start_ms
+            yield b.start_ms, b.end_ms, track, b.text
+
+    count = 0
+    group = None  # [轨道1文本, 轨道2文本, 各轨道起止范围, 组内结束最晚的块的起止时间]
+
+    def flushed() -> SubtitleBlock:
+        (start_ms, end_ms) = group[2][0] if group[2][0] else group[2][1]
+        return SubtitleBlock(count, "", _merged_text(" ".join(group[0]), " ".join(group[1])), start_ms, end_ms)
+
+    for start_ms, end_ms, track, text in heapq.merge(timed(blocks_1, 0), timed(blocks_2, 1), key=lambda item: item[0]):
+        if group is not None:
+            # 按起始时间归并，组内结束最晚的块就是与新块重叠最多的块
+            last_start, last_end = group[3]
+            overlap = min(end_ms, last_end) - start_ms
+            shorter = min(end_ms - start_ms, last_end - last_start)
+        if group is None or overlap <= 0 or overlap < min(min_overlap_ms, end_ms - start_ms) \
+                or overlap < min_overlap_ratio * shorter:
+            if group is not None:
+                count += 1
+                yield flushed()
+            group = [[], [], [None, None], (start_ms, end_ms)]
+        group[track].append(text)
+        span = group[2][track]
+        group[2][track] = (start_ms, end_ms) if span is None else (span[0], max(span[1], end_ms))
+        if end_ms > group[3][1]:
+            group[3] = (start_ms, end_ms)
+    if group is not None:
+        count += 1
+        yield flushed()
+    for track, n in enumerate(skipped):
+        if n:
+            print(f"Skipped {n} blocks without valid timeline in track {track + 1}")
+
+def merge_blocks_by_index(blocks_1: List[SubtitleBlock], blocks_2: List[SubtitleBlock]) -> List[SubtitleBlock]:
+    """按相同序号合并两条字幕轨道，只在第二条轨道出现的序号沿用其时间轴"""
     blocks_1 = {block.index: block for block in blocks_1}
-    blocks_2 = parse_srt(path_2)
     blocks_2 = {block.index: block for block in blocks_2}
-
-    # merge subtitles
     new_blocks = []
-    ids_1 = sorted(blocks_1.keys())
-
-    for index in ids_1:
-        block_1 = blocks_1.get(index,None)
-        block_2 = blocks_2.get(index,None)
+    for index in sorted(blocks_1.keys() | blocks_2.keys()):
+        block_1 = blocks_1.get(index, None)
+        block_2 = blocks_2.get(index, None)
         text1 = block_1.text if block_1 else ""
         text2 = block_2.text if block_2 else ""
-        new_block = SubtitleBlock(index=block_1.index, timeline=block_1.timeline, text=f"{text1}\n{text2}")
-        new_blocks.append(new_block)
-    # save new subtitles
-    save_srt(path_out, new_blocks)
+        new_blocks.append(SubtitleBlock(index=index, timeline=(block_1 or block_2).timeline, text=_merged_text(text1, text2)))
+    return new_blocks
+
+def iter_merge_blocks_by_index(blocks_1: Iterable[SubtitleBlock], blocks_2: Iterable[SubtitleBlock]) -> Iterator[SubtitleBlock]:
+    """
+    merge_blocks_by_index的流式版本，两条轨道须按序号严格递增，否则抛出UnsortedTrackError
+    """
+    def ordered(blocks, track):
+        last = None
+        for block in blocks:
+            if last is not None and block.index <= last:
+                raise UnsortedTrackError(f"轨道{track + 1}未按序号递增（序号{block.index}）")
+            last = block.index
+            yield block
+
+    iter_1, iter_2 = ordered(blocks_1, 0), ordered(blocks_2, 1)
+    block_1, block_2 = next(iter_1, None), next(iter_2, None)
+    while block_1 is not None or block_2 is not None:
+        if block_2 is None or (block_1 is not None and block_1.index < block_2.index):
+            yield SubtitleBlock(index=block_1.index, timeline=block_1.timeline, text=_merged_text(block_1.text, ""))
+            block_1 = next(iter_1, None)
+        elif block_1 is None or block_2.index < block_1.index:
+            yield SubtitleBlock(index=block_2.index, timeline=block_2.timeline, text=_merged_text("", block_2.text))
+            block_2 = next(iter_2, None)
+        else:
+            yield SubtitleBlock(index=block_1.index, timeline=block_1.timeline, text=_merged_text(block_1.text, block_2.text))
+            block_1, block_2 = next(iter_1, None), next(iter_2, None)
+
+def merge_subtitles(path_1: str, path_2: str, path_out: str, align: str = "index", min_overlap_ms: int = 100):
+    """
+    合并两个SRT字幕文件
+    align: "index"按相同序号配对（两条轨道切分方式一致时使用）；
+           "time"按时间区间重叠对齐，适用于切分方式不同的两条轨道
+    两条轨道已排序时逐块读取合并，否则整体读入后排序合并；先写入临时文件再替换
+    """
+    if align not in ("index", "time"):
+        raise ValueError(f"未知的对齐方式: {align}")
+    tmp_path = path_out + ".tmp"
+    try:
+        if align == "time":
+            save_srt(tmp_path, iter_align_blocks_by_time(iter_srt(path_1), iter_srt(path_2), min_overlap_ms))
+        else:
+            save_srt(tmp_path, iter_merge_blocks_by_index(iter_srt(path_1), iter_srt(path_2)))
+    except UnsortedTrackError as e:
+        print(f"{e}，改为整体读入后合并")
+        blocks_1, blocks_2 = parse_srt(path_1), parse_srt(path_2)
+        if align == "time":
+            new_blocks = align_blocks_by_time(blocks_1, blocks_2, min_overlap_ms)
+        else:
+            new_blocks = merge_blocks_by_index(blocks_1, blocks_2)
+        save_srt(tmp_path, new_blocks)
+    os.replace(tmp_path, path_out)
 
 def get_context_window(blocks: List[SubtitleBlock], current_index: int, window_size=50) -> str:
-    """获取动态上下文窗口"""
+    """
+    获取动态上下文窗口
+    已弃用：翻译流程改用ContextWindow（整条字幕共用一个滑动窗口），库内不再调用，仅保留以兼容旧调用
+    """
     if not window_size:
         return "<NO_CONTEXT>"
     start = max(0, current_index - window_size)
     end = min(len(blocks), current_index + window_size + 1)
     return " | ".join([block.text for block in blocks[start:end]])
 
+class ContextWindow:
+    '''
+    滑动上下文窗口
+    逐块追加字幕、从头部移出已不需要的字幕，同时维护每块文本和token前缀和，
+    任意位置的窗口token数只需两次查表，流式翻译中整条字幕共用一个窗口，每块只估算一次token
+    位置均为字幕在整条字幕中的位置（从0开始），窗口只覆盖[start, stop)
+    window_size: 当前块前后各取的最大块数，0或None表示不提供上下文
+    Sample:
+    window = ContextWindow(blocks, window_size=5)
+    window.get(10)                  # blocks[5:16]
+    window.get(10, span=4)          # blocks[5:19]，覆盖10~13共4块
+    window.get(10, max_tokens=300)  # 在300 token以内尽量对称地向两侧扩展
+    '''
+    separator = " | "
+
+    def __init__(self, blocks: Iterable[SubtitleBlock] = (), window_size: Optional[int] = 50):
+        self.window_size = window_size
+        self.start = 0      # 窗口内第一块的位置，之前的块已移出
+        self.stop = 0
+        self._base = 0      # _blocks[0]的位置
+        self._blocks: List[SubtitleBlock] = []
+        self._texts: List[str] = []
+        # _token_prefix[k]为_blocks[:k]（含分隔符）的token总数
+        self._token_prefix = [0]
+        for block in blocks:
+            self.append(block)
+
+    def append(self, block: SubtitleBlock):
+        self._blocks.append(block)
+        self._texts.append(block.text)
+        self._token_prefix.append(self._token_prefix[-1] + estimate_tokens(block.text) + 1)
+        self.stop += 1
+
+    def popleft(self):
+        """移出窗口内的第一块"""
+        self.start += 1
+        dead = self.start - self._base
+        if dead > 64 and dead * 2 > len(self._blocks):
+            # 新建列表而不是原地删除，已生成的视图仍引用旧列表
+            self._blocks = self._blocks[dead:]
+            self._texts = self._texts[dead:]
+            self._token_prefix = self._token_prefix[dead:]
+            self._base = self.start
+
+    def view(self, start: Optional[int] = None, stop: Optional[int] = None, window_size: Optional[int] = None) -> "ContextWindow":
+        """
+        返回[start, stop)范围的只读视图，与本窗口共用存储，创建开销与窗口大小无关；
+        本窗口此后追加或移出字幕不影响视图的内容
+        window_size: 视图使用的窗口半径，默认与本窗口相同
+        """
+        window = ContextWindow.__new__(ContextWindow)
+        window.__dict__.update(self.__dict__)
+        window.start = self.start if start is None else max(self.start, start)
+        window.stop = self.stop if stop is None else min(self.stop, stop)
+        if window_size is not None:
+            window.window_size = window_size
+        return window
+
+    def blocks(self, start: int, stop: int) -> List[SubtitleBlock]:
+        """[start, stop)范围内（限于窗口）的字幕块"""
+        return self._blocks[max(self.start, start) - self._base:min(self.stop, stop) - self._base]
+
+    def tokens(self, start: int, end: int) -> int:
+        """[start, end)范围内上下文的token数"""
+        return self._token_prefix[end - self._base] - self._token_prefix[start - self._base]
+
+    def get(self, index: int, span: int = 1, max_tokens: Optional[int] = None) -> str:
+        """
+        获取覆盖[index, index+span)的上下文
+        max_tokens: 上下文token上限，窗口在不超过上限的前提下尽量对称扩展，
+                    上限过小时仅保留待翻译的块本身
+        """
+        if not self.window_size:
+            return "<NO_CONTEXT>"
+        base, first, last = self._base, self.start, self.stop
+        end = min(last, index + span)
+        radius = self.window_size
+        if max_tokens is not None:
+            # 窗口token数随半径单调不减，二分查找满足预算的最大半径
+            prefix = self._token_prefix
+            low, high = 0, radius
+            while low < high:
+                mid = (low + high + 1) // 2
+                if prefix[min(last, end + mid) - base] - prefix[max(first, index - mid) - base] <= max_tokens:
+                    low = mid
+                else:
+                    high = mid - 1
+            radius = low
+        return self.separator.join(self._texts[max(first, index - radius) - base:min(last, end + radius) - base])
+
+@dataclass
+class ContextChunk:
+    '''
+    流式翻译中的一组连续字幕块及其前后的上下文
+    blocks: 本组待翻译的字幕块
+    window: 覆盖blocks及其前后各window_size块的上下文窗口视图
+    position: blocks[0]在整条字幕中的位置（从0开始）
+    上下文与在整条字幕上构造的ContextWindow完全一致
+    '''
+    blocks: List[SubtitleBlock]
+    window: ContextWindow
+    position: int
+
+    @property
+    def neighbors(self) -> List[SubtitleBlock]:
+        """blocks及其前后的上下文字幕块"""
+        return self.window.blocks(self.window.start, self.window.stop)
+
+    @property
+    def offset(self) -> int:
+        """blocks[0]在neighbors中的位置"""
+        return self.position - self.window.start
+
+    def context(self, i: int = 0, span: int = 1, max_tokens: Optional[int] = None) -> str:
+        """覆盖blocks[i:i+span]的上下文，参数含义同ContextWindow.get"""
+        return self.window.get(self.position + i, span, max_tokens)
+
+    def group_blocks(self, group_size: int) -> List[SubtitleBlock]:
+        """本组所在的对齐分组（整条字幕中位置为[k*group_size, (k+1)*group_size)的字幕块）"""
+        start = self.position - self.position % group_size
+        return self.window.blocks(start, start + group_size)
+
+    def group_context(self, group_size: int, radius: Optional[int], max_tokens: Optional[int] = None) -> str:
+        """
+        覆盖本组所在对齐分组的上下文，前后各至多radius块，同一分组内的各组得到逐字节相同的上下文
+        window须包含整个分组及其前后各radius块（iter_context_chunks的window_size不小于radius+group_size）
+        """
+        start = self.position - self.position % group_size
+        window = self.window.view(window_size=radius or 0)
+        return window.get(start, min(group_size, window.stop - start), max_tokens)
+
+def iter_context_chunks(blocks: Iterable[SubtitleBlock], chunk_size: int = 1, window_size: Optional[int] = 50) -> Iterator[ContextChunk]:
+    """
+    把字幕流按chunk_size切成连续的组，每组附带前后各window_size块的上下文窗口
+    整条字幕共用一个随组滑动的ContextWindow，每组只取其视图；
+    只预读window_size块，窗口中至多保留2*window_size+chunk_size块
+    """
+    radius = window_size or 0
+    chunk_size = max(1, chunk_size)
+    source = iter(blocks)
+    window = ContextWindow(window_size=window_size)
+    position = 0    # 下一组的起始位置
+    exhausted = False
+    while True:
+        while window.start < position - radius:
+            window.popleft()
+        while not exhausted and window.stop < position + chunk_size + radius:
+            block = next(source, None)
+            if block is None:
+                exhausted = True
+            else:
+                window.append(block)
+        size = min(chunk_size, window.stop - position)
+        if size <= 0:
+            return
+        yield ContextChunk(window.blocks(position, position + size), window.view(), position)
+        position += size
+
 CMD_FFMPEG_MERGE_TEMPLATE = '''ffmpeg -hwaccel cuda -c:v h264_cuvid -i "{input_path_video}" -vf subtitles="{input_path_srt}" -c:v h264_nvenc  -b:v 8000k -c:a copy "{output_path_video}" -y'''
 CMD_FFMPEG_SPLIT_TEMPLATE = '''ffmpeg -i "{input_path_video}" -c:v copy -c:a copy -f segment -segment_time 290 -reset_timestamps 1 {output_dir}split_%03d.mp4'''
\ No newline at end of file
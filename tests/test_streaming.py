@@ -0,0 +1,62 @@
+import pytest
+
+from streaming import StreamBudgetExceeded, ThinkFilter
+
+
+def feed_all(think_filter: ThinkFilter, chunks):
+    for chunk in chunks:
+        think_filter.feed(chunk)
+    return think_filter
+
+
+def test_think_block_removed():
+    f = feed_all(ThinkFilter(), ["<thi", "nk>嗯", "嗯</th", "ink>", "你好", "世界"])
+    assert f.text == "你好世界"
+    assert f.think_tokens == 3
+
+
+def test_missing_open_tag_is_think():
+    # qwq:32b等模型不输出<think>，直接以推理内容开头并以</think>结束
+    f = feed_all(ThinkFilter(), ["让我", "想想", "</thi", "nk>\n\n", "你好"])
+    assert f.text == "你好"
+    assert f.think_tokens == 4
+
+
+def test_untagged_output_not_charged_to_think_budget():
+    # 不输出推理段的模型，译文长于推理预算时不应中断
+    f = feed_all(ThinkFilter(max_think_tokens=3), ["你好", "世界", "欢迎", "回来"])
+    assert f.text == "你好世界欢迎回来"
+    assert f.think_tokens == 0
+
+
+def test_untagged_output_limited_by_max_tokens():
+    f = ThinkFilter(max_think_tokens=3, max_tokens=3)
+    with pytest.raises(StreamBudgetExceeded):
+        feed_all(f, ["让我", "想想", "这句", "怎么翻"])
+
+
+def test_missing_open_tag_charged_once_confirmed():
+    f = ThinkFilter(max_think_tokens=3)
+    with pytest.raises(StreamBudgetExceeded):
+        feed_all(f, ["让我", "想想", "这句", "怎么翻", "</think>"])
+
+
+def test_untagged_output_reclassified_as_visible():
+    f = feed_all(ThinkFilter(), ["你好", "世界"])
+    assert f.text == "你好世界"
+    assert f.think_tokens == 0
+
+
+def test_text_before_open_tag_is_visible():
+    f = feed_all(ThinkFilter(), ["前言", "<think>嗯</think>", "正文"])
+    assert f.text == "前言正文"
+    assert f.think_tokens == 1
+
+
+def test_separate_reasoning_content():
+    f = ThinkFilter()
+    f.feed("嗯", think=True)
+    f.feed("嗯", think=True)
+    f.feed("你好")
+    assert f.text == "你好"
+    assert f.think_tokens == 2
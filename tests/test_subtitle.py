@@ -0,0 +1,53 @@
+from subtitle import SubtitleBlock, SubtitleTrack, align_blocks_by_time, iter_srt_records, parse_srt_text
+
+REGULAR = "1\n00:00:01,000 --> 00:00:02,500\nHello\n\n2\n00:01:02,000 --> 00:01:04,000\nTwo\nlines\n"
+
+
+def general_parse(content):
+    return [SubtitleBlock(i, t, " ".join(l), s, e, l) for i, t, l, s, e in iter_srt_records(content)]
+
+
+def fields(block):
+    return block.index, block.timeline, block.text, block.lines, block.start_ms, block.end_ms
+
+
+def test_fast_path_matches_general_parser():
+    assert list(map(fields, parse_srt_text(REGULAR))) == list(map(fields, general_parse(REGULAR)))
+
+
+def test_irregular_content_falls_back():
+    blocks = parse_srt_text("1\r\n00:00:01,000 --> 00:00:02,500\r\n Hello \r\n\r\nworld\r\n")
+    assert [(b.index, b.text) for b in blocks] == [(1, "Hello world")]
+
+
+def test_timeline_parsed_on_first_access():
+    block = parse_srt_text(REGULAR)[1]
+    assert block.timeline == "00:01:02,000 --> 00:01:04,000"
+    assert (block.start_ms, block.end_ms) == (62000, 64000)
+    block.end_ms = 65000
+    assert block.timeline == "00:01:02,000 --> 00:01:05,000"
+    assert block.duration == 3.0
+
+
+def test_track_from_lazy_blocks_keeps_no_custom_timeline():
+    track = SubtitleTrack.from_blocks(parse_srt_text(REGULAR))
+    assert list(track.starts) == [1000, 62000]
+    assert track.timelines == {}
+
+
+def timed_block(index, start_ms, end_ms, text):
+    return SubtitleBlock(index, "", text, start_ms, end_ms)
+
+
+def test_align_does_not_chain_through_small_overlaps():
+    track_1 = [timed_block(1, 0, 4050, "A1"), timed_block(2, 4000, 8000, "A2")]
+    track_2 = [timed_block(1, 0, 4000, "b1"), timed_block(2, 3950, 8000, "b2")]
+    aligned = align_blocks_by_time(track_1, track_2)
+    assert [(b.text, b.start_ms, b.end_ms) for b in aligned] == [("A1\nb1", 0, 4050), ("A2\nb2", 4000, 8000)]
+
+
+def test_align_groups_one_to_many():
+    track_1 = [timed_block(1, 0, 6000, "long line")]
+    track_2 = [timed_block(1, 0, 3000, "first"), timed_block(2, 3000, 6000, "second")]
+    aligned = align_blocks_by_time(track_1, track_2)
+    assert [b.text for b in aligned] == ["long line\nfirst second"]
@@ -0,0 +1,19 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from translate_llm import _iter_ordered
+
+
+def test_cancelled_items_are_released():
+    released = []
+
+    def slow(item, submitted_at):
+        time.sleep(0.1)
+        return item
+
+    with ThreadPoolExecutor(1) as executor:
+        results = _iter_ordered(slow, iter(range(10)), executor, 5, on_cancel=released.append)
+        assert next(results) == 0
+        results.close()
+    # 0已产出，1正在执行，其余已提交的任务被取消并释放
+    assert released == [2, 3, 4]
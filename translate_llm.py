@@ -1,70 +1,38 @@
-import json
+import os
 import time
-from dataclasses import dataclass
-from typing import List, Optional
-import requests
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
 
 from tqdm import tqdm
-from subtitle import SubtitleBlock, parse_srt,save_srt,split_long_subtitle_blocks,merge_subtitles,CMD_FFMPEG_MERGE_TEMPLATE, CMD_FFMPEG_SPLIT_TEMPLATE
-
-@dataclass
-class ModelConfigOpenAI:
-    api_url: str = "https://api.siliconflow.cn/v1"
-    model_id: str = "deepseek-ai/DeepSeek-V3"  # 强制指定模型[^1]
-    api_key: str = "YOUR_API_KEY"
-    headers: dict = None
-    
-    def __post_init__(self):
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-
-@dataclass
-class ModelConfigOllama:
-    """Ollama专用配置类"""
-    api_url: str = "http://localhost:11434"  # 默认本地地址[^1]
-    model_id: str = "llama3.2"  # 必须指定模型名称[^1]
-    num_ctx: int = 4096         # 上下文窗口大小[^3]
-    temperature: float = 0.3    # 输出随机性控制[^1]
-    top_p: float = 0.9          # Top-p采样参数[^1]
-    stream: bool = False        # 流式响应开关[^1]
-    keep_alive: str = "5m"      # 模型内存驻留时间[^1]
-    headers: dict = None        # 自定义请求头
-    
-    def __post_init__(self):
-        self.headers = self.headers or {}
-        # 自动添加必要头信息[^3]
-        self.headers.setdefault("Content-Type", "application/json")
-        
-def parse_srt(file_path: str) -> List[SubtitleBlock]:
-    """SRT文件解析器"""
-    blocks = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        current_block = None
-        for line in f:
-            line = line.strip()
-            if line.isdigit():
-                current_block = SubtitleBlock(index=int(line), timeline="", text="")
-            elif '-->' in line:
-                current_block.timeline = line
-            elif line:
-                current_block.text += line + " "
-            elif current_block and current_block.text:
-                current_block.text = current_block.text.strip()
-                blocks.append(current_block)
-                current_block = None
-        if current_block and current_block.text:  # 处理最后未完结块[^3]
-            blocks.append(current_block)
-    return blocks
-
-def get_context_window(blocks: List[SubtitleBlock], current_index: int, window_size=50) -> str:
-    """获取动态上下文窗口"""
-    if not window_size:
-        return "<NO_CONTEXT>"
-    start = max(0, current_index - window_size)
-    end = min(len(blocks), current_index + window_size + 1)
-    return " | ".join([block.text for block in blocks[start:end]])
+from backends import Backend, ModelConfigOllama, ModelConfigOpenAI, OllamaBackend, OpenAIBackend, get_backend
+from prompts import PROMPT_OVERHEAD_TOKENS, PROMPT_VERSION, PrefixLayout, build_glossary_prompt
+from translation_cache import TranslationCache
+from checkpoint import TranslationJournal
+from dedup import DuplicateIndex, SharedTranslation
+from glossary import Glossary
+from segmentation import SentenceUnit, iter_sentence_units
+from metrics import MetricsCollector, RequestMetrics, track
+# 配置类和字幕处理函数已分别移至backends.py和subtitle.py，原先可从本模块导入的名称在此一并导入以兼容旧的导入路径
+from subtitle import (
+    CMD_FFMPEG_MERGE_TEMPLATE, CMD_FFMPEG_SPLIT_TEMPLATE, SubtitleBlock, ContextChunk, _merged_text, count_srt_blocks,
+    estimate_tokens, get_context_window, iter_context_chunks, iter_patched_srt, iter_split_long_subtitle_blocks, iter_srt,
+    merge_subtitles, parse_srt, save_srt, split_long_subtitle_blocks
+)
+from validation import FAILED_MARKER, ValidationRules, check_translation
+
+__all__ = [
+    # 兼容旧的导入路径
+    "CMD_FFMPEG_MERGE_TEMPLATE", "CMD_FFMPEG_SPLIT_TEMPLATE", "ModelConfigOllama", "ModelConfigOpenAI", "SubtitleBlock",
+    "get_context_window", "merge_subtitles", "parse_srt", "save_srt", "split_long_subtitle_blocks",
+    # 本模块的翻译接口
+    "translate_block_openai", "translate_block_ollama", "translate_block", "translate_batch", "iter_srt_translation",
+    "stream_srt_translation", "generate_srt_translation", "re_translate_failed_blocks"
+]
+
+T = TypeVar("T")
+R = TypeVar("R")
 
 def translate_block_openai(
     config: ModelConfigOpenAI,
@@ -73,65 +41,7 @@ def translate_block_openai(
     domain: Optional[str]
 ) -> str:
     """动态翻译单个字幕块"""
-    system_prompt = (
-        f"你是一个资深的{domain or '通用'}领域的字幕翻译专家，严格遵守以下规则：\n"
-        "1. 仅输出简体中文译文\n"
-        "2. 根据上下文参考给出最符合语境的翻译\n"
-        "3. 确保译文语序和表述符合中文正确的语言习惯\n"
-        "4. 自动校正原文中可能存在的的拼写错误\n"
-        "5. 猜想并保持原始文本的风格和语气\n"
-        "6. 专业技术词汇请参考当前领域知识进行翻译\n"
-        f"当前领域：{domain or '通用领域'}"
-        "请严格按要求直接输出中文译文（不要添加任何解释或符号）"
-    )
-    
-    user_prompt = (
-        f"上下文参考：\n{context}\n"
-        f"需要翻译的内容：{block.text}\n")
-    
-    payload = {
-        "model": config.model_id,  # 必填参数[^1]
-        "messages": [
-            {
-                "role": "system",
-                "content": system_prompt  # 系统指令[^2]
-            },
-            {
-                "role": "user",
-                "content": user_prompt
-            }
-        ],
-        "temperature": 0.3,        # 控制随机性[^4]
-        "max_tokens": 1024,        # 支持长上下文[^3]
-        "top_p": 0.9,             # 平衡多样性[^4]
-        "n": 1,                   # 固定生成数量[^1]
-        "frequency_penalty": 0.5   # 减少重复[^4]
-    }
-    
-
-    max_retries = 5
-    for i in range(max_retries):
-        try:
-            response = requests.post(
-                f"{config.api_url}/chat/completions",  # 官方接口路径[^1]
-                headers=config.headers,
-                json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            # 严格提取翻译结果[^2]
-            response_data = response.json()
-            raw_text = response_data['choices'][0]['message']['content'].strip()
-            return raw_text.split("：")[-1].strip()
-        
-        except Exception as e:
-            print(f"Error translating block {block.index}: {str(e)}")
-            if i < max_retries - 1:
-                print("Retrying...")
-                time.sleep(2)
-            else:
-                return block.text + " [TRANSLATION_FAILED]"
+    return OpenAIBackend(config).translate(block, context, domain)
 
 def translate_block_ollama(
     config: ModelConfigOllama,
@@ -140,155 +50,608 @@ def translate_block_ollama(
     domain: Optional[str]
 ) -> str:
     """基于Ollama Chat结构的翻译实现"""
-    system_message = (
-        f"你是一个资深的{domain or '通用'}领域的字幕翻译专家，严格遵守以下规则：\n"
-        "1. 仅输出简体中文译文\n"
-        "2. 根据上下文参考给出最符合语境的翻译\n"
-        "3. 确保译文语序和表述符合中文正确的语言习惯\n"
-        "4. 自动校正原文中可能存在的的拼写错误\n"
-        "5. 猜想并保持原始文本的风格和语气\n"
-        "6. 专业技术词汇请参考当前领域知识进行翻译\n"
-        f"当前领域：{domain or '通用领域'}"
-        "请严格按要求输出译文（不要添加任何解释或符号）"
-    )
-    
-    payload = {
-        "model": config.model_id,   # 必须指定模型名称[^5]
-        "messages": [
-            {
-                "role": "system",
-                "content": system_message  # 通过系统角色传递指令[^5]
-            },
-            {
-                "role": "user",
-                "content": f"上下文参考：{context}\n需翻译：{block.text}"
-            }
-        ],
-        "options": {
-            "temperature": config.temperature,  # 生成随机性控制[^6]
-            "top_p": config.top_p,
-            "num_ctx": config.num_ctx
-        },
-        "stream": False,
-        "keep_alive": config.keep_alive  # 模型驻留控制[^5]
-    }
-    
-    for retry in range(3):
-        try:
-            response = requests.post(
-                f"{config.api_url}/api/chat",  # Chat专用接口[^5]
-                headers=config.headers,
-                json=payload,
-                timeout=60
-            )
-            response.raise_for_status()
-            
-            response_data = response.json()
-            if response_data.get("done", True):
-                text_with_think=response_data['message']['content'].strip()  # 提取核心响应[^5]
-                # remove text between <think> </think> tag
-                text = text_with_think.split("</think>")[-1].strip()
-                return text
-
-
-            raise ValueError("未完成完整响应")
-            
-        except requests.exceptions.RequestException as e:
-            print(f"网络错误 {block.index}:{str(e)}")
-            time.sleep(2 ** retry)
-        except KeyError:
-            print(f"异常响应格式:{response.text[:200]}")
-            break
-            
-    return block.text + " [TRANSLATION_FAILED]"
+    return OllamaBackend(config).translate(block, context, domain)
+
+def _prompt_version(backend: Backend, domain: Optional[str], terms: Optional[Dict[str, str]], batch_size: int = 1) -> str:
+    """
+    缓存键中的提示词版本：模板版本之外，实际发送的系统指令（含后端覆盖的指令和布局中的术语表）、
+    提示词布局和每次请求的块数都会影响译文，一并计入；注入的术语不同时译文也可能不同，同样计入
+    """
+    parts = [PROMPT_VERSION, backend.request_system_prompt(domain, batch_size > 1), repr(backend.layout), f"batch_size={batch_size}"]
+    if terms:
+        parts.append(build_glossary_prompt(dict(sorted(terms.items()))))
+    return "\n".join(parts)
+
+def _cache_get(cache: Optional[TranslationCache], config, block: SubtitleBlock, context: str, domain: Optional[str],
+               terms: Optional[Dict[str, str]] = None, batch_size: int = 1) -> Optional[str]:
+    """查询译文缓存，batch_size为本次运行每次请求的块数"""
+    if cache is None:
+        return None
+    return cache.get(config.model_id, domain, _prompt_version(get_backend(config), domain, terms, batch_size), block.text, context)
+
+def _cache_put(cache: Optional[TranslationCache], config, block: SubtitleBlock, context: str, domain: Optional[str], translated_text: str,
+               terms: Optional[Dict[str, str]] = None, batch_size: int = 1):
+    """写入译文缓存，翻译失败的结果不缓存"""
+    if cache is None or FAILED_MARKER in translated_text:
+        return
+    cache.put(config.model_id, domain, _prompt_version(get_backend(config), domain, terms, batch_size), block.text, translated_text, context)
 
 def translate_block(
     config,
     block: SubtitleBlock,
     context: str,
-    domain: Optional[str]
+    domain: Optional[str],
+    cache: Optional[TranslationCache] = None,
+    terms: Optional[Dict[str, str]] = None
 ) -> str:
-    """根据配置选择翻译函数"""
-    if isinstance(config, ModelConfigOpenAI):
-        return translate_block_openai(config, block, context, domain)
-    elif isinstance(config, ModelConfigOllama):
-        return translate_block_ollama(config, block, context, domain)
+    """
+    翻译单个字幕块，命中缓存时直接返回缓存译文
+    config: 已注册后端的配置对象（ModelConfigOpenAI/ModelConfigOllama/LocalModelConfig等）或Backend实例
+    terms: 注入提示词的术语 {原文: 译文}，通常由Glossary.match得到
+    """
+    cached = _cache_get(cache, config, block, context, domain, terms)
+    if cached is not None:
+        return cached
+
+    translated_text = get_backend(config).translate(block, context, domain, terms)
+
+    _cache_put(cache, config, block, context, domain, translated_text, terms)
+    return translated_text
+
+def translate_batch(
+    config,
+    blocks: List[SubtitleBlock],
+    context: str,
+    domain: Optional[str],
+    terms: Optional[Dict[str, str]] = None
+) -> Optional[List[str]]:
+    """
+    单次请求翻译连续多个字幕块
+    返回与blocks一一对应的译文；请求失败或译文未对齐时返回None，由调用方回退逐块翻译
+    """
+    return get_backend(config).translate_many(blocks, context, domain, terms)
+
+def _repair_block(
+    backend: Backend,
+    block: SubtitleBlock,
+    context: str,
+    domain: Optional[str],
+    rules: ValidationRules,
+    max_rounds: int,
+    metrics: MetricsCollector,
+    file: str,
+    cache: Optional[TranslationCache] = None,
+    cache_context: Optional[str] = None,
+    delay: float = 0.0,
+    queue_wait: float = 0.0,
+    terms: Optional[Dict[str, str]] = None,
+    batch_size: int = 1
+) -> Tuple[str, List[str]]:
+    """重译不合格的字幕块直到通过校验，最多max_rounds次，返回 (最后一次译文, 仍存在的问题)"""
+    for _ in range(max(1, max_rounds)):
+        with track(RequestMetrics(file, block.index, block.index, 1, "repair", queue_wait)) as record:
+            # 不读缓存：缓存中的译文可能正是需要修复的结果
+            translated_text = translate_block(backend, block, context, domain, terms=terms)
+        queue_wait = 0.0
+        problems = check_translation(block.text, translated_text, rules)
+        record.failed = int(bool(problems))
+        metrics.add(record)
+        time.sleep(delay)
+        if not problems:
+            _cache_put(cache, backend, block, cache_context, domain, translated_text, terms, batch_size)
+            break
+    return translated_text, problems
+
+def _iter_ordered(
+    func: Callable[[T, float], R],
+    items: Iterable[T],
+    executor: Optional[ThreadPoolExecutor],
+    max_pending: int,
+    on_cancel: Optional[Callable[[T], None]] = None
+) -> Iterator[R]:
+    """
+    按items的顺序生成func(item, 提交时刻)的结果
+    传入线程池时并发执行，至多max_pending个任务在途，队首完成即产出；未传入时逐个串行执行
+    on_cancel: 提前结束时对未能执行的item调用（如释放该item已登记的资源）
+    """
+    if executor is None:
+        for item in items:
+            yield func(item, time.monotonic())
+        return
+    pending = deque()  # (future, item)
+    try:
+        for item in items:
+            try:
+                future = executor.submit(func, item, time.monotonic())
+            except BaseException:
+                if on_cancel is not None:
+                    on_cancel(item)
+                raise
+            pending.append((future, item))
+            while pending and (len(pending) >= max_pending or pending[0][0].done()):
+                yield pending.popleft()[0].result()
+        while pending:
+            yield pending.popleft()[0].result()
+    finally:
+        # 提前结束（出错或调用方不再读取）时取消尚未开始的任务
+        for future, item in pending:
+            if future.cancel() and on_cancel is not None:
+                on_cancel(item)
+
+def iter_srt_translation(
+    blocks: Iterable[SubtitleBlock],
+    config,
+    domain: Optional[str] = None,
+    delay: float = 0.0,
+    window_size: int = 20,
+    max_workers: int = 1,
+    batch_size: int = 1,
+    cache: Optional[TranslationCache] = None,
+    journal: Optional[TranslationJournal] = None,
+    context_tokens: Optional[int] = None,
+    executor: Optional[ThreadPoolExecutor] = None,
+    max_pending: Optional[int] = None,
+    metrics: Optional[MetricsCollector] = None,
+    file: str = "",
+    total: Optional[int] = None,
+    rules: Optional[ValidationRules] = None,
+    max_rounds: int = 2,
+    dedup: Optional[DuplicateIndex] = None,
+    merge_sentences: bool = False,
+    prefix_layout: Optional[PrefixLayout] = None,
+    glossary: Optional[Glossary] = None
+) -> Iterator[Tuple[SubtitleBlock, str]]:
+    """
+    流式翻译字幕块序列，按原顺序生成 (字幕块, 译文)
+    只保留当前组前后各window_size块的上下文缓冲和至多max_pending组在途请求，内存占用与字幕总数无关；
+    队首的组完成即产出，调用方可以边翻译边写出
+    参数含义同generate_srt_translation，另有：
+    journal: 已打开的断点日志
+    max_pending: 同时提交到线程池的组数上限，默认为max_workers的2倍
+    file: 指标记录中的文件名
+    total: 字幕总数，仅用于打印首尾块提示
+    rules: 传入时逐块校验译文，不合格的立即以相同上下文重译，最多max_rounds次
+    dedup: 重复字幕索引，重复的短句复用第一次出现时的译文，见dedup.DuplicateIndex
+    merge_sentences: 把句子中途断开的相邻字幕合并为完整的句子再翻译，译文按字符数比例拆回原字幕块，
+                     见segmentation.iter_sentence_units；此时上下文窗口、批量、缓存、断点日志和指标中的块数均以句子为单位
+    prefix_layout: 前缀缓存友好的提示词布局，上下文改为按prefix_layout.context_group块对齐的固定窗口，见prompts.PrefixLayout
+    glossary: 术语表，每次请求只注入原文中出现的术语，见glossary.Glossary
+    """
+    backend = get_backend(config).with_layout(prefix_layout) if prefix_layout is not None else get_backend(config)
+    # 共用同一份上下文的分组大小，取batch_size的整数倍，使每个分组恰好包含若干个完整的请求
+    group_size = -(-prefix_layout.context_group // batch_size) * batch_size if prefix_layout is not None else 0
+    if metrics is None:
+        metrics = MetricsCollector(model_id=config.model_id)
+    system_tokens = estimate_tokens(backend.system_prompt(domain, ""))
+
+    def _terms(blocks: List[SubtitleBlock]) -> Optional[Dict[str, str]]:
+        return glossary.match(block.text for block in blocks) if glossary is not None else None
+
+    def _context_budget(blocks: List[SubtitleBlock]) -> Optional[int]:
+        if context_tokens is not None:
+            return context_tokens
+        if backend.context_limit is None:
+            return None
+        # 预留系统指令、术语、待翻译原文、译文输出（按原文3倍估算）及格式开销，共计原文token的4倍
+        source_tokens = sum(estimate_tokens(block.text) for block in blocks)
+        glossary_tokens = estimate_tokens(build_glossary_prompt(_terms(blocks)))
+        return max(0, backend.context_limit - system_tokens - glossary_tokens - 4 * source_tokens - PROMPT_OVERHEAD_TOKENS)
+
+    def _chunk_context(chunk: ContextChunk, i: int, span: int, blocks: List[SubtitleBlock]) -> str:
+        """覆盖chunk.blocks[i:i+span]（即blocks）的上下文；使用前缀布局时为所在分组的固定上下文"""
+        if group_size:
+            return chunk.group_context(group_size, window_size, _context_budget(chunk.group_blocks(group_size)))
+        return chunk.context(i, span, max_tokens=_context_budget(blocks))
+
+    def _call_metrics(blocks: List[SubtitleBlock], kind: str, queue_wait: float) -> RequestMetrics:
+        return RequestMetrics(file, blocks[0].index, blocks[-1].index, len(blocks), kind, queue_wait)
+
+    def _claim(chunks: Iterable[ContextChunk]) -> Iterator[Tuple[ContextChunk, Dict[int, Tuple[SharedTranslation, bool]]]]:
+        # 在提交到线程池之前按顺序登记，保证代表句总是先于复用它的字幕提交
+        for chunk in chunks:
+            yield chunk, dedup.claim([block.text for block in chunk.blocks]) if dedup is not None else {}
+
+    def _release(item: Tuple[ContextChunk, Dict[int, Tuple[SharedTranslation, bool]]]):
+        # 被取消而未执行的任务同样发布（为None），代表句从索引中移除，复用它的字幕改为自行翻译
+        for entry, own in item[1].values():
+            if own:
+                dedup.publish(entry, None)
+
+    def _translate_chunk(item: Tuple[ContextChunk, Dict[int, Tuple[SharedTranslation, bool]]],
+                         submitted_at: float) -> Tuple[List[SubtitleBlock], List[str]]:
+        chunk, claims = item
+        representatives = {i: entry for i, (entry, own) in claims.items() if own}
+        for entry in representatives.values():
+            entry.started = True
+        translated_texts = None
+        try:
+            blocks, translated_texts = _translate_blocks(chunk, claims, submitted_at)
+            return blocks, translated_texts
+        finally:
+            # 出错时也要发布（为None），复用该译文的字幕改为自行翻译；校验本身出错时同样发布，等待者不会一直阻塞
+            for i, entry in representatives.items():
+                reusable = None
+                try:
+                    text = translated_texts[i] if translated_texts is not None else None
+                    if text is not None and FAILED_MARKER not in text and \
+                            not check_translation(chunk.blocks[i].text, text, rules or ValidationRules()):
+                        reusable = text
+                finally:
+                    dedup.publish(entry, reusable)
+
+    def _translate_blocks(chunk: ContextChunk, claims: Dict[int, Tuple[SharedTranslation, bool]],
+                          submitted_at: float) -> Tuple[List[SubtitleBlock], List[str]]:
+        queue_wait = time.monotonic() - submitted_at
+        blocks = chunk.blocks
+
+        def _block_context(i: int) -> str:
+            return _chunk_context(chunk, i, 1, [blocks[i]])
+
+        def _cache_context(i: int) -> Optional[str]:
+            # 仅当缓存键包含上下文时才构造逐块上下文
+            if cache is not None and cache.include_context:
+                return _block_context(i)
+            return None
+
+        # 边界处理[^3]
+        if chunk.position == 0:
+            print(f"Translating first block (Total: {total if total is not None else '?'})")
+        elif total is not None and chunk.position + len(blocks) == total:
+            print(f"Translating final block (Total: {total})")
+
+        translations = {}
+        if journal is not None:
+            for i, block in enumerate(blocks):
+                resumed = journal.lookup(block.index, block.text)
+                if resumed is not None:
+                    translations[i] = resumed
+        resumed_ids = set(translations)
+        metrics.count_hits(file, "journal", len(resumed_ids))
+        if cache is not None:
+            for i, block in enumerate(blocks):
+                if i in translations:
+                    continue
+                cached = _cache_get(cache, backend, block, _cache_context(i), domain, _terms([block]), batch_size)
+                if cached is not None:
+                    translations[i] = cached
+        pending = [i for i in range(len(blocks)) if i not in translations]
+        metrics.count_hits(file, "cache", len(blocks) - len(pending) - len(resumed_ids))
+        reused = 0
+        for i in pending:
+            entry, representative = claims.get(i, (None, True))
+            if not representative:
+                shared = entry.result()
+                if shared is not None:
+                    translations[i] = shared
+                    reused += 1
+        if reused:
+            metrics.count_hits(file, "dedup", reused)
+            # 其余字幕仍需一次请求（多于一块时合并为一次批量请求），全部复用时才省下这次调用
+            metrics.count_saved_calls(file, int(reused == len(pending)))
+            pending = [i for i in pending if i not in translations]
+
+        if len(pending) > 1:
+            pending_blocks = [blocks[i] for i in pending]
+            context = _chunk_context(chunk, pending[0], pending[-1] + 1 - pending[0], pending_blocks)
+            with track(_call_metrics(pending_blocks, "batch", queue_wait)) as record:
+                batch_translations = translate_batch(backend, pending_blocks, context, domain, _terms(pending_blocks))
+            queue_wait = 0.0
+            if batch_translations is None:
+                record.blocks = 0  # 未对齐的块随后逐块翻译，由逐块调用计数
+            metrics.add(record)
+            time.sleep(delay)  # 防止速率限制
+            if batch_translations is not None:
+                for i, translated_text in zip(pending, batch_translations):
+                    translations[i] = translated_text
+                    _cache_put(cache, backend, blocks[i], _cache_context(i), domain, translated_text, _terms([blocks[i]]), batch_size)
+                pending = []
+            else:
+                print(f"Batch {pending_blocks[0].index}-{pending_blocks[-1].index} misaligned, falling back to per-block translation")
+
+        for i in pending:
+            # 获取动态上下文[^3]
+            context = _block_context(i)
+            terms = _terms([blocks[i]])
+            with track(_call_metrics([blocks[i]], "block", queue_wait)) as record:
+                translations[i] = translate_block(backend, blocks[i], context, domain, terms=terms)
+            queue_wait = 0.0
+            record.failed = int(FAILED_MARKER in translations[i])
+            metrics.add(record)
+            _cache_put(cache, backend, blocks[i], _cache_context(i), domain, translations[i], terms, batch_size)
+            time.sleep(delay)  # 防止速率限制
+
+        if rules is not None:
+            for i, block in enumerate(blocks):
+                if check_translation(block.text, translations[i], rules):
+                    repaired, problems = _repair_block(backend, block, _block_context(i), domain, rules, max_rounds,
+                                                       metrics, file, cache, _cache_context(i), delay, terms=_terms([block]),
+                                                       batch_size=batch_size)
+                    # 重译仍不合格时保留原译文，与re_translate_failed_blocks一致
+                    if not problems:
+                        translations[i] = repaired
+
+        if journal is not None:
+            for i, block in enumerate(blocks):
+                if i not in resumed_ids and FAILED_MARKER not in translations[i]:
+                    journal.record(block.index, block.text, translations[i])
+        return blocks, [translations[i] for i in range(len(blocks))]
+
+    own_executor = None
+    if executor is None and max_workers > 1:
+        own_executor = executor = ThreadPoolExecutor(max_workers=max_workers)
+    if max_pending is None:
+        max_pending = 2 * max(1, max_workers)
+    units = deque()  # 已读入、尚未产出的句子单元，与翻译结果按顺序一一对应
+
+    def _unit_blocks(blocks: Iterable[SubtitleBlock]) -> Iterator[SubtitleBlock]:
+        for unit in iter_sentence_units(blocks):
+            units.append(unit)
+            yield unit.block
+
+    if merge_sentences:
+        blocks = _unit_blocks(blocks)
+        total = None  # 句子单元数事先未知
+    # 前缀布局需要整个分组及其前后的上下文，多预读一个分组
+    chunks = iter_context_chunks(blocks, batch_size, window_size + group_size if window_size else window_size)
+    results = _iter_ordered(_translate_chunk, _claim(chunks), executor, max_pending, on_cancel=_release)
+    try:
+        for chunk_blocks, translated_texts in results:
+            if chunk_blocks[-1].end_ms is not None:
+                metrics.set_video_duration(file, chunk_blocks[-1].end_ms)
+            if not merge_sentences:
+                yield from zip(chunk_blocks, translated_texts)
+                continue
+            for translated_text in translated_texts:
+                unit: SentenceUnit = units.popleft()
+                yield from zip(unit.blocks, unit.split(translated_text))
+    finally:
+        results.close()
+        if own_executor is not None:
+            own_executor.shutdown(wait=True, cancel_futures=True)
+
+def stream_srt_translation(
+    input_path: str,
+    output_path: str,
+    config,
+    split_max_words: int = 0,
+    source_output_path: Optional[str] = None,
+    bilingual_output_path: Optional[str] = None,
+    journal_path: Optional[str] = None,
+    **kwargs
+) -> Iterator[Tuple[SubtitleBlock, str]]:
+    """
+    流式的解析、拆分、翻译、合并与写出：逐块读取input_path，按顺序把译文写入output_path并立即刷新，
+    写出后生成 (原文字幕块, 译文)，调用方可在翻译完成前处理已写出的部分（如按block.end_ms压制已完成的片段）
+    split_max_words: 大于0时先按该单词数拆分长字幕（同split_long_subtitle_blocks）
+    source_output_path: 拆分后的原文输出路径
+    bilingual_output_path: 双语字幕输出路径（译文在上、原文在下，同merge_subtitles）
+    journal_path: 断点日志路径
+    其余参数（domain/window_size/batch_size/max_workers/cache/executor/metrics/rules等）传给iter_srt_translation
+    Sample:
+    for block, text in stream_srt_translation("ep01.srt", "ep01.zh.srt", config, bilingual_output_path="ep01.bi.srt", max_workers=8):
+        pass
+    """
+    def source_blocks() -> Iterator[SubtitleBlock]:
+        blocks = iter_srt(input_path)
+        return iter_split_long_subtitle_blocks(blocks, split_max_words) if split_max_words else blocks
+
+    if kwargs.get("total") is None:
+        # 预先逐块计数一遍，只用于提示首尾块
+        kwargs["total"] = sum(1 for _ in source_blocks()) if split_max_words else count_srt_blocks(input_path)
+    kwargs.setdefault("file", input_path)
+
+    with ExitStack() as stack:
+        journal = TranslationJournal(journal_path) if journal_path else None
+        if journal is not None:
+            stack.callback(journal.close)
+            if len(journal):
+                print(f"Resuming from {journal_path} ({len(journal)} blocks recorded)")
+        outputs = [stack.enter_context(open(path, 'w', encoding='utf-8'))
+                   for path in (output_path, source_output_path, bilingual_output_path) if path]
+        output = outputs[0]
+        source_output = outputs[1] if source_output_path else None
+        bilingual_output = outputs[-1] if bilingual_output_path else None
+        for block, translated_text in iter_srt_translation(source_blocks(), config, journal=journal, **kwargs):
+            # 写入结果
+            output.write(f"{block.index}\n{block.timeline}\n{translated_text}\n\n")
+            if source_output is not None:
+                source_output.write(f"{block.index}\n{block.timeline}\n{block.text}\n\n")
+            if bilingual_output is not None:
+                bilingual_output.write(f"{block.index}\n{block.timeline}\n{_merged_text(translated_text, block.text)}\n\n")
+            for f in outputs:
+                f.flush()
+            yield block, translated_text
 
 def generate_srt_translation(
     input_path: str,
     output_path: str,
-    config: ModelConfigOpenAI,
+    config,
     domain: Optional[str] = None,
-    delay: float = 0.1,
-    window_size: int = 20
+    delay: float = 0.0,
+    window_size: int = 20,
+    max_workers: int = 1,
+    batch_size: int = 1,
+    cache: Optional[TranslationCache] = None,
+    journal_path: Optional[str] = None,
+    context_tokens: Optional[int] = None,
+    executor: Optional[ThreadPoolExecutor] = None,
+    progress_desc: Optional[str] = None,
+    metrics: Optional[MetricsCollector] = None,
+    verbose: bool = True,
+    dedup: Optional[DuplicateIndex] = None,
+    merge_sentences: bool = False,
+    prefix_layout: Optional[PrefixLayout] = None,
+    glossary: Optional[Glossary] = None
 ) -> None:
-    """完整的SRT翻译工作流"""
-    all_blocks = parse_srt(input_path)
-    total_blocks = len(all_blocks)
-    
-    with open(output_path, 'w', encoding='utf-8') as f:
-        for idx, block in tqdm(enumerate(all_blocks),total=total_blocks):
-            # 获取动态上下文[^3]
-            context = get_context_window(all_blocks, idx, window_size)
-            
-            # 边界处理[^3]
-            if idx == 0:
-                print(f"Translating first block (Total: {total_blocks})")
-            elif idx == total_blocks - 1:
-                print(f"Translating final block (Total: {total_blocks})")
-                
-            translated_text = translate_block(config, block, context, domain)
-            
+    """
+    完整的SRT翻译工作流
+    config: 已注册后端的配置对象或Backend实例，见backends.py
+    delay: 每次请求后的额外固定等待（秒），速率限制由配置中的rpm/tpm自适应控制
+    max_workers: 同时在途的最大请求数，1为逐块串行翻译；
+                 大于1时使用线程池并发翻译，输出仍按字幕序号顺序写入
+    batch_size: 每次请求翻译的连续字幕块数量，大于1时共享一份上下文，
+                译文未对齐时自动回退为逐块翻译
+    cache: 译文缓存，命中的字幕块不再请求模型
+    journal_path: 断点日志路径，每完成一个字幕块追加一条记录；
+                  中断后以相同参数重新运行时跳过已完成的字幕块
+    context_tokens: 上下文的token上限，窗口在window_size块以内按此上限扩展；
+                    默认对Ollama按num_ctx扣除指令、原文和译文预留后自动计算
+    executor: 多个文件共用的线程池，全局在途请求数由该线程池限制；传入时max_workers应为该线程池的线程数，
+              用于限制本文件提交到线程池排队的任务数
+    progress_desc: 进度条标题，批量处理多个文件时用于区分
+    metrics: 指标汇总（可写入JSONL/Prometheus textfile），多个文件可共用；
+             未传入时仅在结束时打印本次的汇总
+    verbose: 是否逐块打印原文和译文，False时只保留进度条、错误信息和汇总
+    dedup: 重复字幕索引，归一化后相同的短句只请求一次，其余复用其译文；多个文件共用时跨文件复用
+    merge_sentences: 按句子而不是按字幕块翻译：句子中途断开的相邻字幕合并翻译，译文再按字符数比例拆回各字幕块
+    prefix_layout: 提示词布局，连续请求共享逐字节相同的系统指令和上下文前缀，便于服务端复用KV/提示词缓存；
+                   接口返回缓存命中数时汇总中显示cached比例
+    glossary: 术语表，只把每次请求的原文中出现的术语注入提示词，术语译法不再依赖很长的上下文窗口，
+              可相应减小window_size；多个文件共用时各集译法一致
+    字幕逐块读入、边翻译边按顺序写出，内存占用只取决于window_size和在途请求数，见stream_srt_translation
+    """
+    if metrics is None:
+        metrics = MetricsCollector(model_id=config.model_id)
+    total_blocks = count_srt_blocks(input_path)
+    translated = stream_srt_translation(
+        input_path,
+        output_path,
+        config,
+        journal_path=journal_path,
+        domain=domain,
+        delay=delay,
+        window_size=window_size,
+        max_workers=max_workers,
+        batch_size=batch_size,
+        cache=cache,
+        context_tokens=context_tokens,
+        executor=executor,
+        metrics=metrics,
+        total=total_blocks,
+        dedup=dedup,
+        merge_sentences=merge_sentences,
+        prefix_layout=prefix_layout,
+        glossary=glossary
+    )
+    for block, translated_text in tqdm(translated, total=total_blocks, desc=progress_desc):
+        if verbose:
             print(f"Block {block.index}\n原文：{block.text}\n译文：{translated_text}\n")
-            # 写入结果
-            f.write(f"{block.index}\n{block.timeline}\n{translated_text}\n\n")
-            
-            time.sleep(delay)  # 防止速率限制
+
+    if cache is not None:
+        print(f"Cache stats: {cache.stats()}")
+    print(metrics.format_summary(input_path))
+
 
 def re_translate_failed_blocks(
     rough_path: str,
     source_path: str,
     output_path: str,
-    config: ModelConfigOpenAI,
+    config,
     domain: Optional[str] = None,
-    delay: float = 0.1,
-    window_size: int = 20
-) -> None:
-    """重新翻译失败的字幕块"""
-    rough_blocks = parse_srt(rough_path)
-    source_blocks = parse_srt(source_path)
-    
-    dict_id2block = {block.index: block for block in rough_blocks}
-
-    # Find failed blocks in rough_blocks
-    failed_blocks = [block for block in rough_blocks if "[TRANSLATION_FAILED]" in block.text]
-    print(f"Found {len(failed_blocks)} failed blocks in {rough_path}")
-
-    for failed_block in tqdm(failed_blocks):
-        # 获取动态上下文[^3]
-        context = get_context_window(source_blocks, failed_block.index, window_size)
-        
-        translated_text = translate_block(config, failed_block, context, domain)
-        
-        print(f"Block {failed_block.index}\n原文：{failed_block.text}\n译文：{translated_text}\n")
-        
-        # replace failed block in rough_blocks with new translation
-        id_failed_block = failed_block.index
-        dict_id2block[id_failed_block].text = translated_text
-
-        # time.sleep(delay)  # 防止速率限制
-   
-    with open(output_path, 'w', encoding='utf-8') as f:
-        for block in rough_blocks:
-            f.write(f"{block.index}\n{block.timeline}\n{block.text}\n\n")
-            
+    delay: float = 0.0,
+    window_size: int = 20,
+    cache: Optional[TranslationCache] = None,
+    max_workers: int = 1,
+    max_rounds: int = 2,
+    rules: ValidationRules = ValidationRules(),
+    executor: Optional[ThreadPoolExecutor] = None,
+    metrics: Optional[MetricsCollector] = None,
+    verbose: bool = True,
+    glossary: Optional[Glossary] = None
+) -> Dict[int, List[str]]:
+    """
+    校验并修复译文：找出失败、为空、未翻译、过长或残留<think>的字幕块，
+    以原文中的相邻字幕为上下文重新翻译，只替换这些字幕块的文本，其余内容原样保留
+    max_workers: 并发重译的请求数；传入executor时使用共享线程池，max_workers应为其线程数
+    max_rounds: 每个字幕块最多重译的次数，重译后仍不合格的保留原译文
+    glossary: 术语表，重译时注入原文中出现的术语
+    返回修复后仍不合格的 {序号: 问题列表}
+    原文与译文均逐块读取（须按序号递增），修复结果按顺序写入临时文件后替换output_path，可与rough_path相同
+    """
+    backend = get_backend(config)
+    if metrics is None:
+        metrics = MetricsCollector(model_id=config.model_id)
+    bad = {}
+    found = Counter()
+
+    def _bad_blocks() -> Iterator[Tuple[ContextChunk, List[str]]]:
+        """按序号对照原文与译文，生成不合格的字幕块及其上下文"""
+        rough = iter_srt(rough_path)
+        translated = next(rough, None)
+        for chunk in iter_context_chunks(iter_srt(source_path), 1, window_size):
+            block = chunk.blocks[0]
+            while translated is not None and translated.index < block.index:
+                translated = next(rough, None)
+            if translated is None or translated.index != block.index:
+                problems = ["missing"]
+            else:
+                problems = check_translation(block.text, translated.text, rules)
+            if problems:
+                found.update(problems)
+                yield chunk, problems
+
+    def _repair(item: Tuple[ContextChunk, List[str]], submitted_at: float) -> Tuple[int, Optional[str], List[str]]:
+        chunk, problems = item
+        block = chunk.blocks[0]
+        # 译文中缺失的字幕块无法原位替换，不重译，仍保留在返回结果中
+        if "missing" in problems:
+            return block.index, None, problems
+        # 上下文按原文中的位置取相邻字幕，而不是SRT序号
+        context = chunk.context()
+        cache_context = context if cache is not None and cache.include_context else None
+        terms = glossary.match([block.text]) if glossary is not None else None
+        translated_text, problems = _repair_block(backend, block, context, domain, rules, max_rounds, metrics, source_path,
+                                                  cache, cache_context, delay, time.monotonic() - submitted_at, terms)
+        if verbose:
+            print(f"Block {block.index}\n原文：{block.text}\n译文：{translated_text}\n")
+        return block.index, translated_text, problems
+
+    own_executor = None
+    if executor is None and max_workers > 1:
+        own_executor = executor = ThreadPoolExecutor(max_workers=max_workers)
+    max_pending = 2 * max(1, max_workers)
+    repairs = _iter_ordered(_repair, _bad_blocks(), executor, max_pending)
+    ready = {}  # 已完成、尚未写入的修复 {序号: 新译文}，仍不合格的为None
+    repaired = 0
+
+    def _take(result: Tuple[int, Optional[str], List[str]]):
+        index, translated_text, problems = result
+        if problems:
+            bad[index] = problems
+        ready[index] = None if problems else translated_text
+
+    def _replacement(index: int) -> Optional[str]:
+        nonlocal repaired
+        # 修复结果按原文顺序产出，读到序号不小于index的结果即可确定index是否需要替换
+        while index not in ready and (not ready or max(ready) < index):
+            result = next(repairs, None)
+            if result is None:
+                break
+            _take(result)
+        replacement = ready.pop(index, None)
+        repaired += replacement is not None
+        return replacement
+
+    tmp_path = output_path + ".tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for piece in iter_patched_srt(rough_path, _replacement):
+                f.write(piece)
+        # 译文末尾之后的字幕块（均为missing）
+        for result in repairs:
+            _take(result)
+    finally:
+        repairs.close()
+        if own_executor is not None:
+            own_executor.shutdown(wait=True, cancel_futures=True)
+    os.replace(tmp_path, output_path)
+    print(f"Found bad blocks in {rough_path}: {dict(found)}")
+    print(f"Repaired {repaired} blocks, {len(bad)} still bad")
+    return bad
 
 
 if __name__ == "__main__":
-    # split long subtitle blocks
-    raw_blocks = parse_srt("acis2507\en_raw.srt")
-    split_blocks = split_long_subtitle_blocks(raw_blocks, max_length=15)
-    save_srt("acis2507\en.srt", split_blocks)
+    from batch_translate import EpisodeJob, run_batch
 
     # # 初始化配置
 
@@ -308,40 +671,12 @@ if __name__ == "__main__":
         stream=False,
         keep_alive="10m"
     )
-    
-    # 执行翻译流程
-    generate_srt_translation(
-        input_path="acis2507\en.srt",
-        output_path="acis2507\ch_rough_db.srt",
-        config=model_config,
-        domain="民用航空",
-        delay=0.0,
-        window_size=5
-    )
 
-    # 重新翻译失败的字幕块
-    re_translate_failed_blocks(
-        rough_path="acis2507\ch_rough_db.srt",
-        source_path="acis2507\en.srt",
-        output_path="acis2507\ch_db.srt",
-        config=model_config,
+    # 拆分长字幕、翻译、重新翻译失败块、合并双语字幕，多集处理见batch_translate.py
+    run_batch(
+        [EpisodeJob(name="acis2507", srt_path="acis2507/en_raw.srt", output_dir="acis2507", video_path="acis2507/acis2507.mp4")],
+        model_config,
         domain="民用航空",
-        delay=0.0,
         window_size=5
     )
-    # merge subtitles
-    merge_subtitles("acis2507\ch_db.srt", "acis2507\en.srt", "acis2507\merged.srt")
-
-    cmd_merge = CMD_FFMPEG_MERGE_TEMPLATE.format(
-        input_path_video="acis2507/acis2507.mp4",
-        input_path_srt="acis2507/merged.srt",
-        output_path_video="acis2507/acis2507_ch_en.mp4"
-    )
-    print(cmd_merge)
-
-    cmd_split = CMD_FFMPEG_SPLIT_TEMPLATE.format(
-        input_path_video="acis2507/acis2507_ch_en.mp4",
-        output_dir="acis2507/"
-    )
-    print(cmd_split)
-    print("All done!")
\ No newline at end of file
+    print("All done!")
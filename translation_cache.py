@@ -0,0 +1,135 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+
+class TranslationCache:
+    '''
+    基于SQLite的持久化译文缓存
+    键为(model_id, 领域, 提示词版本, 原文, 可选上下文)的哈希，
+    相同字幕在重跑或重新切分后可直接复用，无需再次请求模型
+    max_entries: 最大缓存条数，超出后按最近访问时间淘汰
+    max_age: 条目最长保留秒数，None表示不过期
+    include_context: 是否将上下文纳入缓存键
+    access_batch: 命中后的访问时间（用于淘汰）先在内存中累积，满该条数或写入、淘汰、关闭时批量写回
+    '''
+    def __init__(
+        self,
+        path: str = "translation_cache.sqlite",
+        max_entries: Optional[int] = 200000,
+        max_age: Optional[float] = None,
+        include_context: bool = False,
+        access_batch: int = 256
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.include_context = include_context
+        self.access_batch = access_batch
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._accessed: Dict[str, float] = {}  # 尚未写回的访问时间 {键: 时间}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "key TEXT PRIMARY KEY, "
+            "translation TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON translations(accessed_at)")
+        self._conn.commit()
+        self.evict()
+
+    def make_key(self, model_id: str, domain: Optional[str], prompt_version: str, text: str, context: Optional[str] = None) -> str:
+        """计算缓存键"""
+        parts = [model_id, domain or "", prompt_version, text]
+        if self.include_context:
+            parts.append(context or "")
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, model_id: str, domain: Optional[str], prompt_version: str, text: str, context: Optional[str] = None) -> Optional[str]:
+        """查询译文，未命中返回None"""
+        key = self.make_key(model_id, domain, prompt_version, text, context)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT translation, created_at FROM translations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age is not None and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self._accessed[key] = now
+            if len(self._accessed) >= self.access_batch:
+                self._write_accessed()
+                self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, model_id: str, domain: Optional[str], prompt_version: str, text: str, translation: str, context: Optional[str] = None):
+        """写入译文"""
+        key = self.make_key(model_id, domain, prompt_version, text, context)
+        now = time.time()
+        with self._lock:
+            self._write_accessed()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations (key, translation, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, translation, now, now)
+            )
+            self._conn.commit()
+            self._puts += 1
+            # 每写入一定数量后检查一次淘汰，避免每次写入都扫描表
+            check_eviction = self._puts % 1000 == 0
+        if check_eviction:
+            self.evict()
+
+    def _write_accessed(self):
+        """批量写回累积的访问时间，由调用方持锁并提交"""
+        if self._accessed:
+            self._conn.executemany(
+                "UPDATE translations SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._accessed.items()]
+            )
+            self._accessed.clear()
+
+    def evict(self):
+        """按过期时间和容量上限淘汰旧条目"""
+        with self._lock:
+            self._write_accessed()
+            if self.max_age is not None:
+                self._conn.execute("DELETE FROM translations WHERE created_at < ?", (time.time() - self.max_age,))
+            if self.max_entries is not None:
+                count = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+                if count > self.max_entries:
+                    self._conn.execute(
+                        "DELETE FROM translations WHERE key IN "
+                        "(SELECT key FROM translations ORDER BY accessed_at ASC LIMIT ?)",
+                        (count - self.max_entries,)
+                    )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def stats(self) -> dict:
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self)
+        }
+
+    def close(self):
+        with self._lock:
+            self._write_accessed()
+            self._conn.commit()
+            self._conn.close()
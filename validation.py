@@ -0,0 +1,66 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, List
+
+from subtitle import CJK_PATTERN, SubtitleBlock
+
+FAILED_MARKER = "[TRANSLATION_FAILED]"
+THINK_LEAK_PATTERN = re.compile(r"</?think>", re.IGNORECASE)
+LATIN_PATTERN = re.compile(r"[A-Za-z]")
+
+
+@dataclass
+class ValidationRules:
+    '''
+    译文检查规则
+    max_length_ratio: 译文字符数超过 原文字符数*该倍数+length_slack 时视为过长（常见于模型附带解释或重复输出）
+    min_cjk_ratio: 原文含min_latin_letters个以上拉丁字母时，译文中中日文字符占全部字母类字符的最低比例，
+                   低于该比例视为未翻译
+    '''
+    max_length_ratio: float = 3.0
+    length_slack: int = 20
+    min_latin_letters: int = 8
+    min_cjk_ratio: float = 0.3
+
+
+def check_translation(source: str, translation: str, rules: ValidationRules = ValidationRules()) -> List[str]:
+    """检查单条译文，返回问题列表（empty/failed/think/untranslated/too_long），合格时为空列表"""
+    problems = []
+    text = translation.strip()
+    if FAILED_MARKER in text:
+        problems.append("failed")
+        text = text.replace(FAILED_MARKER, "").strip()
+    if not text:
+        problems.append("empty")
+        return problems
+    if THINK_LEAK_PATTERN.search(text):
+        problems.append("think")
+    if len(LATIN_PATTERN.findall(source)) >= rules.min_latin_letters and "failed" not in problems:
+        cjk = len(CJK_PATTERN.findall(text))
+        letters = cjk + len(LATIN_PATTERN.findall(text))
+        if text == source.strip() or (letters and cjk / letters < rules.min_cjk_ratio):
+            problems.append("untranslated")
+    if len(text) > len(source) * rules.max_length_ratio + rules.length_slack:
+        problems.append("too_long")
+    return problems
+
+
+def find_bad_translations(
+    source_blocks: List[SubtitleBlock],
+    translated_blocks: List[SubtitleBlock],
+    rules: ValidationRules = ValidationRules()
+) -> Dict[int, List[str]]:
+    """
+    按SRT序号对照原文与译文，返回 {序号: 问题列表}
+    译文中缺失的序号记为missing
+    """
+    translated = {block.index: block.text for block in translated_blocks}
+    bad = {}
+    for block in source_blocks:
+        if block.index not in translated:
+            bad[block.index] = ["missing"]
+            continue
+        problems = check_translation(block.text, translated[block.index], rules)
+        if problems:
+            bad[block.index] = problems
+    return bad